@@ -0,0 +1,106 @@
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def async_cached(
+    ttl: float = 3600,
+    maxsize: int = 128,
+    key: Optional[Callable] = None,
+    cache_if: Optional[Callable] = None,
+    coalesce_if: Optional[Callable] = None,
+):
+    """Кэширующий декоратор для ``async def`` функций.
+
+    В отличие от ``functools.lru_cache`` хранит результат, а не объект
+    корутины. Записи живут ``ttl`` секунд, при превышении ``maxsize``
+    вытесняется давно не использованная запись. Одновременные вызовы с
+    одинаковым ключом ждут одну общую задачу (single-flight).
+
+    ``key`` строит ключ из аргументов вызова, ``cache_if`` решает, можно ли
+    кэшировать результат (например, не кэшировать ``None``), ``coalesce_if`` -
+    можно ли присоединить вызов к одновременному (нельзя, если у вызова свой
+    обратный вызов прогресса). Каждый вызывающий получает свою копию
+    результата. ``refresh(...)`` вызывает функцию в обход кэша и сохраняет
+    новый результат.
+    """
+
+    def decorator(func):
+        entries: OrderedDict = OrderedDict()
+        in_flight: dict = {}
+        counters = {"hits": 0, "misses": 0, "coalesced": 0}
+
+        def make_key(args, kwargs):
+            if key is not None:
+                return key(*args, **kwargs)
+            return args, tuple(sorted(kwargs.items()))
+
+        def store(cache_key, task: asyncio.Task):
+            if in_flight.get(cache_key) is task:
+                del in_flight[cache_key]
+            if task.cancelled() or task.exception() is not None:
+                return
+            result = task.result()
+            if cache_if is not None and not cache_if(result):
+                return
+            entries[cache_key] = (time.monotonic() + ttl, result)
+            entries.move_to_end(cache_key)
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+
+        def start(cache_key, args, kwargs, shared: bool) -> asyncio.Task:
+            counters["misses"] += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            if shared:
+                in_flight[cache_key] = task
+            task.add_done_callback(lambda t: store(cache_key, t))
+            return task
+
+        async def result_of(task: asyncio.Task):
+            # shield: отмена одного из ожидающих не отменяет общий вызов.
+            # Копия - чтобы изменения у одного вызывающего не попали в кэш
+            return copy.deepcopy(await asyncio.shield(task))
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = make_key(args, kwargs)
+
+            entry = entries.get(cache_key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    entries.move_to_end(cache_key)
+                    counters["hits"] += 1
+                    return copy.deepcopy(entry[1])
+                del entries[cache_key]
+
+            shared = coalesce_if is None or coalesce_if(*args, **kwargs)
+            task = in_flight.get(cache_key) if shared else None
+            if task is not None:
+                counters["coalesced"] += 1
+            else:
+                task = start(cache_key, args, kwargs, shared)
+            return await result_of(task)
+
+        async def refresh(*args, **kwargs):
+            cache_key = make_key(args, kwargs)
+            entries.pop(cache_key, None)
+            return await result_of(start(cache_key, args, kwargs, shared=False))
+
+        def cache_clear():
+            entries.clear()
+
+        def cache_info() -> dict:
+            return {**counters, "size": len(entries), "in_flight": len(in_flight)}
+
+        wrapper.refresh = refresh
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_info = cache_info
+        return wrapper
+
+    return decorator
@@ -0,0 +1,256 @@
+"""Сквозной бенчмарк публикации на локальных заглушках OpenAI, OMDb и Telegram.
+
+Прогоняет настоящие пути бота - публикацию по расписанию
+(``publish_scheduled_post``), генерацию рецензии по запросу админа
+(``process_custom_review``) и ручную публикацию (``publish_now_handler``) -
+и пишет p50/p99 задержки и посты в секунду в JSON.
+
+Запуск из корня проекта: python benchmarks/bench_publish.py
+
+Настройки (переменные окружения):
+    BENCH_ITERATIONS        операций на каждый путь (по умолчанию 50)
+    BENCH_CONCURRENCY       одновременных операций (4)
+    BENCH_OPENAI_LATENCY    средняя задержка заглушки OpenAI, с (0.05)
+    BENCH_OPENAI_ERROR_RATE доля ответов 500 от OpenAI (0)
+    BENCH_OMDB_LATENCY      задержка OMDb, с (0.01)
+    BENCH_OMDB_ERROR_RATE   доля ответов 503 от OMDb (0)
+    BENCH_OMDB_POSTER_NA    доля фильмов без постера (0)
+    BENCH_TG_LATENCY        задержка Telegram, с (0.01)
+    BENCH_TG_ERROR_RATE     доля ответов 429 от Telegram (0)
+    BENCH_REVIEW_WORDS      длина рецензии в словах (120)
+    BENCH_OPENAI_STREAM_DELAY пауза между фрагментами потокового ответа, с (0)
+    BENCH_SEND_QUEUE        1 - отправка через очередь с лимитами Telegram (0)
+    BENCH_OUTPUT            файл результатов (bench_publish.json)
+    BENCH_LOG_LEVEL         уровень логов бота во время прогона (ERROR)
+    PREFETCH_BUFFER_SIZE    буфер предзагрузки (0 - каждый пост готовится на месте)
+"""
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeOmdb, FakeOpenAI, FakeTelegram
+
+ADMIN_BASE_ID = 1000
+
+# Переменные окружения с путями файлов бота -> имя файла во временном каталоге
+BOT_FILES = {
+    "HISTORY_DB_FILE": "movies_history.sqlite3",
+    "OMDB_CACHE_FILE": "omdb_cache.sqlite3",
+    "REVIEW_DB_FILE": "reviews.sqlite3",
+    "POSTER_DIR": "posters",
+    "POSTER_DB_FILE": "posters.sqlite3",
+    "STATE_SNAPSHOT_FILE": "bot_state.json",
+    "STATE_JOURNAL_FILE": "bot_state.journal",
+    "CHANNELS_FILE": "channels.json",
+    "CATALOG_FILE": "imdb_catalog.bin",
+    "TITLE_INDEX_FILE": "title_index.sqlite3",
+}
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def admin_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "admin"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "admin"},
+            "text": text,
+        },
+    }
+
+
+async def run_path(name: str, operation, iterations: int, concurrency: int) -> dict:
+    """Выполняет ``operation(worker, index)`` ``iterations`` раз в ``concurrency`` потоков."""
+    latencies, errors = [], 0
+    counter = iter(range(iterations))
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                ok = await operation(worker_id, index)
+            except Exception as e:
+                print(f"{name}: ошибка {type(e).__name__}: {e}", file=sys.stderr)
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if ok is False:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "iterations": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "posts_per_sec": round((iterations - errors) / elapsed, 2) if elapsed else 0.0,
+    }
+    print(
+        f"{name:<24} p50 {result['p50_ms']:>8.2f} мс  p99 {result['p99_ms']:>8.2f} мс  "
+        f"{result['posts_per_sec']:>8.2f} пост/с  ошибок {errors}"
+    )
+    return result
+
+
+async def bench():
+    iterations = int(os.getenv("BENCH_ITERATIONS", "50"))
+    concurrency = int(os.getenv("BENCH_CONCURRENCY", "4"))
+    output = os.path.abspath(os.getenv("BENCH_OUTPUT", "bench_publish.json"))
+
+    openai_fake = FakeOpenAI(
+        latency=env_float("BENCH_OPENAI_LATENCY", 0.05),
+        error_rate=env_float("BENCH_OPENAI_ERROR_RATE", 0),
+        review_words=int(os.getenv("BENCH_REVIEW_WORDS", "120")),
+        stream_delay=env_float("BENCH_OPENAI_STREAM_DELAY", 0),
+    )
+    omdb_fake = FakeOmdb(
+        latency=env_float("BENCH_OMDB_LATENCY", 0.01),
+        error_rate=env_float("BENCH_OMDB_ERROR_RATE", 0),
+        poster_na=env_float("BENCH_OMDB_POSTER_NA", 0),
+    )
+    telegram_fake = FakeTelegram(
+        latency=env_float("BENCH_TG_LATENCY", 0.01),
+        error_rate=env_float("BENCH_TG_ERROR_RATE", 0),
+    )
+
+    # Бот пишет свои файлы (история, кэш, состояние) во временный каталог по
+    # абсолютным путям, а текущим остается корень проекта: styles.json читается
+    # оттуда, иначе бенчмарк мерил бы запасные стили и другой PROMPT_VERSION
+    workdir = tempfile.mkdtemp(prefix="bench-publish-")
+    os.chdir(ROOT)
+    os.environ.update({
+        name: os.path.join(workdir, filename) for name, filename in BOT_FILES.items()
+    })
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "OPENAI_API_KEY": "sk-bench",
+        "OMDB_API_KEY": "bench",
+        "CHANNEL_ID": "-1001",
+        "ADMINS": ",".join(str(ADMIN_BASE_ID + i) for i in range(concurrency)),
+        "OPENAI_API_BASE": await openai_fake.start() + "/v1",
+        "OMDB_BASE_URL": await omdb_fake.start() + "/",
+        "TELEGRAM_API_BASE": await telegram_fake.start(),
+    })
+    os.environ.setdefault("PREFETCH_BUFFER_SIZE", "0")
+
+    import main
+    from main import AdminStates
+
+    # Логи бота на каждой операции заглушили бы отчет
+    logging.getLogger().setLevel(os.getenv("BENCH_LOG_LEVEL", "ERROR"))
+
+    if os.getenv("BENCH_SEND_QUEUE") == "1":
+        main.outbound.start()
+    await main.omdb.start()
+    await main.posters.start()
+
+    def fsm(user_id: int):
+        return main.dp.fsm.get_context(bot=main.bot, chat_id=user_id, user_id=user_id)
+
+    async def scheduled(worker_id: int, index: int):
+        before = main.history.count()
+        await main.publish_scheduled_post()
+        return main.history.count() > before
+
+    async def custom_review(worker_id: int, index: int):
+        user_id = ADMIN_BASE_ID + worker_id
+        state = fsm(user_id)
+        await state.set_state(AdminStates.custom_review)
+        # Уникальный запрос - чтобы мерить генерацию, а не кэш
+        await main.dp.feed_raw_update(main.bot, admin_update(index + 1, user_id, f"фильм про учителя {index}"))
+        return await state.get_state() == AdminStates.review_ready.state
+
+    async def publish_now(worker_id: int, index: int):
+        user_id = ADMIN_BASE_ID + worker_id
+        state = fsm(user_id)
+        await state.set_state(AdminStates.review_ready)
+        await state.update_data(
+            movie={"imdb_id": f"tt{9000000 + index:07d}", "title": f"Ручной {index}", "year": 2001, "plot": "Сюжет."},
+            review="Короткая рецензия для ручной публикации.",
+        )
+        before = main.history.count()
+        await main.dp.feed_raw_update(main.bot, admin_update(100000 + index, user_id, "🚀 Опубликовать сейчас"))
+        return main.history.count() > before
+
+    results = {}
+    try:
+        results["publish_scheduled_post"] = await run_path("publish_scheduled_post", scheduled, iterations, concurrency)
+        results["process_custom_review"] = await run_path("process_custom_review", custom_review, iterations, concurrency)
+        results["publish_now_handler"] = await run_path("publish_now_handler", publish_now, iterations, concurrency)
+    finally:
+        await main.prefetcher.close()
+        await main.publish_pipeline.drain()
+        await main.publish_now_pipeline.drain()
+        await main.outbound.close()
+        await main.omdb.close()
+        await main.posters.close()
+        await main.reviews.close()
+        await main.bot.session.close()
+        main.omdb.cache.close()
+        main.history.close()
+        for fake in (openai_fake, omdb_fake, telegram_fake):
+            await fake.close()
+
+    report = {
+        "date": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "prompt_version": main.PROMPT_VERSION,
+        "styles": sorted(main.STYLE_DESCRIPTIONS),
+        "config": {
+            key: value for key, value in os.environ.items()
+            if key.startswith("BENCH_") or key == "PREFETCH_BUFFER_SIZE"
+        },
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "paths": results,
+        "fakes": {
+            "openai": openai_fake.stats,
+            "omdb": omdb_fake.stats,
+            "telegram": {**telegram_fake.stats, "methods": telegram_fake.methods},
+        },
+        "send_queue": main.outbound.summary(),
+        "posters": main.posters.stats,
+        "llm_tokens": main.token_ledger.day_total(),
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,52 @@
+"""Микро-бенчмарк экранирования MarkdownV2 и сборки постов.
+
+Запуск из корня проекта: python benchmarks/bench_render.py
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import MD_SPECIAL_CHARS, escape_md, render_post
+
+MOVIE = {
+    "title": "Зеленая миля (The Green Mile)",
+    "year": 1999,
+    "plot": "Фильм повествует о тюремном страже Поле Эджкомбе, который работает в крыле смертной казни. " * 3,
+}
+MD_ESCAPE_TABLE = str.maketrans({char: "\\" + char for char in MD_SPECIAL_CHARS})
+REVIEW = "Сильная драма о милосердии и вине! Актерская игра - на высоте (особенно Майкл Кларк Дункан). " * 12
+
+
+def escape_md_regex(text: str) -> str:
+    # Прежняя реализация: регулярное выражение собирается заново на каждом вызове
+    escape_chars = '_*[]()~`>#+-=|{}.!'
+    return re.sub(f'([{"".join(re.escape(c) for c in escape_chars)}])', r'\\\1', str(text))
+
+
+def bench(name: str, func, iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32} {iterations / elapsed:>12,.0f} оп/с  {elapsed / iterations * 1e6:>8.2f} мкс/оп")
+
+
+def main():
+    iterations = int(os.getenv("BENCH_ITERATIONS", "20000"))
+    bench("escape_md (regex, старый)", lambda: escape_md_regex(REVIEW), iterations)
+    bench("escape_md (str.translate)", lambda: REVIEW.translate(MD_ESCAPE_TABLE), iterations)
+    bench("escape_md (компилированный)", lambda: escape_md(REVIEW), iterations)
+    bench("render_post scheduled/trim", lambda: render_post("scheduled", MOVIE, REVIEW, "драма", "default"), iterations)
+    bench("render_post custom/trim", lambda: render_post("custom", MOVIE, REVIEW, "драма", "default"), iterations)
+    bench(
+        "render_post custom/split",
+        lambda: render_post("custom", MOVIE, REVIEW, "драма", "default", layout="split"),
+        iterations
+    )
+
+
+if __name__ == "__main__":
+    main()
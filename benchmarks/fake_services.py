@@ -0,0 +1,238 @@
+"""Локальные заглушки OpenAI, OMDb и Telegram Bot API для бенчмарков.
+
+Каждая заглушка - aiohttp-сервер с настраиваемой задержкой, долей ошибок
+и формой ответов. Запросы подсчитываются в ``stats``.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+PLOT = "Скромный учитель обнаруживает, что его ученики хранят общую тайну, и пытается понять, кому можно доверять."
+REVIEW_SENTENCE = "Режиссер уверенно держит ритм, а актеры играют сдержанно и точно."
+# Минимальный заголовок JPEG - для проверки загрузчика постеров этого достаточно
+POSTER_BYTES = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+class FakeService:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0}
+        self._runner = None
+        self.port = None
+
+    def build_app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def start(self, host: str = "127.0.0.1") -> str:
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self) -> bool:
+        """Имитирует задержку; True - этот запрос должен завершиться ошибкой."""
+        self.stats["requests"] += 1
+        if self.latency:
+            # Небольшой разброс вокруг заданной задержки
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        failed = self.random.random() < self.error_rate
+        if failed:
+            self.stats["errors"] += 1
+        return failed
+
+
+class FakeOpenAI(FakeService):
+    """``POST /v1/chat/completions`` в формате legacy ChatCompletion.
+
+    Форма ответа выбирается по промпту: пакет фильмов (JSON), свободная
+    рецензия или рецензия по запросу пользователя (JSON). Каждый фильм
+    получает новый ID.
+    Запросы с ``stream=True`` получают ответ фрагментами (SSE).
+    """
+
+    def __init__(self, review_words: int = 120, stream_chunk: int = 16, stream_delay: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.review_words = review_words
+        self.stream_chunk = stream_chunk
+        self.stream_delay = stream_delay
+        self._ids = itertools.count(1000001)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+    def _review(self) -> str:
+        sentences = max(1, self.review_words // len(REVIEW_SENTENCE.split()))
+        return " ".join([REVIEW_SENTENCE] * sentences)
+
+    def _movie(self) -> dict:
+        number = next(self._ids)
+        return {"title": f"Фильм {number}", "year": 1980 + number % 40, "imdb_id": f"tt{number:07d}", "plot": PLOT}
+
+    def _content(self, messages: list) -> str:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = messages[-1]["content"]
+        if '"review"' in system:
+            return json.dumps({**self._movie(), "review": self._review()}, ensure_ascii=False)
+        if '"movies"' in system:
+            count = int(user.split()[1]) if user.split()[1].isdigit() else 1
+            return json.dumps({"movies": [self._movie() for _ in range(count)]}, ensure_ascii=False)
+        return self._review()
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        if await self._delay():
+            return web.json_response({"error": {"message": "fake overload", "type": "server_error"}}, status=500)
+        content = self._content(payload["messages"])
+        if payload.get("stream"):
+            return await self._stream(request, payload, content)
+        return web.json_response({
+            "id": f"chatcmpl-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(payload["messages"], content),
+        })
+
+    @staticmethod
+    def _usage(messages: list, content: str) -> dict:
+        # Грубая оценка токенов: ~4 символа на токен
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        }
+
+
+    async def _stream(self, request: web.Request, payload: dict, content: str) -> web.StreamResponse:
+        """Ответ в формате server-sent events, фрагментами по ``stream_chunk`` символов."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for start in range(0, len(content), self.stream_chunk):
+            chunk = {
+                "id": f"chatcmpl-{self.stats['requests']}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "gpt-4"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": content[start:start + self.stream_chunk]},
+                    "finish_reason": None,
+                }],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.stream_delay:
+                await asyncio.sleep(self.stream_delay)
+        if payload.get("stream_options", {}).get("include_usage"):
+            usage = {"id": f"chatcmpl-{self.stats['requests']}", "object": "chat.completion.chunk",
+                     "choices": [], "usage": self._usage(payload["messages"], content)}
+            await response.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+class FakeOmdb(FakeService):
+    """``GET /?i=...`` и ``GET /?t=...&y=...``; доля ``poster_na`` - фильмы без постера.
+
+    Постеры отдаются тем же сервером по ``GET /<imdb_id>.jpg``.
+    """
+
+    def __init__(self, poster_na: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.poster_na = poster_na
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self.lookup)
+        app.router.add_get("/{imdb_id}.jpg", self.poster)
+        return app
+
+    async def poster(self, request: web.Request) -> web.Response:
+        self.stats["posters"] = self.stats.get("posters", 0) + 1
+        return web.Response(body=POSTER_BYTES, content_type="image/jpeg")
+
+    async def lookup(self, request: web.Request) -> web.Response:
+        if await self._delay():
+            return web.Response(status=503)
+        imdb_id = request.query.get("i") or f"tt{abs(hash(request.query.get('t', ''))) % 10 ** 7:07d}"
+        poster = "N/A" if self.random.random() < self.poster_na else f"http://127.0.0.1:{self.port}/{imdb_id}.jpg"
+        return web.json_response({
+            "Response": "True",
+            "Title": request.query.get("t", f"Film {imdb_id}"),
+            "Year": request.query.get("y", "2000"),
+            "imdbID": imdb_id,
+            "Plot": PLOT,
+            "Poster": poster,
+        })
+
+
+class FakeTelegram(FakeService):
+    """``POST /bot<token>/<method>``: любой send*/edit* возвращает сообщение.
+
+    Ошибка имитируется как flood control (429 с ``retry_after``).
+    """
+
+    def __init__(self, retry_after: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.retry_after = retry_after
+        self.methods: dict = {}
+        self._message_ids = itertools.count(1)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.call)
+        return app
+
+    async def call(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.methods[method] = self.methods.get(method, 0) + 1
+        if await self._delay():
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        chat_id = form.get("chat_id", "0")
+        chat = (
+            {"id": int(chat_id), "type": "private", "first_name": "admin"}
+            if chat_id.lstrip("-").isdigit() and int(chat_id) > 0
+            else {"id": -1001, "type": "channel", "title": "bench"}
+        )
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+        }
+        if method.lower() == "sendphoto":
+            photo = form.get("photo")
+            # Загруженный файл получает новый file_id, строка (file_id или URL) - как есть
+            file_id = photo if isinstance(photo, str) else f"fake-{message['message_id']}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+            message["caption"] = form.get("caption", "")
+        else:
+            message["text"] = form.get("text", "")
+        result = message if method.lower().startswith(("send", "edit")) else True
+        return web.json_response({"ok": True, "result": result})
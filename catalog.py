@@ -0,0 +1,223 @@
+"""Локальный каталог фильмов из открытых выгрузок IMDb.
+
+Сборка (однократно, из title.basics.tsv.gz и title.ratings.tsv.gz с
+https://datasets.imdbws.com/):
+
+    python catalog.py title.basics.tsv.gz title.ratings.tsv.gz -o imdb_catalog.bin
+
+Файл каталога отображается в память целиком (mmap) и не загружается в
+кучу: записи фиксированной длины, хэш-таблица ID -> запись и блок названий.
+"""
+import argparse
+import csv
+import gzip
+import logging
+import mmap
+import random
+import struct
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = "imdb_catalog.bin"
+MAGIC = b"CMCAT001"
+
+# Заголовок: сигнатура, число записей, размер хэш-таблицы, длина блока названий
+HEADER = struct.Struct("<8sIII")
+# Запись: числовой IMDB ID, голоса, маска жанров, смещение названия, длина названия, год, рейтинг x10
+RECORD = struct.Struct("<IIIIHHH")
+SLOT = struct.Struct("<I")
+
+IMDB_GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Documentary",
+    "Drama", "Family", "Fantasy", "Film-Noir", "History", "Horror", "Music", "Musical",
+    "Mystery", "Romance", "Sci-Fi", "Sport", "Thriller", "War", "Western",
+]
+GENRE_BITS = {genre: 1 << index for index, genre in enumerate(IMDB_GENRES)}
+
+# Жанры бота (как их выбирает админ) -> жанры IMDb
+GENRE_ALIASES = {
+    "боевик": "Action",
+    "комедия": "Comedy",
+    "драма": "Drama",
+    "фантастика": "Sci-Fi",
+    "ужасы": "Horror",
+    "триллер": "Thriller",
+    "мультфильм": "Animation",
+    "детектив": "Crime",
+}
+
+
+def genre_mask(genre: str) -> Optional[int]:
+    imdb_genre = GENRE_ALIASES.get(genre.strip().lower(), genre.strip())
+    return GENRE_BITS.get(imdb_genre)
+
+
+def _slot_hash(number: int, mask: int) -> int:
+    return (number * 2654435761) & mask
+
+
+class MovieCatalog:
+    """Каталог, отображенный в память.
+
+    ``has_id`` - одна проба хэш-таблицы (открытая адресация, заполнение не
+    больше половины). ``sample`` выбирает случайные записи, пока не найдет
+    подходящую по жанру, году и рейтингу и не отвергнутую ``exclude``.
+    """
+
+    def __init__(self, path: str = CATALOG_FILE):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.slots, titles_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: это не файл каталога")
+        self._records_at = HEADER.size
+        self._slots_at = self._records_at + self.count * RECORD.size
+        self._titles_at = self._slots_at + self.slots * SLOT.size
+        logger.info(f"Каталог фильмов: {self.count} записей из {path}")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _record(self, index: int) -> tuple:
+        return RECORD.unpack_from(self._map, self._records_at + index * RECORD.size)
+
+    def _movie(self, record: tuple) -> dict:
+        number, votes, _, title_offset, title_size, year, rating = record
+        start = self._titles_at + title_offset
+        return {
+            "imdb_id": f"tt{number:07d}",
+            "title": self._map[start:start + title_size].decode("utf-8"),
+            "year": year,
+            "rating": rating / 10,
+            "votes": votes,
+        }
+
+    def _find(self, imdb_id: str) -> Optional[int]:
+        if not imdb_id or not imdb_id.startswith("tt") or not imdb_id[2:].isdigit():
+            return None
+        number = int(imdb_id[2:])
+        mask = self.slots - 1
+        slot = _slot_hash(number, mask)
+        while True:
+            (entry,) = SLOT.unpack_from(self._map, self._slots_at + slot * SLOT.size)
+            if entry == 0:
+                return None
+            if self._record(entry - 1)[0] == number:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def has_id(self, imdb_id: str) -> bool:
+        return self._find(imdb_id) is not None
+
+    def get(self, imdb_id: str) -> Optional[dict]:
+        index = self._find(imdb_id)
+        return self._movie(self._record(index)) if index is not None else None
+
+    def sample(
+        self,
+        genre: Optional[str] = None,
+        min_year: int = 0,
+        min_rating: float = 0,
+        exclude: Optional[Callable[[dict], bool]] = None,
+        attempts: int = 5000,
+    ) -> Optional[dict]:
+        """Случайный фильм по фильтрам или ``None``, если за ``attempts`` проб не нашелся."""
+        if not self.count:
+            return None
+        mask = genre_mask(genre) if genre else None
+        if genre and mask is None:
+            return None
+        min_rating10 = int(min_rating * 10)
+        for _ in range(attempts):
+            record = self._record(random.randrange(self.count))
+            if mask is not None and not record[2] & mask:
+                continue
+            if record[5] < min_year or record[6] < min_rating10:
+                continue
+            movie = self._movie(record)
+            if exclude is not None and exclude(movie):
+                continue
+            return movie
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def read_tsv(path: str) -> Iterator[Dict[str, str]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+
+def build_catalog(basics_path: str, ratings_path: str, output: str, min_votes: int = 1000) -> int:
+    """Собирает файл каталога из TSV-выгрузок IMDb; возвращает число фильмов."""
+    ratings = {}
+    for row in read_tsv(ratings_path):
+        votes = int(row["numVotes"])
+        if votes >= min_votes:
+            ratings[row["tconst"]] = (float(row["averageRating"]), votes)
+
+    records: List[tuple] = []
+    titles = bytearray()
+    for row in read_tsv(basics_path):
+        if row["titleType"] != "movie" or row["isAdult"] == "1" or row["startYear"] == "\\N":
+            continue
+        rating = ratings.get(row["tconst"])
+        if rating is None:
+            continue
+        mask = 0
+        for genre in row["genres"].split(","):
+            mask |= GENRE_BITS.get(genre, 0)
+        title = row["primaryTitle"].encode("utf-8")[:65535]
+        records.append((
+            int(row["tconst"][2:]), rating[1], mask, len(titles), len(title),
+            int(row["startYear"]), int(round(rating[0] * 10)),
+        ))
+        titles += title
+
+    slots = 1
+    while slots < len(records) * 2:
+        slots *= 2
+    table = [0] * slots
+    mask = slots - 1
+    for index, record in enumerate(records):
+        slot = _slot_hash(record[0], mask)
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+
+    with open(output, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records), slots, len(titles)))
+        for record in records:
+            f.write(RECORD.pack(*record))
+        f.write(struct.pack(f"<{slots}I", *table))
+        f.write(titles)
+    return len(records)
+
+
+def load_catalog(path: str) -> Optional[MovieCatalog]:
+    """Каталог, если файл есть, иначе ``None`` (бот работает без него)."""
+    try:
+        return MovieCatalog(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        logger.error(f"Не удалось открыть каталог фильмов {path}: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Сборка локального каталога фильмов из выгрузок IMDb")
+    parser.add_argument("basics", help="title.basics.tsv(.gz)")
+    parser.add_argument("ratings", help="title.ratings.tsv(.gz)")
+    parser.add_argument("-o", "--output", default=CATALOG_FILE)
+    parser.add_argument("--min-votes", type=int, default=1000)
+    args = parser.parse_args()
+    total = build_catalog(args.basics, args.ratings, args.output, args.min_votes)
+    print(f"Каталог: {total} фильмов -> {args.output}")
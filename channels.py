@@ -0,0 +1,49 @@
+import json
+import logging
+from typing import List
+
+from history_store import MAIN_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+CHANNELS_FILE = "channels.json"
+
+PROFILE_DEFAULTS = {
+    "genre": "боевик",
+    "style": "default",
+    "schedule": "0 9 * * *",
+    # channel - не повторять фильмы внутри канала, global - во всех каналах
+    "dedupe": "channel",
+}
+
+
+def load_channel_profiles(path: str = CHANNELS_FILE) -> List[dict]:
+    """Читает дополнительные каналы из JSON-файла.
+
+    Формат: список объектов ``{"id", "chat_id", "genre", "style", "schedule",
+    "dedupe"}``; обязательны только ``id`` и ``chat_id``. Основной канал
+    (CHANNEL_ID, настройки из админ-панели) в файле не описывается.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw_profiles = json.load(f)
+    except FileNotFoundError:
+        return []
+    except ValueError as e:
+        logger.error(f"Ошибка чтения {path}: {e}")
+        return []
+
+    profiles = []
+    seen = {MAIN_CHANNEL}
+    for raw in raw_profiles:
+        if not raw.get("id") or not raw.get("chat_id"):
+            logger.error(f"Профиль канала без id или chat_id пропущен: {raw}")
+            continue
+        if raw["id"] in seen:
+            logger.error(f"Повторяющийся id канала пропущен: {raw['id']}")
+            continue
+        seen.add(raw["id"])
+        profiles.append({**PROFILE_DEFAULTS, **raw})
+
+    logger.info(f"Загружено дополнительных каналов: {len(profiles)}")
+    return profiles
@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, List, Optional, Set, Tuple
+
+from omdb_cache import normalize_title
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB_FILE = "movies_history.sqlite3"
+MAIN_CHANNEL = "main"
+
+# Колонки, по которым история фильтруется при просмотре
+FILTER_COLUMNS = ("genre", "year", "style")
+
+
+def title_year_key(title: str, year) -> str:
+    return f"{normalize_title(title)}|{year or ''}"
+
+
+class HistoryStore:
+    """Индексированная история публикаций на SQLite.
+
+    Каждая публикация - строка с порядковым номером ``seq``; по IMDB ID и по
+    нормализованному названию+году построены индексы, поэтому проверка на
+    дубликат не зависит от размера истории, а запись - одна вставка.
+    Публикации помечены каналом; ``channel=None`` в проверках означает
+    "в любом канале".
+
+    Фильм подготовленного, но еще не опубликованного поста резервируется
+    (``reserve``) в памяти процесса: пока резерв не снят, ``is_taken``
+    считает фильм занятым, и два канала с общей проверкой повторов не
+    получат один и тот же фильм в одном слоте.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_FILE):
+        self.path = path
+        # Ключ фильма (IMDB ID или название+год) -> каналы, за которыми он зарезервирован
+        self._reserved: Dict[str, Set[Optional[str]]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " imdb_id TEXT,"
+            " title_key TEXT NOT NULL,"
+            " year INTEGER,"
+            " genre TEXT,"
+            " style TEXT,"
+            " date TEXT NOT NULL,"
+            " data TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS history_imdb_id ON history (imdb_id);"
+            "CREATE INDEX IF NOT EXISTS history_title_key ON history (title_key);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(history)")}
+        if "channel" not in columns:
+            # Записи, сделанные до появления нескольких каналов, относятся к основному
+            self._conn.execute("ALTER TABLE history ADD COLUMN channel TEXT")
+            self._conn.execute("UPDATE history SET channel = ?", (MAIN_CHANNEL,))
+        self._conn.executescript(
+            "CREATE INDEX IF NOT EXISTS history_channel_imdb_id ON history (channel, imdb_id);"
+            "CREATE INDEX IF NOT EXISTS history_channel_title_key ON history (channel, title_key);"
+            "CREATE INDEX IF NOT EXISTS history_genre ON history (genre);"
+            "CREATE INDEX IF NOT EXISTS history_year ON history (year);"
+            "CREATE INDEX IF NOT EXISTS history_style ON history (style);"
+        )
+        self._conn.commit()
+
+    def _insert(self, record: dict) -> int:
+        cursor = self._conn.execute(
+            "INSERT INTO history (imdb_id, title_key, year, genre, style, date, channel, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record.get("imdb_id") or None,
+                title_year_key(record.get("title", ""), record.get("year")),
+                record.get("year"),
+                record.get("genre"),
+                record.get("style"),
+                record["date"],
+                record.get("channel") or MAIN_CHANNEL,
+                json.dumps(record, ensure_ascii=False),
+            )
+        )
+        return cursor.lastrowid
+
+    def append(self, record: dict) -> int:
+        seq = self._insert(record)
+        self._conn.commit()
+        return seq
+
+    def migrate_jsonl(self, path: str) -> int:
+        """Однократно переносит записи из старого JSONL-файла истории."""
+        done = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'jsonl_migrated'"
+        ).fetchone()
+        if done or not os.path.exists(path):
+            return 0
+
+        count = 0
+        with self._conn:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._insert(json.loads(line))
+                        count += 1
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"Пропущена строка истории при миграции: {e}")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('jsonl_migrated', ?)",
+                (os.path.abspath(path),)
+            )
+        logger.info(f"История: перенесено {count} записей из {path}")
+        return count
+
+    def has_imdb_id(self, imdb_id: str, channel: Optional[str] = None) -> bool:
+        if not imdb_id:
+            return False
+        if channel is None:
+            row = self._conn.execute(
+                "SELECT 1 FROM history WHERE imdb_id = ? LIMIT 1", (imdb_id,)
+            ).fetchone()
+        else:
+            row = self._conn.execute(
+                "SELECT 1 FROM history WHERE channel = ? AND imdb_id = ? LIMIT 1", (channel, imdb_id)
+            ).fetchone()
+        return row is not None
+
+    def has_title(self, title: str, year, channel: Optional[str] = None) -> bool:
+        key = title_year_key(title, year)
+        if channel is None:
+            row = self._conn.execute(
+                "SELECT 1 FROM history WHERE title_key = ? LIMIT 1", (key,)
+            ).fetchone()
+        else:
+            row = self._conn.execute(
+                "SELECT 1 FROM history WHERE channel = ? AND title_key = ? LIMIT 1", (channel, key)
+            ).fetchone()
+        return row is not None
+
+    def is_posted(self, movie: dict, channel: Optional[str] = None) -> bool:
+        return self.has_imdb_id(movie.get("imdb_id"), channel) or self.has_title(
+            movie.get("title", ""), movie.get("year"), channel
+        )
+
+    @staticmethod
+    def _movie_keys(movie: dict) -> List[str]:
+        keys = [title_year_key(movie.get("title", ""), movie.get("year"))]
+        if movie.get("imdb_id"):
+            keys.append(movie["imdb_id"])
+        return keys
+
+    def is_reserved(self, movie: dict, channel: Optional[str] = None) -> bool:
+        for key in self._movie_keys(movie):
+            owners = self._reserved.get(key)
+            if owners and (channel is None or channel in owners):
+                return True
+        return False
+
+    def is_taken(self, movie: dict, channel: Optional[str] = None) -> bool:
+        """Фильм опубликован или зарезервирован подготовленным постом."""
+        return self.is_posted(movie, channel) or self.is_reserved(movie, channel)
+
+    def reserve(self, movie: dict, channel: Optional[str] = None) -> bool:
+        """Резервирует фильм; False - он уже опубликован или занят другим постом."""
+        if self.is_taken(movie, channel):
+            return False
+        for key in self._movie_keys(movie):
+            self._reserved.setdefault(key, set()).add(channel)
+        return True
+
+    def release(self, movie: dict, channel: Optional[str] = None):
+        """Снимает резерв: пост опубликован (и записан в историю) или отброшен."""
+        for key in self._movie_keys(movie):
+            owners = self._reserved.get(key)
+            if owners is not None:
+                owners.discard(channel)
+                if not owners:
+                    del self._reserved[key]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def recent_ids(self, limit: int, channel: Optional[str] = None, genre: Optional[str] = None) -> List[str]:
+        """Последние ``limit`` IMDB ID (в канале и жанре, если заданы), от старых к новым."""
+        rows = self._conn.execute(
+            "SELECT imdb_id FROM history WHERE imdb_id IS NOT NULL AND (? IS NULL OR channel = ?)"
+            " AND (? IS NULL OR genre = ?) ORDER BY seq DESC LIMIT ?",
+            (channel, channel, genre, genre, limit)
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def records(self, limit: Optional[int] = None) -> List[dict]:
+        """Записи истории в порядке публикации (последние ``limit``, если задан)."""
+        rows = self._conn.execute(
+            "SELECT data FROM history ORDER BY seq DESC LIMIT ?",
+            (limit if limit is not None else -1,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    @staticmethod
+    def _where(filters: dict) -> Tuple[str, tuple]:
+        clauses, params = [], []
+        for column in FILTER_COLUMNS:
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
+
+    def count_matching(self, **filters) -> int:
+        where, params = self._where(filters)
+        return self._conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def page(self, size: int, before: Optional[int] = None, after: Optional[int] = None, **filters) -> List[dict]:
+        """Страница записей, от новых к старым: ``size`` записей старее ``before``
+        или новее ``after`` (по ``seq``), без них - самые новые.
+
+        Курсор по ``seq`` (это rowid, он есть в каждом индексе фильтров)
+        сразу попадает на нужное место индекса - в отличие от OFFSET, цена
+        страницы не растет с ее номером, а новые публикации не сдвигают
+        листание.
+        """
+        where, params = self._where(filters)
+        order = "DESC"
+        if after is not None:
+            cursor, params, order = "seq > ?", (*params, after), "ASC"
+        elif before is not None:
+            cursor, params = "seq < ?", (*params, before)
+        else:
+            cursor = ""
+        if cursor:
+            where = f"{where} AND {cursor}" if where else f" WHERE {cursor}"
+        rows = self._conn.execute(
+            f"SELECT seq, data FROM history{where} ORDER BY seq {order} LIMIT ?",
+            (*params, size)
+        ).fetchall()
+        records = [{**json.loads(data), "seq": seq} for seq, data in rows]
+        return records if order == "DESC" else records[::-1]
+
+    def distinct(self, column: str, limit: int = 24) -> list:
+        """Самые частые значения колонки фильтра - варианты для выбора."""
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Фильтр по {column} не поддерживается")
+        rows = self._conn.execute(
+            f"SELECT {column} FROM history WHERE {column} IS NOT NULL"
+            f" GROUP BY {column} ORDER BY COUNT(*) DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return sorted((row[0] for row in rows), reverse=column == "year")
+
+    def close(self):
+        self._conn.close()
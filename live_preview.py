@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class LivePreview:
+    """Сообщение-заглушка, которое редактируется по мере генерации текста.
+
+    ``update()`` только запоминает последний текст; правка сообщения идет в
+    фоне и не чаще одного раза в ``interval`` секунд, поэтому поток
+    фрагментов от GPT не упирается в лимиты Telegram на редактирование.
+    Промежуточные версии, которые не успели показать, просто пропускаются.
+    ``close()`` не обрывает правку, уже отправленную в Telegram: отмена
+    запроса посреди отправки оставила бы очередь исходящих без ответа.
+    """
+
+    def __init__(self, message: types.Message, placeholder: str, interval: float = 1.5):
+        self.message = message
+        self.placeholder = placeholder
+        self.interval = interval
+        self.sent: Optional[types.Message] = None
+        self._pending: Optional[str] = None
+        self._shown = placeholder
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._editing = False
+        self._closed = False
+
+    async def start(self):
+        self.sent = await self.message.answer(self.placeholder)
+        self._last_edit = time.monotonic()
+
+    def update(self, text: str):
+        if self.sent is None or self._closed:
+            return
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending is not None:
+            wait = self.interval - (time.monotonic() - self._last_edit)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self._closed:
+                return
+            text, self._pending = self._pending, None
+            if text == self._shown:
+                continue
+            self._editing = True
+            try:
+                await self.sent.edit_text(text)
+                self._shown = text
+            except TelegramAPIError as e:
+                logger.debug(f"Превью: правка не удалась: {e}")
+            finally:
+                self._editing = False
+            self._last_edit = time.monotonic()
+
+    async def close(self):
+        """Останавливает правки и удаляет заглушку - итог отправляется отдельно."""
+        self._closed = True
+        self._pending = None
+        if self._task is not None:
+            if not self._editing:
+                self._task.cancel()  # ждет паузы между правками - прерывать безопасно
+            # Начатая правка доходит до конца, и только потом заглушка удаляется
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.sent is not None:
+            try:
+                await self.sent.delete()
+            except TelegramAPIError as e:
+                logger.debug(f"Превью: не удалось удалить заглушку: {e}")
@@ -4,20 +4,45 @@ import logging
 import asyncio
 import aiohttp
 import re
-import requests
-from typing import Dict, Optional
-from aiogram import Bot, Dispatcher, types, F
+import hashlib
+import functools
+from typing import Callable, Dict, Optional, Tuple
+from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import openai
 from dotenv import load_dotenv
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from datetime import datetime, time
-from functools import lru_cache
+from datetime import datetime, time, timedelta
+from omdb_client import OmdbClient, OMDB_BASE_URL
+from omdb_cache import OmdbCache, OMDB_CACHE_FILE
+from async_cache import async_cached
+from history_store import HistoryStore, HISTORY_DB_FILE, MAIN_CHANNEL, title_year_key
+from channels import load_channel_profiles, CHANNELS_FILE
+from prefetch import PostPrefetcher
+from text_dispatch import ButtonDispatcher
+from state_store import StateStore, STATE_SNAPSHOT_FILE, STATE_JOURNAL_FILE
+from render import escape_md, clip_md, render_post
+from resilience import CallPolicy, CircuitBreaker, CircuitOpenError, OPEN, CLOSED, transient_http_error
+from web_server import BotWebServer, WEBHOOK_PATH
+from catalog import load_catalog, CATALOG_FILE
+from poster_store import PosterStore, POSTER_DIR, POSTER_DB_FILE
+from title_index import load_title_index, TITLE_INDEX_FILE
+from live_preview import LivePreview
+from prompts import TokenLedger, compact_avoid_list, estimate_usage
+from metrics import REGISTRY, STAGE_SECONDS, STAGE_ERRORS, STAGE_RETRIES, UPSTREAM_ERRORS, DUPLICATES, LLM_PARSE, track_stage
+from pipeline import Pipeline, Stage, StageFailed
+from review_store import ReviewStore, REVIEW_DB_FILE
+from structured import StructuredOutput, stream_fields, partial_string
+from shared_state import open_shared_store, SharedFSMStorage, LeaderLease, IdempotencyKeys
+from send_queue import OutboundQueue, OutboundMiddleware, PRIORITY_CHANNEL, PRIORITY_USER, PRIORITY_ADMIN
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -31,20 +56,193 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ADMINS = list(map(int, os.getenv("ADMINS").split(','))) if os.getenv("ADMINS") else []
 CHANNEL_ID = os.getenv("CHANNEL_ID")
-MOVIES_HISTORY_FILE = "movies_history.json"
+OMDB_API_KEY = os.getenv("OMDB_API_KEY")
+MOVIES_HISTORY_FILE = "movies_history.json"  # старый JSONL, переносится в HistoryStore при старте
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", WEBHOOK_PATH)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")  # публичный адрес вебхука
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+# /health и /metrics - отдельный слушатель, по умолчанию доступный только локально.
+# В режиме webhook он поднимается всегда (порт 8081, если HEALTH_PORT не задан),
+# в режиме polling - только если задан HEALTH_PORT
+HEALTH_HOST = os.getenv("HEALTH_HOST", "127.0.0.1")
+HEALTH_PORT = os.getenv("HEALTH_PORT")
+DEFAULT_HEALTH_PORT = 8081
+
+# Несколько реплик: общее хранилище для FSM, аренды лидера и ключей публикаций
+# (пусто - одна реплика, memory:// - проверка режима без внешнего сервиса, redis://...)
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL")
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "30"))
+SLOT_GRACE = 600  # опоздавшее срабатывание относится к своему слоту в пределах 10 минут
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2))
-dp = Dispatcher()
+# TELEGRAM_API_BASE - локальный Bot API сервер или заглушка для бенчмарков
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None,
+    default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
+)
+shared_store = open_shared_store(SHARED_STATE_URL)
+# Без общего хранилища aiogram держит FSM в памяти процесса
+dp = Dispatcher(storage=SharedFSMStorage(shared_store) if shared_store is not None else None)
 scheduler = AsyncIOScheduler()
-
-# База данных
-DB = {
+# Планировщик есть в каждой реплике, но публикует только лидер, и каждый
+# слот канала - не больше одного раза
+leader = LeaderLease(shared_store, ttl=LEADER_LEASE_TTL) if shared_store is not None else None
+publish_keys = IdempotencyKeys(shared_store) if shared_store is not None else None
+
+# Роутеры регистрируются один раз при импорте: сначала пользовательский,
+# затем админский (только для ADMINS). Кнопки меню - через таблицы ButtonDispatcher
+user_router = Router(name="user")
+admin_router = Router(name="admin")
+admin_router.message.filter(F.from_user.id.in_(ADMINS))
+admin_router.callback_query.filter(F.from_user.id.in_(ADMINS))
+
+user_buttons = ButtonDispatcher()
+user_buttons.attach(user_router)
+admin_buttons = ButtonDispatcher()
+admin_buttons.attach(admin_router)
+
+dp.include_routers(user_router, admin_router)
+
+# Политики вызова внешних сервисов: таймауты, повторы с джиттером, размыкатель цепи
+breaker_notifications: set = set()  # ссылки на задачи уведомлений, чтобы их не собрал GC
+
+def report_breaker_state(name: str, previous: str, state: str):
+    # Неудачная пробная попытка (half_open -> open) - не повод писать админам снова
+    if state == OPEN and previous == CLOSED:
+        text = f"🔴 {name} не отвечает, запросы временно отклоняются"
+    elif state == CLOSED:
+        text = f"🟢 {name} снова доступен"
+    else:
+        return
+    task = asyncio.create_task(notify_admin(escape_md(text)))
+    breaker_notifications.add(task)
+    task.add_done_callback(breaker_notifications.discard)
+
+def optional_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+openai_policy = CallPolicy(
+    "OpenAI",
+    timeout=float(os.getenv("OPENAI_TIMEOUT", "90")),
+    retries=int(os.getenv("OPENAI_RETRIES", "2")),
+    backoff_base=2.0,
+    breaker=CircuitBreaker("OpenAI", failure_threshold=5, reset_timeout=120, on_state_change=report_breaker_state),
+    # Дублирующий запрос к GPT стоит денег - по умолчанию выключен
+    hedge_quantile=optional_float("OPENAI_HEDGE_QUANTILE"),
+    retry_on=(
+        openai.error.Timeout,
+        openai.error.APIError,
+        openai.error.APIConnectionError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+    )
+)
+
+omdb_policy = CallPolicy(
+    "OMDb",
+    timeout=float(os.getenv("OMDB_TIMEOUT", "10")),
+    retries=int(os.getenv("OMDB_RETRIES", "2")),
+    backoff_base=0.5,
+    breaker=CircuitBreaker("OMDb", failure_threshold=5, reset_timeout=60, on_state_change=report_breaker_state),
+    hedge_quantile=optional_float("OMDB_HEDGE_QUANTILE") or 0.95,
+    retry_on=(aiohttp.ClientError,),
+    # 401 (неверный ключ, исчерпан лимит) и прочие 4xx повторять бесполезно
+    retryable=transient_http_error
+)
+
+# Общий клиент OMDb: сессия открывается в main() и закрывается при остановке
+omdb = OmdbClient(
+    api_key=OMDB_API_KEY,
+    base_url=os.getenv("OMDB_BASE_URL", OMDB_BASE_URL),
+    timeout=float(os.getenv("OMDB_TIMEOUT", "10")),
+    max_concurrency=int(os.getenv("OMDB_MAX_CONCURRENCY", "5")),
+    cache=OmdbCache(
+        path=os.getenv("OMDB_CACHE_FILE", OMDB_CACHE_FILE),
+        ttl=float(os.getenv("OMDB_CACHE_TTL", str(30 * 86400))),
+        max_entries=int(os.getenv("OMDB_CACHE_SIZE", "20000"))
+    ),
+    policy=omdb_policy
+)
+
+# База данных: настройки переживают перезапуск (снимок + журнал изменений)
+state_store = StateStore(
+    snapshot_path=os.getenv("STATE_SNAPSHOT_FILE", STATE_SNAPSHOT_FILE),
+    journal_path=os.getenv("STATE_JOURNAL_FILE", STATE_JOURNAL_FILE)
+)
+DB = state_store.load({
     "current_genre": "боевик",
     "current_style": "аналитический",
     "schedule": "0 9 * * *",
-    "posted_imdb_ids": []
-}
+    "fast_reviews": False
+})
+
+# Пулы готовых рецензий по (фильм, стиль, промпт): в быстром режиме рецензия
+# берется из пула сразу, а новый вариант генерируется в фоне
+reviews = ReviewStore(
+    path=os.getenv("REVIEW_DB_FILE", REVIEW_DB_FILE),
+    variants=int(os.getenv("REVIEW_VARIANTS", "3"))
+)
+
+# Постеры: локальная копия и file_id Telegram, чтобы не гонять картинку заново
+posters = PosterStore(
+    directory=os.getenv("POSTER_DIR", POSTER_DIR),
+    db_path=os.getenv("POSTER_DB_FILE", POSTER_DB_FILE)
+)
+
+# История публикаций с индексами по IMDB ID и названию+году
+history = HistoryStore(os.getenv("HISTORY_DB_FILE", HISTORY_DB_FILE))
+
+# Локальный каталог IMDb (необязательный): кандидаты выбираются из него, а GPT пишет
+# только сюжет и рецензию. Без файла каталога фильмы по-прежнему предлагает GPT
+catalog = load_catalog(os.getenv("CATALOG_FILE", CATALOG_FILE))
+CATALOG_MIN_YEAR = int(os.getenv("CATALOG_MIN_YEAR", "1970"))
+CATALOG_MIN_RATING = float(os.getenv("CATALOG_MIN_RATING", "6.5"))
+
+# Индекс названий (необязательный): подбор IMDB ID по названию из кастомной рецензии
+title_index = load_title_index(os.getenv("TITLE_INDEX_FILE", TITLE_INDEX_FILE))
+TITLE_MATCH_SCORE = 0.8  # начиная с такого сходства лучший вариант берется без вопросов
+
+# Каналы: основной (CHANNEL_ID, настройки из админ-панели) и дополнительные из channels.json
+EXTRA_CHANNELS = load_channel_profiles(os.getenv("CHANNELS_FILE", CHANNELS_FILE))
+channel_semaphore = asyncio.Semaphore(int(os.getenv("CHANNEL_CONCURRENCY", "3")))
+
+def main_channel_profile() -> dict:
+    return {
+        "id": MAIN_CHANNEL,
+        "chat_id": CHANNEL_ID,
+        "genre": DB["current_genre"],
+        "style": DB["current_style"],
+        "schedule": DB["schedule"],
+        "dedupe": "channel"
+    }
+
+def channel_profiles() -> list:
+    return [main_channel_profile()] + EXTRA_CHANNELS
+
+def dedupe_scope(profile: dict) -> Optional[str]:
+    # None - проверять повторы по всем каналам
+    return None if profile.get("dedupe") == "global" else profile["id"]
+
+# Все исходящие сообщения идут через очередь с лимитами Telegram и приоритетами:
+# посты в каналы, затем ответы пользователям, затем уведомления админам
+outbound = OutboundQueue(workers=int(os.getenv("SEND_WORKERS", "4")))
+
+def send_priority(chat_id) -> int:
+    if str(chat_id) in {str(profile["chat_id"]) for profile in channel_profiles()}:
+        return PRIORITY_CHANNEL
+    if chat_id in ADMINS:
+        return PRIORITY_ADMIN
+    return PRIORITY_USER
+
+bot.session.middleware(OutboundMiddleware(outbound, send_priority))
 
 # Состояния FSM
 class AdminStates(StatesGroup):
@@ -64,23 +262,171 @@ except Exception as e:
 
 # OpenAI функции
 openai.api_key = OPENAI_API_KEY
+openai.api_base = os.getenv("OPENAI_API_BASE", openai.api_base)
 
-MOVIE_PROMPT = """Сгенерируй описание фильма в жанре {genre} в формате:
-Title: Название
-Year: Год
-IMDB-ID: ttXXXXXX \(действительный идентификатор с IMDB\)
-Plot: Краткое описание на русском языке - без многоточий на конце предложений.
+# Промпты: неизменная часть - в системном сообщении (одинаковый префикс у всех
+# запросов позволяет провайдеру кэшировать его), переменная - в сообщении пользователя
+MOVIE_SYSTEM_PROMPT = """Ты подбираешь существующие фильмы. Ответь только JSON-объектом, без пояснений:
+{"movies": [{"title": "Название", "year": 1999, "imdb_id": "tt0000000", "plot": "Описание"}]}
+imdb_id - действительный идентификатор с IMDB, plot - краткое описание на русском языке без многоточий на конце предложений.
 Избегай многоточий и повторяющихся знаков препинания
-Избегай фильмов с этими ID: {avoid_ids}
-Только действительные существующие фильмы\!"""
+Только действительные существующие фильмы!"""
+
+MOVIE_PROMPT = """Сгенерируй {count} разных фильмов в жанре {genre}.
+Не предлагай фильмы с этими ID: {avoid_ids}"""
 
 GENERAL_REVIEW_PROMPT = os.getenv("GENERAL_REVIEW_PROMPT", "Стандартные требования к рецензии")
 
-# Утилиты
-def escape_md(text: str) -> str:
-    escape_chars = '_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{"".join(re.escape(c) for c in escape_chars)}])', r'\\\1', str(text))
+PLOT_SYSTEM_PROMPT = """Ты кратко пересказываешь сюжеты фильмов.
+Ответь только описанием сюжета на русском языке: 2-3 предложения, без спойлеров концовки.
+Избегай многоточий и повторяющихся знаков препинания"""
+
+CUSTOM_REVIEW_FORMAT = (
+    "Учти: пользователь мог ввести название, концепцию или краткое описание!\n"
+    "Ответь только JSON-объектом, без пояснений, с полями в таком порядке:\n"
+    '{"title": "Название фильма", "year": 1999, "imdb_id": "tt0000000", "plot": "Описание", "review": "Рецензия"}\n'
+    "plot - описание сюжета на 20-30 слов - ни в коем случае не ставь несколько точек рядом, не ставь нигде многоточия, обязательно заканчивай описание одной точкой\n"
+    "review - текст рецензии 100-120 слов - не ставь нигде многоточия\n\n"
+)
+
+# Схемы ответов модели: проверка и мелкий ремонт идут локально, без повторных запросов
+IMDB_ID_PATTERN = r"^tt\d{7,8}$"
+MOVIE_SCHEMA = {
+    "type": "object",
+    "required": ["title", "year", "imdb_id", "plot"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "year": {"type": "integer", "minimum": 1888, "maximum": 2100},
+        "imdb_id": {"type": "string", "pattern": IMDB_ID_PATTERN},
+        "plot": {"type": "string", "minLength": 1},
+    },
+}
+movie_batch_output = StructuredOutput("movie_batch", {
+    "type": "object",
+    "required": ["movies"],
+    "wrappedIn": "movies",
+    "properties": {
+        "movies": {"type": "array", "items": MOVIE_SCHEMA, "dropInvalid": True, "minItems": 1},
+    },
+})
+custom_review_output = StructuredOutput("custom_review", {
+    "type": "object",
+    "required": ["title", "review"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        # Год и ID модель может не знать - тогда они пустые, а не выдуманные
+        "year": {"type": "integer", "minimum": 1888, "maximum": 2100, "default": None},
+        "imdb_id": {"type": "string", "pattern": IMDB_ID_PATTERN, "default": ""},
+        "plot": {"type": "string", "default": ""},
+        "review": {"type": "string", "minLength": 1},
+    },
+})
+
+# Версия промптов входит в ключи кэша: после правки промптов старые ответы не используются
+PROMPT_VERSION = hashlib.sha1(
+    (
+        MOVIE_SYSTEM_PROMPT + MOVIE_PROMPT + PLOT_SYSTEM_PROMPT + GENERAL_REVIEW_PROMPT + CUSTOM_REVIEW_FORMAT
+        + json.dumps(STYLE_DESCRIPTIONS, sort_keys=True)
+    ).encode("utf-8")
+).hexdigest()[:8]
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(6 * 3600)))
+# Кастомная рецензия генерируется потоком с живым превью в чате админа
+CUSTOM_REVIEW_STREAMING = os.getenv("CUSTOM_REVIEW_STREAMING", "1") == "1"
+PREVIEW_EDIT_INTERVAL = float(os.getenv("PREVIEW_EDIT_INTERVAL", "1.5"))
+PREVIEW_TAIL = 1500
+REVIEW_UNAVAILABLE = "Рецензия временно недоступна"
+
+# В промпт попадают только ID, которые модель скорее всего повторит: свои кандидаты
+# и недавние публикации того же жанра. Остальные повторы отсеивает проверка по истории
+AVOID_LIST_SIZE = int(os.getenv("AVOID_LIST_SIZE", "30"))
+
+# Учет токенов по местам вызова (суточные итоги видны в админ-панели)
+token_ledger = TokenLedger()
+
+@functools.lru_cache(maxsize=None)
+def review_system_prompt(style: str) -> str:
+    style_description = STYLE_DESCRIPTIONS.get(
+        style,
+        "Стандартный аналитический стиль"
+    )
+    return (
+        f"{GENERAL_REVIEW_PROMPT}\n\n"
+        f"Стиль изложения: {style}\n"
+        f"Характеристики стиля: {style_description}"
+    )
+
+@functools.lru_cache(maxsize=None)
+def review_prompt_hash(style: str) -> str:
+    # Общие требования и описание стиля: после их правки старые варианты не выдаются
+    return hashlib.sha1(review_system_prompt(style).encode("utf-8")).hexdigest()[:8]
+
+@functools.lru_cache(maxsize=None)
+def custom_review_system_prompt(style: str) -> str:
+    return (
+        f"{GENERAL_REVIEW_PROMPT}\n"
+        f"Стиль: {style}\n"
+        f"{CUSTOM_REVIEW_FORMAT}"
+    )
+
+async def chat_completion(site: str, messages: list, **params) -> str:
+    """Запрос к ChatCompletion через политику вызова OpenAI с учетом токенов."""
+    text, _ = await chat_completion_ended(site, messages, **params)
+    return text
+
+async def chat_completion_ended(site: str, messages: list, **params) -> Tuple[str, bool]:
+    """Как ``chat_completion``, но еще и с признаком обрыва ответа по ``max_tokens``."""
+    response = await openai_policy.call(lambda: openai.ChatCompletion.acreate(
+        model="gpt-4",
+        messages=messages,
+        **params
+    ))
+    token_ledger.record(site, response.get("usage"))
+    choice = response.choices[0]
+    return choice.message.content, choice.get("finish_reason") == "length"
+
+async def stream_chat_completion(
+    site: str, messages: list, on_text: Callable[[str], None], **params
+) -> Tuple[str, bool]:
+    """Потоковый ChatCompletion: ``on_text`` получает накопленный текст после каждого фрагмента.
+
+    Возвращает текст и признак обрыва ответа по ``max_tokens``. Политика
+    вызова распространяется на открытие потока, чтение ограничено ее
+    таймаутом. Usage приходит последним фрагментом (``include_usage``); если
+    API его не прислал, в учет токенов идет оценка по длине текста.
+    """
+    stream = await openai_policy.call(lambda: openai.ChatCompletion.acreate(
+        model="gpt-4",
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **params
+    ))
+    text = ""
+    usage = None
+    finish_reason = None
+
+    async def consume():
+        nonlocal text, usage, finish_reason
+        async for chunk in stream:
+            usage = chunk.get("usage") or usage
+            if not chunk.get("choices"):
+                continue  # итоговый фрагмент с usage
+            finish_reason = chunk.choices[0].get("finish_reason") or finish_reason
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                text += delta
+                on_text(text)
+
+    await asyncio.wait_for(consume(), openai_policy.timeout)
+    token_ledger.record(site, usage or estimate_usage(messages, text))
+    return text, finish_reason == "length"
+
+# Пакетная генерация: один запрос к GPT возвращает несколько кандидатов
+MOVIE_BATCH_SIZE = int(os.getenv("MOVIE_BATCH_SIZE", "5"))
+MOVIE_POOL_LIMIT = 20
+movie_candidates: Dict[str, list] = {}  # проверенные кандидаты, оставшиеся от прошлых пакетов, по жанрам
 
+# Утилиты
 def time_to_cron(user_time: str) -> str:
     error_msg = (
         "Неправильный формат времени\!\n"
@@ -107,65 +453,157 @@ def parse_cron(cron_str: str) -> dict:
     }
 
 # Работа с историей фильмов
-def save_to_history(movie: dict):
+def save_to_history(
+    movie: dict,
+    genre: Optional[str] = None,
+    style: Optional[str] = None,
+    channel: str = MAIN_CHANNEL
+):
     try:
-        with open(MOVIES_HISTORY_FILE, "a", encoding="utf-8") as f:
-            record = {
-                "date": datetime.now().isoformat(),
-                **movie
-            }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        record = {
+            "date": datetime.now().isoformat(),
+            **movie,
+            "channel": channel
+        }
+        if genre:
+            record["genre"] = genre
+        if style:
+            record["style"] = style
+        history.append(record)
+        history_pages.clear()
     except Exception as e:
         logger.error(f"Ошибка сохранения истории: {str(e)}")
 
-def load_history() -> list:
-    try:
-        with open(MOVIES_HISTORY_FILE, "r", encoding="utf-8") as f:
-            return [json.loads(line) for line in f.readlines()]
-    except FileNotFoundError:
-        return []
-
-@lru_cache(maxsize=100)
-async def get_cached_movie(genre: str, attempt: int):
-    return await get_movie_data(genre, attempt)
-
-def parse_movie_response(text: str) -> Optional[dict]:
-    try:
-        imdb_id = re.search(r'tt\d{7,8}', text).group(0)
-        title = re.search(r'Title: (.+)', text).group(1)
-        year = re.search(r'Year: (\d{4})', text).group(1)
-        plot = re.search(r'Plot: (.+)', text, re.DOTALL).group(1)
-
-        return {
-            "imdb_id": imdb_id,
-            "title": title.strip(),
-            "year": int(year),
-            "plot": plot.strip()
-        }
-    except Exception as e:
-        logger.error(f"Ошибка парсинга: {str(e)}")
+def load_history(limit: Optional[int] = None) -> list:
+    return history.records(limit)
+
+# Просмотр истории пользователями: страницы от новых к старым с фильтрами.
+# Отрисованные страницы кэшируются до следующей записи в историю
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 5))
+HISTORY_PAGE_CACHE_SIZE = 256
+HISTORY_FILTER_NAMES = {"genre": "🎭 Жанр", "year": "📅 Год", "style": "🖋 Стиль"}
+history_pages: Dict[tuple, tuple] = {}
+history_filter_values: Dict[str, str] = {}  # токен -> значение фильтра жанра или стиля
+
+def filter_token(value: str) -> str:
+    # callback_data ограничены 64 байтами, а кириллица занимает по 2 байта на букву:
+    # в кнопках вместо значения фильтра - короткий хэш
+    token = hashlib.sha1(value.encode("utf-8")).hexdigest()[:8]
+    history_filter_values[token] = value
+    return token
+
+def filter_value(name: str, token: str) -> Optional[str]:
+    if not token:
         return None
-
-# Обновлённая функция генерации рецензии
-async def generate_review(movie: dict) -> str:
-    style_description = STYLE_DESCRIPTIONS.get(
-        DB['current_style'],
-        "Стандартный аналитический стиль"
+    if token not in history_filter_values:
+        # После перезапуска токены кнопок старых сообщений восстанавливаются по истории
+        for value in history.distinct(name, limit=-1):
+            filter_token(value)
+    return history_filter_values.get(token)
+
+def history_callback(page: int, cursor: str, filters: dict, prefix: str = "hist") -> str:
+    # Курсор и фильтры передаются в самих callback-данных: "hist|стр|курсор|жанр|год|стиль".
+    # Курсор: "" - самые новые, "<seq" - старее записи seq, ">seq" - новее
+    genre, year, style = (filters.get(key) for key in HISTORY_FILTER_NAMES)
+    values = [filter_token(genre) if genre else "", str(year or ""), filter_token(style) if style else ""]
+    return "|".join([prefix, str(page), cursor, *values])
+
+def parse_history_callback(data: str) -> tuple:
+    _, page, cursor, genre, year, style = data.split("|")
+    filters = {
+        "genre": filter_value("genre", genre),
+        "year": int(year) if year.isdigit() else None,
+        "style": filter_value("style", style),
+    }
+    return int(page), cursor, filters
+
+def history_cursor(cursor: str) -> dict:
+    if cursor[1:].isdigit():
+        return {"before" if cursor[0] == "<" else "after": int(cursor[1:])}
+    return {}
+
+def history_entry(record: dict) -> str:
+    details = [record.get("date", "")[:10]]
+    details += [record[key] for key in ("genre", "style") if record.get(key)]
+    plot = record.get("plot", "").split("Review:")[0].strip()
+    year = f" ({record['year']})" if record.get("year") else ""
+    return (
+        f"*{escape_md(record.get('title', ''))}*{escape_md(year)}\n"
+        f"_{escape_md(' · '.join(details))}_\n"
+        f"{clip_md(plot, 300)}"
     )
 
-    system_prompt = (
-        f"{GENERAL_REVIEW_PROMPT}\n\n"
-        f"Стиль изложения: {DB['current_style']}\n"
-        f"Характеристики стиля: {style_description}"
-    )
+def render_history_page(page: int, cursor: str, filters: dict) -> tuple:
+    """Текст и клавиатура страницы истории; результат кэшируется.
+
+    ``page`` - только номер для заголовка, записи выбираются по курсору.
+    """
+    key = (page, cursor, tuple(filters.get(name) for name in HISTORY_FILTER_NAMES))
+    cached = history_pages.get(key)
+    if cached is not None:
+        return cached
+
+    total = history.count_matching(**filters)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    records = history.page(HISTORY_PAGE_SIZE, **history_cursor(cursor), **filters)
+    if cursor and (not records or cursor.startswith(">") and len(records) < HISTORY_PAGE_SIZE):
+        # Листание назад дошло до самых новых записей - это первая страница
+        page, cursor = 0, ""
+        records = history.page(HISTORY_PAGE_SIZE, **filters)
+    page = min(max(page, 0), pages - 1)
+
+    active = [f"{HISTORY_FILTER_NAMES[name]}: {value}" for name, value in filters.items() if value is not None]
+    header = f"📚 История рецензий - страница {page + 1} из {pages}"
+    if active:
+        header += "\n" + ", ".join(active)
+    body = "\n\n".join(history_entry(record) for record in records) or escape_md("Пока ничего не опубликовано.")
+    text = f"{escape_md(header)}\n\n{body}"
+
+    builder = InlineKeyboardBuilder()
+    if page > 0 and records:
+        builder.button(text="⬅️", callback_data=history_callback(page - 1, f">{records[0]['seq']}", filters))
+    if page < pages - 1 and records:
+        builder.button(text="➡️", callback_data=history_callback(page + 1, f"<{records[-1]['seq']}", filters))
+    for name, label in HISTORY_FILTER_NAMES.items():
+        builder.button(text=label, callback_data=history_callback(page, cursor, filters, prefix=f"histf_{name}"))
+    if active:
+        builder.button(text="✖️ Сбросить фильтры", callback_data=history_callback(0, "", {}))
+    navigation = bool(records) * ((page > 0) + (page < pages - 1))
+    builder.adjust(*([navigation] if navigation else []), len(HISTORY_FILTER_NAMES), 1)
+
+    result = (text, builder.as_markup())
+    if len(history_pages) >= HISTORY_PAGE_CACHE_SIZE:
+        history_pages.clear()
+    history_pages[key] = result
+    return result
+
+def parse_movie_batch(text: str, truncated: Optional[bool] = None) -> list:
+    data = movie_batch_output.parse(text, truncated)
+    return data["movies"] if data else []
+
+def take_movie_candidate(genre: str, used_ids: list, scope: Optional[str] = None) -> Optional[dict]:
+    pool = movie_candidates.get(genre, [])
+    for index, movie in enumerate(pool):
+        if movie["imdb_id"] not in used_ids and not history.is_taken(movie, scope):
+            return pool.pop(index)
+    return None
 
+# Обновлённая функция генерации рецензии.
+# Одновременные запросы одной рецензии (фильм в двух каналах, предзагрузка и
+# "Опубликовать сейчас") ждут один вызов GPT; результат не кэшируется -
+# следующий запрос получает новую рецензию
+@async_cached(
+    key=lambda movie, style: review_key(movie, style),
+    cache_if=lambda review: False
+)
+async def generate_fresh_review(movie: dict, style: str) -> Optional[str]:
     try:
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-4",
-            messages=[
+        review = await chat_completion(
+            "review",
+            [
                 {
                     "role": "system",
-                    "content": system_prompt
+                    "content": review_system_prompt(style)
                 },
                 {
                     "role": "user",
@@ -179,221 +617,498 @@ async def generate_review(movie: dict) -> str:
             temperature=0.5,
             max_tokens=1000
         )
-        return response.choices[0].message.content
     except Exception as e:
         logger.error(f"Ошибка генерации: {str(e)}")
-        return "Рецензия временно недоступна"
-
-# Обновлённая функция генерации фильмов
-async def get_movie_data(genre: str, attempt: int = 0, used_ids: list = None):
-    if attempt >= 3:
         return None
-    if used_ids is None:
-        used_ids = []
+    return review
 
-    try:
-        # Экранируем и форматируем ID
-        safe_ids = [id.replace('_', r'\_') for id in used_ids]
-        avoid_ids = ", ".join(safe_ids[-50:]) if safe_ids else "нет запрещённых ID"
+def review_key(movie: dict, style: str) -> tuple:
+    return (
+        movie.get("imdb_id") or title_year_key(movie["title"], movie["year"]),
+        style,
+        review_prompt_hash(style)
+    )
 
-        full_prompt = MOVIE_PROMPT.format(
-            genre=escape_md(genre),
-            avoid_ids=avoid_ids
+async def generate_review(movie: dict, style: Optional[str] = None) -> str:
+    style = style or DB['current_style']
+    key = review_key(movie, style)
+    if DB.get("fast_reviews"):
+        review = reviews.take(key)
+        if review is not None:
+            # Готовый вариант отдается сразу, пул пополняется в фоне
+            # Пополнение пула - всегда отдельный вызов, иначе в пул попал бы уже выданный вариант
+            reviews.refill(key, lambda: generate_fresh_review.refresh(movie, style))
+            return review
+
+    review = await generate_fresh_review(movie, style)
+    if review is None:
+        return REVIEW_UNAVAILABLE
+    reviews.add(key, review)
+    return review
+
+@async_cached(
+    ttl=LLM_CACHE_TTL,
+    maxsize=256,
+    key=lambda movie: (movie["imdb_id"], PROMPT_VERSION),
+    cache_if=lambda plot: plot is not None
+)
+async def describe_movie(movie: dict) -> Optional[str]:
+    """Сюжет фильма из каталога - фильм уже выбран, GPT только пересказывает."""
+    try:
+        plot = await chat_completion(
+            "movie_plot",
+            [
+                {"role": "system", "content": PLOT_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Фильм: {movie['title']} ({movie['year']}), IMDb {movie['imdb_id']}"}
+            ],
+            temperature=0.3,
+            max_tokens=300
         )
+        return plot.strip() or None
+    except Exception as e:
+        logger.error(f"Ошибка генерации сюжета: {str(e)}")
+        return None
 
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-4",
-            messages=[{"role": "user", "content": full_prompt}],
-            temperature=0.7 + attempt * 0.1
-        )
+async def pick_catalog_movie(genre: str, used_ids: list, scope: Optional[str]) -> Optional[dict]:
+    if catalog is None:
+        return None
+    used = set(used_ids)
+    movie = catalog.sample(
+        genre,
+        min_year=CATALOG_MIN_YEAR,
+        min_rating=CATALOG_MIN_RATING,
+        exclude=lambda m: m["imdb_id"] in used or history.is_taken(m, scope)
+    )
+    if movie is None:
+        return None
+    plot = await describe_movie(movie)
+    if not plot:
+        return None
+    return {"imdb_id": movie["imdb_id"], "title": movie["title"], "year": movie["year"], "plot": plot}
 
-        raw_text = response.choices[0].message.content
-        movie = parse_movie_response(raw_text)
+# Обновлённая функция генерации фильмов.
+# Не кэшируется: каждый вызов должен вернуть новый фильм (берет кандидата из пула)
+async def get_movie_data(genre: str, attempt: int = 0, used_ids: list = None, scope: Optional[str] = None):
+    if used_ids is None:
+        used_ids = []
 
-        if not movie or movie["imdb_id"] in used_ids:
-            return await get_movie_data(genre, attempt+1, used_ids)
+    # Если есть локальный каталог - фильм выбирается из него без запроса к GPT
+    movie = await pick_catalog_movie(genre, used_ids, scope)
+    if movie:
+        return movie
 
+    # Затем - кандидаты, оставшиеся от прошлых пакетов
+    movie = take_movie_candidate(genre, used_ids, scope)
+    if movie:
         return movie
 
-    except Exception as e:
-        logger.error(f"Попытка {attempt + 1} неудачна: {str(e)}")
-        return await get_movie_data(genre, attempt+1, used_ids)
+    pool = movie_candidates.setdefault(genre, [])
+    first_attempt = attempt
+    for attempt in range(attempt, 3):
+        if attempt > first_attempt:
+            STAGE_RETRIES.inc(stage="movie_data")
+        try:
+            avoid = compact_avoid_list(
+                [
+                    [m["imdb_id"] for m in pool],
+                    reversed(history.recent_ids(AVOID_LIST_SIZE // 2, scope, genre=genre)),
+                    reversed(used_ids),
+                ],
+                AVOID_LIST_SIZE
+            )
 
-# МЕДИА-ФУНКЦИИ
-def get_movie_poster(movie_data: dict) -> Optional[str]:
-    omdb_api_key = os.getenv("OMDB_API_KEY")
+            raw_text, truncated = await chat_completion_ended(
+                "movie_batch",
+                [
+                    {"role": "system", "content": MOVIE_SYSTEM_PROMPT},
+                    {"role": "user", "content": MOVIE_PROMPT.format(
+                        count=MOVIE_BATCH_SIZE,
+                        genre=escape_md(genre),
+                        avoid_ids=", ".join(avoid) if avoid else "нет"
+                    )}
+                ],
+                temperature=0.7 + attempt * 0.1
+            )
 
-    # Пытаемся найти по IMDB ID для обычных фильмов
-    if movie_data["imdb_id"].startswith("tt"):
-        url = f"http://www.omdbapi.com/?i={movie_data['imdb_id']}&apikey={omdb_api_key}"
-    else:  # Для кастомных рецензий ищем по названию и году
-        url = (f"http://www.omdbapi.com/?t={movie_data['title']}"
-               f"&y={movie_data['year']}&apikey={omdb_api_key}")
+            # Отсеиваем дубликаты внутри пакета и уже опубликованные фильмы
+            seen = set(used_ids) | {m["imdb_id"] for m in pool}
+            fresh = []
+            for candidate in parse_movie_batch(raw_text, truncated):
+                if candidate["imdb_id"] in seen or history.is_taken(candidate, scope):
+                    DUPLICATES.inc(source="batch")
+                    continue
+                seen.add(candidate["imdb_id"])
+                fresh.append(candidate)
+
+            # Оставшихся проверяем в OMDb параллельно
+            checks = await asyncio.gather(*(verify_imdb_id(m["imdb_id"]) for m in fresh))
+            verified = [m for m, ok in zip(fresh, checks) if ok]
+            logger.info(f"Пакет кандидатов: новых {len(fresh)}, подтверждено {len(verified)}")
+
+            if verified:
+                pool.extend(verified[1:])
+                del pool[:-MOVIE_POOL_LIMIT]
+                return verified[0]
+
+        except CircuitOpenError as e:
+            logger.error(f"Генерация фильмов прервана: {str(e)}")
+            break
+        except Exception as e:
+            logger.error(f"Попытка {attempt + 1} неудачна: {str(e)}")
 
+    return None
+
+# МЕДИА-ФУНКЦИИ
+async def get_movie_poster(movie_data: dict) -> Optional[str]:
     try:
-        response = requests.get(url)
-        if response.ok:
-            data = response.json()
-            if data.get('Response') == 'True':
-                return data.get("Poster") if data.get("Poster") != "N/A" else None
+        data = {}
+        imdb_id = movie_data["imdb_id"]
+        if imdb_id.startswith("tt"):
+            data = await omdb.get_by_id(imdb_id)
+
+        if data.get('Response') != 'True' and title_index is not None:
+            # ID не из IMDb или OMDb его не знает (LLM ошибся в цифрах) - ищем по
+            # названию в локальном индексе: он понимает и русские названия, в отличие от t= в OMDb
+            matches = title_index.search(movie_data["title"], movie_data["year"], limit=1)
+            if matches and matches[0]["score"] >= TITLE_MATCH_SCORE and matches[0]["imdb_id"] != imdb_id:
+                data = await omdb.get_by_id(matches[0]["imdb_id"])
+
+        if data.get('Response') != 'True':  # Последняя попытка - поиск OMDb по названию и году
+            data = await omdb.get_by_title(movie_data["title"], movie_data["year"])
+
+        if data.get('Response') == 'True':
+            return data.get("Poster") if data.get("Poster") != "N/A" else None
     except Exception as e:
         logger.error(f"Ошибка получения постера: {e}")
     return None
 
 async def get_movie_media(imdb_id: str) -> dict:
-    omdb_api_key = os.getenv("OMDB_API_KEY")
-    url = f"http://www.omdbapi.com/?i={imdb_id}&apikey={omdb_api_key}"
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
-                return {
-                    "poster": data.get('Poster'),
-                    "trailer": f"https://www.imdb.com/title/{imdb_id}/videogallery"
-                }
+        data = await omdb.get_by_id(imdb_id)
+        return {
+            "poster": data.get('Poster'),
+            "trailer": f"https://www.imdb.com/title/{imdb_id}/videogallery"
+        }
     except Exception as e:
         logger.error(f"Ошибка получения медиа: {str(e)}")
         return {}
 
 # Основная логика публикации
-async def send_post_with_media(movie: dict, review: str):
-    movie_data = {
-        "imdb_id": movie["imdb_id"],
-        "title": movie['title'],
-        "year": movie['year']
-    }
-
-    poster_url = get_movie_poster(movie_data)
-
-    # Экранируем ВСЕ динамические данные
-    escaped_title = escape_md(movie['title'])
-    escaped_year = escape_md(str(movie['year']))
-    escaped_genre = escape_md(DB['current_genre'])
-    escaped_style = escape_md(DB['current_style'])
-    escaped_review = escape_md(review)
+# Ошибки Telegram про саму картинку - есть смысл попробовать следующий источник.
+# Остальные (разметка подписи, недоступный чат) от источника не зависят
+PHOTO_SOURCE_ERRORS = re.compile(
+    r"file identifier|file reference|HTTP URL|web page content|IMAGE_PROCESS_FAILED|PHOTO_", re.IGNORECASE
+)
+FILE_ID_ERRORS = re.compile(r"file identifier|file reference", re.IGNORECASE)
+
+async def send_poster(chat_id: str, imdb_id: Optional[str], poster_url: str, caption: str) -> bool:
+    """Отправляет постер с подписью; False - картинку отправить не удалось.
+
+    Источники перебираются от дешевого к дорогому: сохраненный ``file_id``,
+    локальный файл, исходный URL. ``file_id`` забывается, только если
+    Telegram отверг именно его; при ошибке подписи перебор прекращается.
+    """
+    if not imdb_id:
+        sources = [("url", poster_url)]
+    else:
+        await posters.fetch(imdb_id, poster_url)
+        sources = posters.sources(imdb_id, poster_url)
 
-    # Формируем текст с правильным экранированием
-    caption = (
-        f"🎬 *{escaped_title}* \\({escaped_year}\\)\n\n"
-        f"📖 Жанр: {escaped_genre}\n"
-        f"📝 Рецензия \\({escaped_style}\\):\n{escaped_review}"
-    )
+    for kind, photo in sources:
+        try:
+            sent = await bot.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=caption,
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+        except TelegramBadRequest as e:
+            logger.error(f"Постер не отправлен ({imdb_id}, {kind}): {str(e)}")
+            if not PHOTO_SOURCE_ERRORS.search(e.message):
+                return False
+            if kind == "file_id" and FILE_ID_ERRORS.search(e.message):
+                posters.forget_file_id(imdb_id)
+            continue
+        if imdb_id:
+            posters.remember(imdb_id, sent, kind)
+        return True
+    return False
+
+async def send_post_with_media(
+    caption: str,
+    poster_url: Optional[str],
+    follow_ups: list = (),
+    chat_id: Optional[str] = None,
+    imdb_id: Optional[str] = None,
+    delivered: Optional[list] = None
+):
+    """Отправляет пост; в ``delivered`` (если передан) добавляется каждая ушедшая часть."""
+    chat_id = chat_id or CHANNEL_ID
+    delivered = delivered if delivered is not None else []
     logger.info(f"Подпись: {caption} ")
     logger.info(f"Длина подписи: {len(caption)} символов")
-    if poster_url:
-        await bot.send_photo(
-            chat_id=CHANNEL_ID,
-            photo=poster_url,
-            caption=caption,
+    imdb_id = imdb_id if imdb_id and imdb_id.startswith("tt") else None
+    if not (poster_url and await send_poster(chat_id, imdb_id, poster_url, caption)):
+        # Без постера (или если картинку отправить не удалось) пост уходит текстом
+        await bot.send_message(
+            chat_id,
+            text=caption,
             parse_mode=ParseMode.MARKDOWN_V2
         )
-    else:
+    delivered.append("caption")
+    # Продолжение рецензии, не поместившееся в подпись
+    for text in follow_ups:
         await bot.send_message(
-            CHANNEL_ID,
-            text=caption,
+            chat_id,
+            text=text,
             parse_mode=ParseMode.MARKDOWN_V2
         )
+        delivered.append("follow_up")
 
-async def publish_scheduled_post_with_movie(movie: dict):
-    try:
-        review = await generate_review(movie)
-        await send_post_with_media(movie, review)
-        DB["posted_imdb_ids"].append(movie["imdb_id"])
-        save_to_history(movie)
-    except Exception as e:
-        logger.error(f"Ошибка публикации: {str(e)}")
-        await notify_admin(f"🔥 Ошибка публикации: {str(e)}")
+# ПОДГОТОВКА ПОСТА: граф этапов - фильм -> {проверка ID, рецензия, постер} -> подпись.
+# Рецензия и постер не ждут друг друга и проверки ID; отвергнутый фильм
+# останавливает граф, и незаконченные этапы отменяются
+REVIEW_STAGE_TIMEOUT = float(os.getenv("REVIEW_STAGE_TIMEOUT", 180))
+VERIFY_STAGE_TIMEOUT = float(os.getenv("VERIFY_STAGE_TIMEOUT", 30))
+POSTER_STAGE_TIMEOUT = float(os.getenv("POSTER_STAGE_TIMEOUT", 30))
+SEND_STAGE_TIMEOUT = float(os.getenv("SEND_STAGE_TIMEOUT", 120))
 
-# ОБРАБОТКА ДУБЛИКАТОВ
-async def handle_duplicate(movie: dict):
-    logger.warning(f"Дубликат IMDB ID: {movie['imdb_id']}")
-    used_ids = DB["posted_imdb_ids"][-100:]  # Берем последние 100 ID
-    new_movie = await get_movie_data(DB["current_genre"], used_ids=used_ids)
+class RejectedMovie(Exception):
+    """Фильм уже публиковался или его IMDB ID не существует - нужен другой."""
 
-    if new_movie and new_movie["imdb_id"] not in DB["posted_imdb_ids"]:
-        await publish_scheduled_post_with_movie(new_movie)
-    else:
-        await notify_admin(f"⚠️ Не удалось найти уникальный фильм после дубликата {movie['imdb_id']}")
-
-# СУЩЕСТВУЮЩИЕ ФУНКЦИИ ПУБЛИКАЦИИ
-async def publish_scheduled_post():
-    used_ids = DB["posted_imdb_ids"][-100:]  # Последние 100 фильмов
-    movie = await get_movie_data(DB["current_genre"], used_ids=used_ids)
+    def __init__(self, movie: dict, reason: str):
+        super().__init__(f"{reason}: {movie['imdb_id']}")
+        self.movie = movie
 
+async def select_movie_stage(results: dict) -> dict:
+    movie = await get_movie_data(results["genre"], used_ids=results["used_ids"], scope=results["scope"])
     if not movie:
-        await notify_admin("❌ Не удалось получить данные фильма\!")
-        return
-   # await publish_scheduled_post_with_movie(movie) #
-
-    if movie["imdb_id"] in DB["posted_imdb_ids"]:
-        await handle_duplicate(movie)
-        return
+        raise LookupError(f"нет фильма в жанре {results['genre']}")
+    # Резерв сразу при выборе: другой канал с той же областью проверки
+    # повторов не получит этот фильм, пока пост не опубликован или не отброшен
+    if movie["imdb_id"] in results["exclude_ids"] or not history.reserve(movie, results["scope"]):
+        DUPLICATES.inc(source="prepare")
+        raise RejectedMovie(movie, "Дубликат IMDB ID")
+    results["reserved"].append(movie)
+    return movie
+
+async def verify_stage(results: dict) -> bool:
+    if not await verify_imdb_id(results["movie_data"]["imdb_id"]):
+        raise RejectedMovie(results["movie_data"], "Недействительный IMDB ID")
+    return True
+
+async def review_stage(results: dict) -> str:
+    review = await generate_review(results["movie_data"], results["style"])
+    if review == REVIEW_UNAVAILABLE:
+        raise RuntimeError(REVIEW_UNAVAILABLE)
+    return review
+
+async def poster_stage(results: dict) -> Optional[str]:
+    movie = results.get("movie_data") or results["movie"]
+    poster_url = await get_movie_poster(movie)
+    if poster_url and movie["imdb_id"].startswith("tt"):
+        # Картинка скачивается заранее, вместе с подготовкой поста
+        await posters.fetch(movie["imdb_id"], poster_url)
+    return poster_url
+
+async def render_scheduled_stage(results: dict) -> dict:
+    return render_post(
+        "scheduled", results["movie_data"], results["review"], results["genre"], results["style"],
+        with_photo=bool(results["poster"])
+    )
 
-    try:
-        review = await generate_review(movie)
+prepare_pipeline = Pipeline("prepare", [
+    Stage("movie_data", select_movie_stage),
+    Stage("verify", verify_stage, after=["movie_data"], timeout=VERIFY_STAGE_TIMEOUT),
+    Stage("review", review_stage, after=["movie_data"], timeout=REVIEW_STAGE_TIMEOUT),
+    # Без постера пост уходит текстом
+    Stage("poster", poster_stage, after=["movie_data"], timeout=POSTER_STAGE_TIMEOUT, fallback=None),
+    Stage("render", render_scheduled_stage, after=["verify", "review", "poster"]),
+])
+
+async def prepare_post(
+    genre: str,
+    style: str,
+    scope: Optional[str] = MAIN_CHANNEL,
+    exclude_ids: list = ()
+) -> Optional[dict]:
+    # Последние 100 фильмов (в пределах канала или всех каналов) и уже подготовленные
+    used_ids = history.recent_ids(100, scope) + list(exclude_ids)
+
+    # Дубликат или несуществующий ID - одна повторная попытка с расширенным списком исключений
+    for _ in range(2):
+        reserved = []
+        try:
+            results = await prepare_pipeline.run(
+                genre=genre, style=style, scope=scope, used_ids=used_ids, exclude_ids=list(exclude_ids),
+                reserved=reserved
+            )
+        except BaseException as e:
+            # Пост не состоялся (в том числе отмена предзагрузки) - фильм снова свободен
+            for movie in reserved:
+                history.release(movie, scope)
+            if not isinstance(e, StageFailed):
+                raise
+            if not isinstance(e.cause, RejectedMovie):
+                logger.warning(f"Пост не подготовлен: {str(e)}")
+                return None
+            logger.warning(str(e.cause))
+            STAGE_RETRIES.inc(stage="movie_data")
+            used_ids = used_ids + [e.cause.movie["imdb_id"]]
+            continue
 
-        # Получаем данные для медиа
-        movie_data = {
-            "imdb_id": movie["imdb_id"],
-            "title": movie['title'],
-            "year": movie['year']
+        return {
+            "movie": results["movie_data"],
+            "review": results["review"],
+            "poster_url": results["poster"],
+            **results["render"],
+            "genre": genre,
+            "style": style,
+            "scope": scope,
+            "prepared_at": datetime.now().isoformat()
         }
 
-        # Используем ту же логику, что и в ручной публикации
-        poster_url = get_movie_poster(movie_data)
+    logger.warning(f"Не удалось найти уникальный фильм в жанре {genre}")
+    return None
 
-        # Формируем текст поста
-        escaped_title = escape_md(movie['title'])
-        escaped_year = escape_md(str(movie['year']))
-        escaped_genre = escape_md(DB['current_genre'])
-        escaped_style = escape_md(DB['current_style'])
-        escaped_review = escape_md(review)
+def release_post(post: dict):
+    """Снимает резерв фильма поста, который опубликован или уже не будет опубликован."""
+    history.release(post["movie"], post["scope"])
 
-        caption = (
-            f"🎬 *{escaped_title}* \\({escaped_year}\\)\n\n"
-            f"📖 Жанр: {escaped_genre}\n"
-            f"📝 Рецензия \\({escaped_style}\\):\n{escaped_review}"
-        )
-        logger.info(f"Подпись: {caption} ")
-        logger.info(f"Длина подписи: {len(caption)} символов")
-
-        # Отправка с постером или без
-        if poster_url:
-            await bot.send_photo(
-                chat_id=CHANNEL_ID,
-                photo=poster_url,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-        else:
-            await bot.send_message(
-                CHANNEL_ID,
-                text=caption,
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
+# Буфер заранее подготовленных постов для публикации по расписанию
+prefetcher = PostPrefetcher(
+    prepare_post,
+    buffer_size=int(os.getenv("PREFETCH_BUFFER_SIZE", "2")),
+    discard=release_post
+)
 
-        DB["posted_imdb_ids"].append(movie["imdb_id"])
-        save_to_history(movie)
+def start_prefetch():
+    for profile in channel_profiles():
+        prefetcher.start(profile["genre"], profile["style"], dedupe_scope(profile))
 
-    except Exception as e:
-        logger.error(f"Ошибка публикации: {str(e)}")
-        await notify_admin(f"🔥 Ошибка публикации: {str(e)}")
+# СУЩЕСТВУЮЩИЕ ФУНКЦИИ ПУБЛИКАЦИИ
+async def prepared_post_stage(results: dict) -> dict:
+    genre, style, scope = results["genre"], results["style"], results["scope"]
+    # Обычно пост уже готов - остается только отправить
+    post = prefetcher.take(genre, style, scope, is_stale=lambda p: history.is_posted(p["movie"], scope))
+    if post is None:
+        logger.warning(f"Буфер предзагрузки пуст, готовим пост на месте{results['channel_note']}")
+        post = await prepare_post(genre, style, scope)
+    if not post:
+        raise LookupError("Не удалось получить данные фильма")
+    return post
+
+async def send_scheduled_stage(results: dict):
+    post = results["prepare"]
+    # Список общий с копией результатов в StageFailed: видно, ушло ли что-то до сбоя
+    results["delivered"] = []
+    await send_post_with_media(
+        post["caption"], post["poster_url"], post["follow_ups"],
+        chat_id=results["chat_id"], imdb_id=post["movie"]["imdb_id"], delivered=results["delivered"]
+    )
+
+async def record_scheduled_stage(results: dict):
+    save_to_history(results["prepare"]["movie"], genre=results["genre"], style=results["style"], channel=results["channel"])
+    # Теперь повтор отсекает сама история
+    release_post(results["prepare"])
+
+# Публикация по расписанию: готовый пост -> отправка -> запись в историю.
+# Запись не фоновая: пока ее нет, повтор фильма отсекает только резерв в памяти
+publish_pipeline = Pipeline("publish", [
+    Stage("prepare", prepared_post_stage),
+    Stage("send", send_scheduled_stage, after=["prepare"], timeout=SEND_STAGE_TIMEOUT),
+    Stage("record", record_scheduled_stage, after=["send"]),
+])
+
+async def publish_scheduled_post(profile: Optional[dict] = None) -> bool:
+    """Публикует пост в канал; False - в канал ничего не ушло, слот можно повторить."""
+    profile = profile or main_channel_profile()
+    channel_note = "" if profile["id"] == MAIN_CHANNEL else f" [{profile['id']}]"
+    try:
+        await publish_pipeline.run(
+            genre=profile["genre"], style=profile["style"], scope=dedupe_scope(profile),
+            chat_id=profile["chat_id"], channel=profile["id"], channel_note=channel_note
+        )
+    except StageFailed as e:
+        if e.stage == "prepare":
+            await notify_admin(escape_md(f"❌ Не удалось получить данные фильма!{channel_note}"))
+            return False
+        sent = e.stage != "send" or bool(e.results.get("delivered"))
+        if e.stage == "send":
+            if sent:
+                # Часть поста уже в канале - фильм засчитан, повторять его нельзя
+                try:
+                    await record_scheduled_stage(e.results)
+                except Exception as record_error:
+                    logger.error(f"Не удалось записать в историю{channel_note}: {str(record_error)}")
+            else:
+                release_post(e.results["prepare"])
+        logger.error(f"Ошибка публикации{channel_note}: {str(e.cause)}")
+        await notify_admin(escape_md(f"🔥 Ошибка публикации{channel_note}: {str(e.cause)}"))
+        return sent
+    return True
+
+def slot_time(schedule: str) -> str:
+    """Номинальное время слота: у опоздавшего срабатывания - то, на которое оно было назначено."""
+    job = scheduler.get_job(f"publish_job:{schedule}")
+    if job is None:
+        return datetime.now().strftime("%Y-%m-%dT%H:%M")
+    now = datetime.now(job.trigger.timezone)
+    nominal = job.trigger.get_next_fire_time(None, now - timedelta(seconds=SLOT_GRACE))
+    if nominal is not None and nominal <= now:
+        now = nominal
+    return now.strftime("%Y-%m-%dT%H:%M")
+
+async def publish_slot(schedule: str):
+    """Публикует во все каналы, у которых совпадает время, параллельно."""
+    if leader is not None and not leader.is_leader:
+        logger.info(f"Слот {schedule}: публикует реплика-лидер")
+        return
+    slot = slot_time(schedule)
+
+    async def publish_limited(profile: dict):
+        async with channel_semaphore:
+            if publish_keys is not None and not await publish_keys.claim(profile["id"], slot):
+                logger.warning(f"Слот {slot} канала {profile['id']} уже опубликован")
+                return
+            published = await publish_scheduled_post(profile)
+            if not published and publish_keys is not None:
+                # Пост не ушел - повторная попытка для этого слота разрешена
+                await publish_keys.release(profile["id"], slot)
+
+    profiles = [p for p in channel_profiles() if p["schedule"] == schedule]
+    await asyncio.gather(*(publish_limited(p) for p in profiles))
+
+def reschedule_publishing():
+    for job in scheduler.get_jobs():
+        if job.id.startswith("publish_job"):
+            job.remove()
+    # Одно задание на каждое уникальное время публикации
+    for schedule in {p["schedule"] for p in channel_profiles()}:
+        scheduler.add_job(
+            publish_slot,
+            trigger='cron',
+            args=[schedule],
+            **parse_cron(schedule),
+            id=f"publish_job:{schedule}"
+        )
 
 # Уведомления админа
 async def notify_admin(message: str):
-    for admin in ADMINS:
-        await bot.send_message(admin, message)
+    results = await asyncio.gather(
+        *(bot.send_message(admin, message) for admin in ADMINS), return_exceptions=True
+    )
+    for admin, result in zip(ADMINS, results):
+        if isinstance(result, Exception):
+            logger.error(f"Не удалось уведомить админа {admin}: {str(result)}")
 
 async def verify_imdb_id(imdb_id: str) -> bool:
-    omdb_api_key = os.getenv("OMDB_API_KEY")
-    url = f"http://www.omdbapi.com/?i={imdb_id}&apikey={omdb_api_key}"
-
+    # ID из каталога существует наверняка; новинок в каталоге может не быть - их проверяет OMDb
+    if catalog is not None and catalog.has_id(imdb_id):
+        return True
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
-                return data.get('Response') == 'True'
+        data = await omdb.get_by_id(imdb_id)
+        return data.get('Response') == 'True'
     except Exception as e:
         logger.error(f"Ошибка верификации IMDB ID: {str(e)}")
         return False
@@ -409,7 +1124,7 @@ def admin_menu_keyboard() -> ReplyKeyboardMarkup: #
     builder.row(KeyboardButton(text="🔙 В меню"))
     return builder.as_markup(resize_keyboard=True)
 
-@dp.message(F.text.in_(["🔙 В меню", "/admin"]))
+@admin_buttons.button("🔙 В меню", "/admin")
 async def return_to_admin_menu(message: types.Message, state: FSMContext):
     """Обработчик возврата в админ-панель из любого места"""
     await state.clear()
@@ -429,12 +1144,34 @@ async def admin_panel(message: types.Message):
     except:
         current_time = "⏰ Не установлено"
 
+    cache_stats = omdb.cache.stats()
+    send_stats = outbound.summary()
+    depth = send_stats["depth"]
+    latency = f"{send_stats['latency_p50']:.2f}/{send_stats['latency_p95']:.2f}"
+    tokens = token_ledger.day_total()
+    stage_means = STAGE_SECONDS.means("stage")
+    stages = ", ".join(
+        f"{stage} {mean * 1000:.0f}" for stage, (_, mean) in sorted(stage_means.items())
+    ) or "нет данных"
     status_text = (
         f"⚙️ *{escape_md('Админ-панель')}*\n\n"  # Экранируем статический текст
         f"▫️ Жанр: {escape_md(DB['current_genre'])}\n"
         f"▫️ Стиль: {escape_md(DB['current_style'])}\n"
-        f"▫️ Время: {escape_md(current_time)}\n\n"
-        f"Опубликовано фильмов: {escape_md(str(len(DB['posted_imdb_ids'])))}"  # Число тоже экранируем
+        f"▫️ Время: {escape_md(current_time)}\n"
+        f"▫️ Рецензии: {'из пула, быстро' if DB.get('fast_reviews') else 'всегда новые'}\n\n"
+        f"Опубликовано фильмов: {escape_md(str(history.count()))}\n"  # Число тоже экранируем
+        f"OMDb кэш: {cache_stats['hits']} попаданий / {cache_stats['misses']} промахов\n"
+        f"Очередь отправки: {depth['channel']}/{depth['user']}/{depth['admin']}, "
+        f"доставлено {send_stats['delivered']}, RetryAfter {send_stats['retry_after']}, "
+        f"ошибок {send_stats['failed']}, "
+        f"p50/p95 {escape_md(latency)} с\n"
+        f"Этапы, среднее мс: {escape_md(stages)}\n"
+        f"Ошибки: этапы {STAGE_ERRORS.total():.0f}, сервисы {UPSTREAM_ERRORS.total():.0f}, "
+        f"дубликаты {DUPLICATES.total():.0f}\n"
+        f"Ответы модели: исправлено {LLM_PARSE.total(outcome='repaired'):.0f}, "
+        f"не разобрано {LLM_PARSE.total(outcome='failed'):.0f} из {LLM_PARSE.total():.0f}\n"
+        f"Токены за сегодня: {tokens['prompt']} промпт / {tokens['completion']} ответ "
+        f"за {tokens['calls']} запросов"
     )
     logger.debug(f"Raw text before sending: {status_text}")
     builder = ReplyKeyboardBuilder()
@@ -448,8 +1185,9 @@ async def admin_panel(message: types.Message):
     )
     builder.row(
         KeyboardButton(text="📝 Создать рецензию"),
-        KeyboardButton(text="🔙 В меню")
+        KeyboardButton(text="⚡ Режим рецензий")
     )
+    builder.row(KeyboardButton(text="🔙 В меню"))
 
     await message.answer(
         status_text,
@@ -460,7 +1198,7 @@ async def admin_panel(message: types.Message):
     )
 
 # ОБРАБОТЧИКИ СООБЩЕНИЙ
-@dp.message(F.text == "/start")
+@user_router.message(F.text == "/start")
 async def cmd_start(message: types.Message):
     if message.from_user.id in ADMINS:
         await admin_panel(message)
@@ -476,40 +1214,105 @@ async def cmd_start(message: types.Message):
             input_field_placeholder="Выберите действие..."
         )
         await message.answer(
-            "🍿 Добро пожаловать в Кинобот!\n"
-            "Здесь вы можете:\n"
-            "- Читать профессиональные рецензии\n"
-            " - Искать фильмы по жанру\n"        
-            "- Узнавать о новых релизах",
-        reply_markup = markup
+            escape_md(
+                "🍿 Добро пожаловать в Кинобот!\n"
+                "Здесь вы можете:\n"
+                "- Читать профессиональные рецензии\n"
+                "- Искать фильмы по жанру\n"
+                "- Узнавать о новых релизах"
+            ),
+            reply_markup=markup
         )
 
-        @dp.message(F.text == "ℹ️ Помощь")
-        async def show_help(message: types.Message):
-            help_text = (
-                "🔍 *Основные возможности:*\n\n"
-                "🎯 Автоматические публикации:\n"
-                "- Ежедневные рецензии\n"
-                "- Подборки по жанрам\n"
-                "- Новинки кинопроката\n\n"
-                "🔎 Поиск фильмов:\n"
-                "- По названию\n"
-                "- По жанру\n"
-                "- По году выпуска\n\n"
-                "⚙️ Персонализация:\n"
-                "- Настройка уведомлений\n"
-                "- Выбор любимых жанров\n"
-                "- История просмотров"
-            )
+@user_buttons.button("ℹ️ Помощь")
+async def show_help(message: types.Message, state: FSMContext):
+    help_text = (
+        "🔍 *Основные возможности:*\n\n" + escape_md(
+            "🎯 Автоматические публикации:\n"
+            "- Ежедневные рецензии\n"
+            "- Подборки по жанрам\n"
+            "- Новинки кинопроката\n\n"
+            "🔎 Поиск фильмов:\n"
+            "- По названию\n"
+            "- По жанру\n"
+            "- По году выпуска\n\n"
+            "⚙️ Персонализация:\n"
+            "- Настройка уведомлений\n"
+            "- Выбор любимых жанров\n"
+            "- История просмотров"
+        )
+    )
 
-            await message.answer(
-                help_text,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                reply_markup=ReplyKeyboardRemove()
-            )
+    await message.answer(
+        help_text,
+        parse_mode=ParseMode.MARKDOWN_V2,
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+
+@user_buttons.button("📚 История рецензий")
+async def show_history(message: types.Message, state: FSMContext):
+    text, markup = render_history_page(0, "", {})
+    await message.answer(text, reply_markup=markup)
+
+@user_router.callback_query(F.data.startswith("hist|"))
+async def history_page_selected(callback: types.CallbackQuery):
+    page, cursor, filters = parse_history_callback(callback.data)
+    text, markup = render_history_page(page, cursor, filters)
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.error(f"История: страница не показана: {e}")
+        # Иначе - повторное нажатие на ту же страницу
+    await callback.answer()
+
+@user_router.callback_query(F.data.startswith("histf_"))
+async def history_filter_menu(callback: types.CallbackQuery):
+    name = callback.data.split("|", 1)[0][len("histf_"):]
+    page, cursor, filters = parse_history_callback(callback.data)
+    builder = InlineKeyboardBuilder()
+    for value in history.distinct(name):
+        builder.button(text=str(value), callback_data=history_callback(0, "", {**filters, name: value}))
+    builder.button(text="Любой", callback_data=history_callback(0, "", {**filters, name: None}))
+    builder.button(text="🔙 Назад", callback_data=history_callback(page, cursor, filters))
+    builder.adjust(3)
+    await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
+    await callback.answer()
+
+# Жанр ручных публикаций: в подписи поста и в истории (фильтр по жанру)
+CUSTOM_GENRE = "Выбор пользователя"
+
+async def render_custom_stage(results: dict) -> dict:
+    return render_post(
+        "custom", results["movie"], results["review"], CUSTOM_GENRE, results["style"],
+        with_photo=bool(results["poster"])
+    )
+
+async def send_custom_stage(results: dict):
+    rendered = results["render"]
+    await send_post_with_media(
+        rendered["caption"], results["poster"], rendered["follow_ups"], imdb_id=results["movie"]["imdb_id"]
+    )
+
+async def record_custom_stage(results: dict):
+    movie = results["movie"]
+    save_to_history({
+        "imdb_id": movie["imdb_id"],
+        "title": movie['title'],
+        "year": movie['year'],
+        "plot": movie.get('plot', '')
+    }, genre=CUSTOM_GENRE, style=results["style"])
+
+# Ручная публикация готовой рецензии: постер -> подпись -> отправка -> история
+publish_now_pipeline = Pipeline("publish_now", [
+    Stage("poster", poster_stage, timeout=POSTER_STAGE_TIMEOUT, fallback=None),
+    Stage("render", render_custom_stage, after=["poster"]),
+    Stage("send", send_custom_stage, after=["render"], timeout=SEND_STAGE_TIMEOUT),
+    Stage("record", record_custom_stage, after=["send"]),
+])
 
 # Модифицированный обработчик публикации
-@dp.message(F.text == "🚀 Опубликовать сейчас")
+@admin_buttons.button("🚀 Опубликовать сейчас")
 async def publish_now_handler(message: types.Message, state: FSMContext):
     logger.warning("start")
     if message.from_user.id not in ADMINS:
@@ -523,55 +1326,7 @@ async def publish_now_handler(message: types.Message, state: FSMContext):
     logger.info(movie)
     if movie and review:
         try:
-            # Получаем данные для поиска постера
-            movie_data = {
-                "imdb_id": movie["imdb_id"],
-                "title": movie['title'],
-                "year": movie['year']
-            }
-
-            poster_url = get_movie_poster(movie_data)
-            logger.warning("Poster url")
-            logger.warning(poster_url)
-
-            # Экранирование текста
-            escaped_title = escape_md(movie['title'])
-            escaped_year = escape_md(str(movie['year']))
-            escaped_style = escape_md(DB['current_style'])
-          #  escaped_plot = escape_md(movie['plot'])
-            escaped_genre= "Выбор пользователя"
-            escaped_review = escape_md(review)
-
-            caption = (
-                f"🎬 *{escaped_title}* \\({escaped_year}\\)\n\n"
-                f"📖 Жанр: {escaped_genre}\n"
-                f"📚 Сюжет: {escape_md(movie['plot'])[:200]}\n\n"
-                f"📝 Рецензия \\({escaped_style}\\):\n{escaped_review}"
-            )
-
-            # Отправка поста с постером или без
-            if poster_url:
-                await bot.send_photo(
-                    chat_id=CHANNEL_ID,
-                    photo=poster_url,
-                    caption=caption,
-                    parse_mode=ParseMode.MARKDOWN_V2
-                )
-            else:
-                await bot.send_message(
-                    CHANNEL_ID,
-                    text=caption,
-                    parse_mode=ParseMode.MARKDOWN_V2
-                )
-
-            # Сохранение в историю
-            save_to_history({
-                "imdb_id": movie["imdb_id"],
-                "title": movie['title'],
-                "year": movie['year'],
-                "plot": movie.get('plot', '')
-            })
-
+            await publish_now_pipeline.run(movie=movie, review=review, style=DB['current_style'])
             await message.answer("✅ Рецензия опубликована\!")
         except Exception as e:
             logger.error(f"Ошибка публикации: {str(e)}")
@@ -583,7 +1338,7 @@ async def publish_now_handler(message: types.Message, state: FSMContext):
 
 # Остальные обработчики
 # Обработчик кнопки "🎭 Сменить жанр"
-@dp.message(F.text == "🎭 Сменить жанр")
+@admin_buttons.button("🎭 Сменить жанр")
 async def set_genre_handler(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMINS:
         return
@@ -600,7 +1355,7 @@ async def set_genre_handler(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.setting_genre)
 
 # Обработчик кнопки "🖋 Сменить стиль"
-@dp.message(F.text == "🖋 Сменить стиль")
+@admin_buttons.button("🖋 Сменить стиль")
 async def set_style_handler(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMINS:
         return
@@ -616,8 +1371,16 @@ async def set_style_handler(message: types.Message, state: FSMContext):
     )
     await state.set_state(AdminStates.setting_style)
 
+# Обработчик кнопки "⚡ Режим рецензий": готовые варианты из пула или всегда новая генерация
+@admin_buttons.button("⚡ Режим рецензий")
+async def toggle_review_mode_handler(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMINS:
+        return
+    state_store.set("fast_reviews", not DB.get("fast_reviews"))
+    await admin_panel(message)
+
 # Обработчик кнопки "⏰ Изменить время"
-@dp.message(F.text == "⏰ Изменить время")
+@admin_buttons.button("⏰ Изменить время")
 async def set_schedule_handler(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMINS:
         return
@@ -634,23 +1397,17 @@ async def set_schedule_handler(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.setting_schedule)
 
 # Добавляем новый обработчик для состояния установки времени
-@dp.message(AdminStates.setting_schedule)
+@admin_router.message(AdminStates.setting_schedule)
 async def process_schedule_time(message: types.Message, state: FSMContext):
     try:
         user_time = message.text.strip()
         cron_expression = time_to_cron(user_time)
 
         # Обновляем расписание
-        DB["schedule"] = cron_expression
+        state_store.set("schedule", cron_expression)
 
-        # Перезапускаем задание планировщика
-        scheduler.remove_job('publish_job')  # Удаляем старое задание
-        scheduler.add_job(
-            publish_scheduled_post,
-            trigger='cron',
-            **parse_cron(cron_expression),
-            id='publish_job'
-        )
+        # Перезапускаем задания планировщика
+        reschedule_publishing()
 
         await message.answer(
             f"✅ Время публикации установлено: {user_time}",
@@ -669,7 +1426,7 @@ async def process_schedule_time(message: types.Message, state: FSMContext):
         await admin_panel(message)  # Возврат в админ-панель
 
 # Обработчик команды /cancel
-@dp.message(F.text == "/cancel")
+@admin_buttons.button("/cancel")
 async def cancel_handler(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMINS:
         return
@@ -678,87 +1435,113 @@ async def cancel_handler(message: types.Message, state: FSMContext):
     await message.answer("❌ Операция отменена", reply_markup=types.ReplyKeyboardRemove())
     await admin_panel(message)
 
-@dp.message(F.text == "❌ Отменить операцию")
+@admin_buttons.button("❌ Отменить операцию")
 async def cancel_button_handler(message: types.Message, state: FSMContext):
     await cancel_handler(message, state)
 
 # Обработчик кнопки "📝 Еще рецензия"
-@dp.message(F.text == "📝 Еще рецензия")
+@admin_buttons.button("📝 Еще рецензия")
 async def another_review_handler(message: types.Message, state: FSMContext):
+    # Явная просьба о новой рецензии - кэш для следующего запроса не используется
+    await state.update_data(fresh_review=True)
     await custom_review_start(message, state)
 
-# Изменения в функции generate_custom_review и добавление parse_custom_review
-def parse_custom_review(text: str) -> Optional[dict]:
-    try:
-        title_match = re.search(r'Title:\s*(.+)', text, re.IGNORECASE)
-        year_match = re.search(r'Year:\s*(\d{4})', text, re.IGNORECASE)
-        imdb_match = re.search(r'IMDB-ID:\s*(tt\d{7,8})', text, re.IGNORECASE)
-        plot_match = re.search(r'Plot:\s*(.+)', text, re.IGNORECASE | re.DOTALL)
-        review_match = re.search(r'Review:\s*(.+)$', text, re.IGNORECASE | re.DOTALL)
-
-        title = title_match.group(1).strip() if title_match else "Неизвестный фильм"
-        year = int(year_match.group(1)) if year_match else datetime.now().year
-        plot = plot_match.group(1).strip() if plot_match else ""
-        review = review_match.group(1).strip() if review_match else ""
-
-        # Проверяем наличие корректного IMDB ID
-        imdb_id = ""
-        if imdb_match:
-            extracted = imdb_match.group(1).strip()
-            if re.match(r'^tt\d{7,8}$', extracted):
-                imdb_id = extracted
-
-        return {
-            "title": title,
-            "year": year,
-            "plot": plot,
-            "review": review,
-            "imdb_id": imdb_id
+def parse_custom_review(text: str, truncated: Optional[bool] = None) -> Optional[dict]:
+    return custom_review_output.parse(text, truncated)
+
+def parse_review_header(text: str) -> dict:
+    """Поля title, year и imdb_id, которые уже полностью пришли в потоковом ответе."""
+    fields = stream_fields(text)
+    header = {}
+    if fields.get("title"):
+        header["title"] = fields["title"]
+    if isinstance(fields.get("year"), int):
+        header["year"] = fields["year"]
+    if re.fullmatch(IMDB_ID_PATTERN, str(fields.get("imdb_id", ""))):
+        header["imdb_id"] = fields["imdb_id"]
+    return header
+
+def render_stream_preview(fields: dict, text: str) -> str:
+    lines = ["⏳ *Генерирую рецензию*"]
+    if "title" in fields:
+        year = f" \\({fields['year']}\\)" if "year" in fields else ""
+        lines.append(f"🎬 {escape_md(fields['title'])}{year}")
+    if "imdb_id" in fields:
+        lines.append(f"🔎 IMDB: {escape_md(fields['imdb_id'])}")
+    # Из сырого JSON показываем только дописываемый текст рецензии (или сюжета)
+    body = partial_string(text, "review") or partial_string(text, "plot") or ""
+    body = body if len(body) <= PREVIEW_TAIL else "…" + body[-PREVIEW_TAIL:]
+    return "\n".join(lines) + "\n\n" + escape_md(body)
+
+@async_cached(
+    ttl=LLM_CACHE_TTL,
+    maxsize=128,
+    key=lambda query, on_text=None: (" ".join(query.casefold().split()), DB["current_style"], PROMPT_VERSION),
+    cache_if=lambda review_data: review_data is not None,
+    # У вызова с живым превью свой поток: чужой запрос его превью не обновлял бы
+    coalesce_if=lambda query, on_text=None: on_text is None
+)
+async def generate_custom_review(query: str, on_text: Optional[Callable[[str], None]] = None) -> Optional[dict]:
+    messages = [
+        {
+            "role": "system",
+            "content": custom_review_system_prompt(DB['current_style'])
+        },
+        {
+            "role": "user",
+            "content": f"Запрос: {query}\n\nНапиши рецензию в указанном формате:"
         }
-    except Exception as e:
-        logger.error(f"Ошибка парсинга кастомной рецензии: {str(e)}")
-        return None
-
-async def generate_custom_review(query: str) -> Optional[dict]:
-    system_prompt = (
-        f"{GENERAL_REVIEW_PROMPT}\n"
-        f"Стиль: {DB['current_style']}\n"
-        "Учти: пользователь мог ввести название, концепцию или краткое описание\!\n"
-        "Формат ответа:\n"
-        "Title: Название фильма\n"
-        "Year: Год выпуска\n"
-        "IMDB-ID: ttXXXXXXX\n"
-        "Plot: Описание сюжета на 20-30 слов - ни в коем случае не ставь несколько точек рядом, не ставь нигде многоточия, обязательно заканчивай описание одной точкой\n"
-        "Review: Текст рецензии 100-120 слов - не ставь нигде многоточия\n\n"
-    )
-
+    ]
     try:
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": f"Запрос: {query}\n\nНапиши рецензию в указанном формате:"
-                }
-            ],
-            temperature=0.5,
-            max_tokens=1500
-        )
-        raw_text = response.choices[0].message.content
+        raw_text = truncated = None
+        if CUSTOM_REVIEW_STREAMING and on_text is not None:
+            try:
+                raw_text, truncated = await stream_chat_completion(
+                    "custom_review", messages, on_text, temperature=0.5, max_tokens=1500
+                )
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                logger.warning(f"Потоковая генерация не удалась, обычный запрос: {str(e)}")
+        if raw_text is None:
+            raw_text, truncated = await chat_completion_ended(
+                "custom_review", messages, temperature=0.5, max_tokens=1500
+            )
         logger.warning(raw_text)
-        return parse_custom_review(raw_text)
+        return parse_custom_review(raw_text, truncated)
     except Exception as e:
         logger.error(f"Ошибка генерации кастомной рецензии: {str(e)}")
         return None
 
-@dp.message(AdminStates.custom_review)
+@admin_router.message(AdminStates.custom_review)
 async def process_custom_review(message: types.Message, state: FSMContext):
+    preview = None
+    early_checks: Dict[str, asyncio.Task] = {}
+
+    def on_text(text: str):
+        fields = parse_review_header(text)
+        # Проверка IMDB ID стартует, как только строка с ним дописана
+        imdb_id = fields.get("imdb_id")
+        if imdb_id and imdb_id not in early_checks:
+            # ID в тексте сменился - прежняя проверка уже не нужна
+            for task in early_checks.values():
+                task.cancel()
+            early_checks.clear()
+            early_checks[imdb_id] = asyncio.create_task(verify_imdb_id(imdb_id))
+        preview.update(render_stream_preview(fields, text))
+
     try:
-        review_data = await generate_custom_review(message.text)
+        fresh = (await state.get_data()).get("fresh_review")
+        generate = generate_custom_review.refresh if fresh else generate_custom_review
+        if CUSTOM_REVIEW_STREAMING:
+            preview = LivePreview(message, "⏳ Генерирую рецензию\\.\\.\\.", interval=PREVIEW_EDIT_INTERVAL)
+            await preview.start()
+        try:
+            with track_stage("custom_review"):
+                review_data = await generate(message.text, on_text=on_text if preview else None)
+        finally:
+            if preview is not None:
+                await preview.close()
 
         if not review_data:
          #   Создаем  клавиатуру
@@ -769,10 +1552,28 @@ async def process_custom_review(message: types.Message, state: FSMContext):
                 reply_markup=builder.as_markup(resize_keyboard=True)
             )
             return  # Состояние не очищается, пользователь остается в custom_review
-        # Верификация IMDB ID
-        is_valid = await verify_imdb_id(review_data["imdb_id"])
-
-        if not is_valid:
+        # Верификация IMDB ID (при потоковой генерации обычно уже запущена)
+        early_check = early_checks.pop(review_data["imdb_id"], None)
+        is_valid = await early_check if early_check else await verify_imdb_id(review_data["imdb_id"])
+
+        matches = []
+        if not is_valid and title_index is not None:
+            matches = title_index.search(review_data["title"], review_data["year"])
+
+        if matches:
+            # Вместо ручного ввода ID - выбор из найденных по названию фильмов
+            picker = InlineKeyboardBuilder()
+            for match in matches:
+                picker.button(
+                    text=f"{match['title']} ({match['year'] or '?'})",
+                    callback_data=f"imdb_{match['imdb_id']}"
+                )
+            picker.adjust(1)
+            await message.answer(
+                "⚠️ Недействительный IMDB ID\! Выберите фильм из найденных по названию:",
+                reply_markup=picker.as_markup()
+            )
+        elif not is_valid:
             await message.answer("⚠️ Недействительный IMDB ID\! Постер не будет сформирован\!\n")
          #   return!
 
@@ -782,7 +1583,8 @@ async def process_custom_review(message: types.Message, state: FSMContext):
         await state.update_data(
             movie=review_data,  # содержит imdb_id
             review=review_data["review"],
-            imdb_id=review_data["imdb_id"]  # явное сохранение ID
+            imdb_id=review_data["imdb_id"],  # явное сохранение ID
+            fresh_review=False
         )
         await state.set_state(AdminStates.review_ready)
         logger.warning("Ok!")
@@ -795,9 +1597,9 @@ async def process_custom_review(message: types.Message, state: FSMContext):
         await message.answer(
             f"✅ Найден фильм:\n\n"
           #  f"🎬 {escape_md(review_data['title'])} \({review_data['year']}\)\n"
-            f"🎬 {escape_md(review_data['title'])} \\({escape_md(str(review_data['year']))}\\)\n"
-            f"📚 Сюжет: {escape_md(review_data['plot'])[:200]}\n\n"
-            f"📝 Рецензия:\n{escape_md(review_data['review'])[:500]}",
+            f"🎬 {escape_md(review_data['title'])} \\({escape_md(str(review_data['year'] or '?'))}\\)\n"
+            f"📚 Сюжет: {clip_md(review_data['plot'], 200)}\n\n"
+            f"📝 Рецензия:\n{clip_md(review_data['review'], 500)}",
             reply_markup=builder.as_markup()
         )
 
@@ -805,8 +1607,12 @@ async def process_custom_review(message: types.Message, state: FSMContext):
         logger.error(f"Ошибка: {str(e)}")
         await message.answer("❌ Произошла ошибка, попробуйте снова")
         await state.clear()
+    finally:
+        # Ранние проверки ID, которые не понадобились (ID в итоге другой или генерация не удалась)
+        for task in early_checks.values():
+            task.cancel()
 
-@dp.message(F.text.startswith("tt") and AdminStates.review_ready)
+@admin_router.message(F.text.startswith("tt") and AdminStates.review_ready)
 async def handle_manual_imdb_input(message: types.Message, state: FSMContext):
     # Проверка команды возврата
     if message.text.lower() in ["меню", "/admin", "🔙 в меню"]:
@@ -859,32 +1665,49 @@ async def handle_manual_imdb_input(message: types.Message, state: FSMContext):
         reply_markup=success_kb.as_markup(resize_keyboard=True)
     )
 
+# Выбор IMDB ID из вариантов индекса названий
+@admin_router.callback_query(F.data.startswith("imdb_"), AdminStates.review_ready)
+async def imdb_match_selected(callback: types.CallbackQuery, state: FSMContext):
+    imdb_id = callback.data.split("_", 1)[1]
+    data = await state.get_data()
+
+    new_data = data['movie'].copy()
+    new_data['imdb_id'] = imdb_id
+    await state.update_data(movie=new_data, imdb_id=imdb_id)
+
+    await callback.message.edit_text(f"✅ IMDB ID обновлен: {escape_md(imdb_id)}")
+    await callback.answer()
+
 # Обновление обработчика возврата в админку для очистки состояния
-@dp.message(F.text == "🔙 В админку")
+@admin_buttons.button("🔙 В админку")
 async def back_to_admin_handler(message: types.Message, state: FSMContext):
     await state.clear()
     await admin_panel(message)
 
 # Обработчик выбора жанра
-@dp.callback_query(F.data.startswith("genre_"), AdminStates.setting_genre)
+@admin_router.callback_query(F.data.startswith("genre_"), AdminStates.setting_genre)
 async def genre_selected(callback: types.CallbackQuery, state: FSMContext):
     genre = callback.data.split("_")[1]
-    DB["current_genre"] = genre
+    state_store.set("current_genre", genre)
+    prefetcher.invalidate()
+    start_prefetch()
     await callback.message.edit_text(f"✅ Жанр установлен: {genre}")
     await state.clear()
     await admin_panel(callback.message)  # Возврат в админ-панель
 
 # Обработчик выбора стиля
-@dp.callback_query(F.data.startswith("style_"), AdminStates.setting_style)
+@admin_router.callback_query(F.data.startswith("style_"), AdminStates.setting_style)
 async def style_selected(callback: types.CallbackQuery, state: FSMContext):
     style = callback.data.split("_")[1]
-    DB["current_style"] = style
+    state_store.set("current_style", style)
+    prefetcher.invalidate()
+    start_prefetch()
     await callback.message.edit_text(f"✅ Стиль установлен: {style}")
     await state.clear()
     await admin_panel(callback.message)  # Возврат в админ-панель
 
 # Обработчик кнопки "📝 Создать рецензию"
-@dp.message(F.text == "📝 Создать рецензию")
+@admin_buttons.button("📝 Создать рецензию")
 async def custom_review_start(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMINS:
         return
@@ -900,38 +1723,123 @@ async def custom_review_start(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.custom_review)
 
 # Новый обработчик для некорректного ввода в админ-панели
-@dp.message(F.from_user.id.in_(ADMINS))
+@admin_router.message()
 async def handle_admin_invalid_input(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
-    allowed_commands = [
-        "🎭 Сменить жанр", "🖋 Сменить стиль", "⏰ Изменить время",
-        "🚀 Опубликовать сейчас", "📝 Создать рецензию", "🔙 В меню",
-        "/start", "/admin"
-    ]
 
-    # Если пользователь не в состоянии и ввел неизвестную команду
-    if current_state is None and message.text not in allowed_commands:
+    # Кнопки меню и /start разбираются раньше, сюда попадает только неизвестный ввод
+    if current_state is None:
        # await message.answer("Пожалуйста, выберите вариант из списка ниже\.")
         await message.answer("ℹ️ Пожалуйста, выберите вариант из списка ниже\.")
         await admin_panel(message)  # <-- Добавляем вызов админ-панели
 
+webhook_server: Optional[BotWebServer] = None
+
+def health_status() -> dict:
+    return {
+        "status": "ok",
+        "mode": BOT_MODE,
+        "webhook": webhook_server.webhook_status() if webhook_server is not None else None,
+        "leader": leader.is_leader if leader is not None else None,
+        "breakers": {
+            policy.name: policy.breaker.state for policy in (openai_policy, omdb_policy)
+        },
+        "send_queue": outbound.summary(),
+        "history": history.count(),
+        "catalog": len(catalog) if catalog is not None else None,
+        "posters": posters.stats,
+        "reviews": reviews.stats,
+    }
+
+async def run_webhook():
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook нужно задать WEBHOOK_SECRET")
+    global webhook_server
+    webhook_server = BotWebServer(
+        dispatcher=dp,
+        bot=bot,
+        webhook_path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        concurrency=int(os.getenv("WEBHOOK_CONCURRENCY", "16")),
+        max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "256")),
+    )
+    ops_server = BotWebServer(health_status, metrics=REGISTRY.render)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await webhook_server.start(WEB_HOST, WEB_PORT)
+    await ops_server.start(HEALTH_HOST, int(HEALTH_PORT or DEFAULT_HEALTH_PORT))
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await webhook_server.close()
+        await ops_server.close()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+async def run_polling():
+    server = None
+    if HEALTH_PORT:
+        server = BotWebServer(health_status, metrics=REGISTRY.render)
+        await server.start(HEALTH_HOST, int(HEALTH_PORT))
+    try:
+        # Вебхук, оставшийся от режима webhook, блокирует getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if server is not None:
+            await server.close()
+
 # Остальные обработчики и запуск
 async def main():
 
-    # Загрузка истории при старте
-    history = load_history()
-    DB["posted_imdb_ids"] = [m["imdb_id"] for m in history[-500:]]
+    # Однократный перенос старой JSONL-истории в индексированное хранилище
+    history.migrate_jsonl(MOVIES_HISTORY_FILE)
 
-    # Инициализация планировщика с ID задания
-    scheduler.add_job(
-        publish_scheduled_post,
-        trigger='cron',
-        **parse_cron(DB['schedule']),
-        id='publish_job'  # Добавляем идентификатор задания
-    )
+    # Сворачиваем журнал в снимок, чтобы следующий старт читал только снимок
+    state_store.compact()
+
+    # Задания планировщика по расписаниям всех каналов (основное восстановлено из состояния)
+    reschedule_publishing()
     scheduler.start()
 
-    await dp.start_polling(bot)
+    if leader is not None:
+        await leader.start()
+    outbound.start()
+    await omdb.start()
+    await posters.start()
+    start_prefetch()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        await prefetcher.close()
+        # Фоновые записи в историю должны завершиться до закрытия хранилища
+        await publish_pipeline.drain()
+        await publish_now_pipeline.drain()
+        await outbound.close()
+        logger.info(f"Очередь отправки: {outbound.summary()}")
+        await omdb.close()
+        await posters.close()
+        await reviews.close()
+        logger.info(f"OMDb кэш: {omdb.cache.stats()}")
+        omdb.cache.close()
+        history.close()
+        if catalog is not None:
+            catalog.close()
+        if title_index is not None:
+            title_index.close()
+        if leader is not None:
+            await leader.close()
+        if shared_store is not None:
+            await shared_store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,133 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Границы корзин гистограмм в секундах: от быстрых запросов к OMDb до долгих ответов GPT
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self, **labels) -> float:
+        """Сумма по всем меткам или только по записям с заданными значениями меток."""
+        wanted = set(_label_key(labels))
+        return sum(value for key, value in self.values.items() if wanted.issubset(key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # Метки -> (счетчики по корзинам, сумма, количество)
+        self.values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def means(self, label: str) -> Dict[str, Tuple[int, float]]:
+        """Количество и среднее по значениям метки ``label``."""
+        result = {}
+        for key, (_, total, count) in self.values.items():
+            value = dict(key).get(label, "")
+            previous_count, previous_total = result.get(value, (0, 0.0))
+            result[value] = (previous_count + count, previous_total + total)
+        return {value: (count, total / count) for value, (count, total) in result.items() if count}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик с выводом в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.metrics: list = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("cinemania_stage_seconds", "Длительность этапов подготовки и публикации поста")
+STAGE_ERRORS = REGISTRY.counter("cinemania_stage_errors_total", "Неудачные этапы публикации")
+STAGE_RETRIES = REGISTRY.counter("cinemania_stage_retries_total", "Повторные попытки этапов публикации")
+STAGE_FALLBACKS = REGISTRY.counter("cinemania_stage_fallbacks_total", "Этапы публикации, замененные запасным вариантом")
+UPSTREAM_SECONDS = REGISTRY.histogram("cinemania_upstream_seconds", "Длительность запросов к внешним сервисам")
+UPSTREAM_ERRORS = REGISTRY.counter("cinemania_upstream_errors_total", "Ошибки запросов к внешним сервисам")
+UPSTREAM_RETRIES = REGISTRY.counter("cinemania_upstream_retries_total", "Повторы запросов к внешним сервисам")
+DUPLICATES = REGISTRY.counter("cinemania_duplicates_total", "Найденные дубликаты фильмов")
+LLM_PARSE = REGISTRY.counter("cinemania_llm_parse_total", "Разбор структурированных ответов модели: ok, repaired, failed")
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Измеряет этап; исключение считается ошибкой этапа и пробрасывается дальше."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage=stage)
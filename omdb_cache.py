@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+import sqlite3
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+OMDB_CACHE_FILE = "omdb_cache.sqlite3"
+
+# Отрицательные ответы, которые стоит кэшировать: фильма действительно нет.
+# "Request limit reached!", "Invalid API key!" и т.п. - временные, их не кэшируем
+NOT_FOUND_ERRORS = re.compile(r"not found|incorrect imdb id", re.IGNORECASE)
+
+
+def normalize_title(title: str) -> str:
+    text = str(title).casefold().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def id_key(imdb_id: str) -> str:
+    return f"id:{imdb_id.strip().lower()}"
+
+
+def title_key(title: str, year=None) -> str:
+    return f"title:{normalize_title(title)}|{year or ''}"
+
+
+class OmdbCache:
+    """Дисковый кэш ответов OMDb на SQLite.
+
+    Записи живут ``ttl`` секунд, ответы "фильм не найден" - ``negative_ttl``
+    секунд; прочие ошибки OMDb (лимит запросов, ключ API) не кэшируются.
+    При превышении ``max_entries`` вытесняются записи, к которым дольше всего
+    не обращались (LRU). Время обращения пишется на диск не чаще раза в
+    ``access_resolution`` секунд на запись - попадание в кэш обычно обходится
+    одним чтением; число записей считается в памяти.
+    """
+
+    def __init__(
+        self,
+        path: str = OMDB_CACHE_FILE,
+        ttl: float = 30 * 86400,
+        negative_ttl: float = 86400,
+        max_entries: int = 20000,
+        access_resolution: float = 3600,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.access_resolution = access_resolution
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS omdb_cache ("
+            " key TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS omdb_cache_last_access ON omdb_cache (last_access)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM omdb_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT data, expires_at, last_access FROM omdb_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if row[1] < now:
+            self._conn.execute("DELETE FROM omdb_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            self._count -= 1
+            self.misses += 1
+            return None
+
+        if now - row[2] > self.access_resolution:
+            # Для LRU точность до access_resolution достаточна
+            self._conn.execute("UPDATE omdb_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def _ttl_for(self, data: dict) -> Optional[float]:
+        if data.get("Response") == "True":
+            return self.ttl
+        if NOT_FOUND_ERRORS.search(str(data.get("Error", ""))):
+            return self.negative_ttl
+        return None
+
+    def put(self, key: str, data: dict):
+        ttl = self._ttl_for(data)
+        if ttl is None:
+            logger.warning(f"OMDb: ответ не кэшируется ({key}): {data.get('Error')}")
+            return
+        now = time.time()
+        exists = self._conn.execute("SELECT 1 FROM omdb_cache WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO omdb_cache (key, data, expires_at, last_access)"
+            " VALUES (?, ?, ?, ?)",
+            (key, json.dumps(data, ensure_ascii=False), now + ttl, now)
+        )
+        if exists is None:
+            self._count += 1
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        if self._count <= self.max_entries:
+            return
+        # Освобождаем 10% места, чтобы не чистить кэш на каждой записи
+        excess = self._count - int(self.max_entries * 0.9)
+        deleted = self._conn.execute(
+            "DELETE FROM omdb_cache WHERE key IN ("
+            " SELECT key FROM omdb_cache ORDER BY last_access LIMIT ?)",
+            (excess,)
+        ).rowcount
+        self._count -= deleted
+        logger.info(f"OMDb кэш: вытеснено {excess} записей")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": self._count}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import aiohttp
+
+from omdb_cache import OmdbCache, id_key, title_key
+from resilience import CallPolicy
+
+logger = logging.getLogger(__name__)
+
+OMDB_BASE_URL = "http://www.omdbapi.com/"
+
+
+class OmdbClient:
+    """Долгоживущий асинхронный клиент OMDb с пулом соединений.
+
+    Сессия открывается в ``start()`` (внутри работающего event loop) и
+    закрывается в ``close()``. Количество одновременных запросов ограничено
+    семафором, каждый запрос имеет собственный таймаут. Если передан
+    ``cache``, ответы по IMDB ID и по названию+году берутся из него; сетевые
+    запросы выполняются по правилам ``policy`` (повторы, размыкатель цепи).
+    Одновременные запросы одного и того же фильма объединяются в один.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: str = OMDB_BASE_URL,
+        timeout: float = 10.0,
+        max_connections: int = 10,
+        max_concurrency: int = 5,
+        keepalive_timeout: float = 30.0,
+        cache: Optional[OmdbCache] = None,
+        policy: Optional[CallPolicy] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache = cache
+        self.policy = policy
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        logger.info("OMDb клиент запущен")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("OMDb клиент остановлен")
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("OMDb клиент не запущен: вызовите start()")
+        return self._session
+
+    async def request(self, **params) -> dict:
+        """Выполняет запрос к OMDb и возвращает разобранный JSON."""
+        query = {key: str(value) for key, value in params.items() if value is not None}
+        query["apikey"] = self.api_key or ""
+
+        if self.policy is None:
+            return await self._fetch(query)
+        return await self.policy.call(lambda: self._fetch(query))
+
+    async def _fetch(self, query: dict) -> dict:
+        async with self._semaphore:
+            async with self.session.get(self.base_url, params=query) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def _cached(self, key: str, **params) -> dict:
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        # Тот же ключ уже запрашивается - ждем общий ответ
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.request(**params))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+        return await asyncio.shield(task)
+
+    def _store(self, key: str, task: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.cache is not None:
+            self.cache.put(key, task.result())
+
+    async def get_by_id(self, imdb_id: str) -> dict:
+        return await self._cached(id_key(imdb_id), i=imdb_id)
+
+    async def get_by_title(self, title: str, year=None) -> dict:
+        data = await self._cached(title_key(title, year), t=title, y=year)
+        # Тот же фильм потом запрашивают по ID - кладем и под этим ключом
+        if self.cache is not None and data.get("Response") == "True" and data.get("imdbID"):
+            self.cache.put(id_key(data["imdbID"]), data)
+        return data
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from metrics import STAGE_ERRORS, STAGE_FALLBACKS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+NO_FALLBACK = object()
+
+
+class StageFailed(Exception):
+    """Этап без запасного варианта завершился ошибкой или по таймауту.
+
+    ``results`` - результаты этапов, успевших выполниться до сбоя.
+    """
+
+    def __init__(self, stage: str, cause: BaseException, results: dict):
+        super().__init__(f"этап {stage}: {str(cause) or type(cause).__name__}")
+        self.stage = stage
+        self.cause = cause
+        self.results = results
+
+
+class Stage:
+    """Этап графа публикации.
+
+    ``run(results)`` получает словарь с входными данными и результатами
+    этапов из ``after``; его результат записывается под именем этапа.
+    При ошибке или превышении ``timeout`` этап получает значение
+    ``fallback``, а если оно не задано - весь граф останавливается.
+    Фоновые этапы (``background``) не задерживают возврат из ``run()``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[dict], Awaitable[Any]],
+        after: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = NO_FALLBACK,
+        background: bool = False,
+    ):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.background = background
+
+
+class Pipeline:
+    """Исполнитель графа этапов: каждый этап стартует, как только готовы
+    все этапы, от которых он зависит, поэтому независимые этапы идут
+    параллельно. Время и ошибки этапов попадают в метрики ``STAGE_*``.
+    """
+
+    def __init__(self, name: str, stages: Iterable[Stage]):
+        self.name = name
+        self.stages = list(stages)
+        known = set()
+        for stage in self.stages:
+            missing = [dependency for dependency in stage.after if dependency not in known]
+            if missing:
+                # Зависимости объявляются раньше этапа - так граф заведомо без циклов
+                raise ValueError(f"{name}: этап {stage.name} зависит от необъявленных {missing}")
+            known.add(stage.name)
+        self._background: Set[asyncio.Task] = set()
+
+    async def _run_stage(self, stage: Stage, results: dict, dependencies: list):
+        if dependencies:
+            await asyncio.gather(*dependencies)
+        started = time.monotonic()
+        try:
+            value = await asyncio.wait_for(stage.run(results), stage.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            STAGE_ERRORS.inc(stage=stage.name)
+            if stage.fallback is NO_FALLBACK:
+                raise StageFailed(stage.name, e, dict(results)) from e
+            STAGE_FALLBACKS.inc(stage=stage.name)
+            logger.warning(f"{self.name}: этап {stage.name} не удался ({str(e) or type(e).__name__}), запасной вариант")
+            value = stage.fallback
+        finally:
+            STAGE_SECONDS.observe(time.monotonic() - started, stage=stage.name)
+        results[stage.name] = value
+        return value
+
+    def _forget_background(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"{self.name}: фоновый этап не выполнен: {str(task.exception())}")
+
+    async def run(self, **inputs) -> dict:
+        """Выполняет граф; возвращает входные данные вместе с результатами этапов."""
+        results = dict(inputs)
+        tasks: Dict[str, asyncio.Task] = {}
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.ensure_future(
+                self._run_stage(stage, results, [tasks[name] for name in stage.after])
+            )
+
+        try:
+            await asyncio.gather(*(tasks[stage.name] for stage in self.stages if not stage.background))
+        except BaseException:
+            # Остальные этапы уже не нужны (например, рецензия для отвергнутого фильма)
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        for stage in self.stages:
+            if stage.background:
+                # И для уже завершившихся задач: колбэк залогирует их ошибку
+                self._background.add(tasks[stage.name])
+                tasks[stage.name].add_done_callback(self._forget_background)
+        return results
+
+    async def drain(self):
+        """Дожидается фоновых этапов (перед остановкой бота)."""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import aiohttp
+from aiogram import types
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger(__name__)
+
+POSTER_DIR = "posters"
+POSTER_DB_FILE = "posters.sqlite3"
+MAX_POSTER_BYTES = 10 * 1024 * 1024  # лимит Telegram на фото
+
+# Вид источника -> счетчик удачных отправок в stats
+SOURCE_STATS = {"file_id": "file_id_hits", "local": "local_hits", "url": "url_sends"}
+
+# Сигнатуры форматов, которые Telegram принимает как фото
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": ".jpg",
+    b"\x89PNG\r\n\x1a\n": ".png",
+    b"RIFF": ".webp",
+}
+
+
+def image_extension(data: bytes) -> Optional[str]:
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            if extension == ".webp" and data[8:12] != b"WEBP":
+                continue
+            return extension
+    return None
+
+
+class PosterStore:
+    """Постеры: локальная копия файла и ``file_id`` Telegram по IMDB ID.
+
+    ``fetch()`` один раз скачивает и проверяет картинку. ``sources()`` отдает
+    варианты отправки от дешевого к дорогому: ``file_id`` после первой
+    загрузки в Telegram, локальный файл и исходный URL - следующий берется,
+    если Telegram отверг предыдущий. ``remember()`` сохраняет ``file_id`` из
+    отправленного сообщения - он годится для любого чата этого бота.
+    """
+
+    def __init__(
+        self,
+        directory: str = POSTER_DIR,
+        db_path: str = POSTER_DB_FILE,
+        timeout: float = 15.0,
+        max_concurrency: int = 4,
+    ):
+        self.directory = directory
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats = {"downloads": 0, "download_failures": 0, "file_id_hits": 0, "local_hits": 0, "url_sends": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS posters ("
+            " imdb_id TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " path TEXT,"
+            " file_id TEXT,"
+            " size INTEGER,"
+            " fetched_at REAL)"
+        )
+        self._conn.commit()
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._conn.close()
+
+    def _row(self, imdb_id: str) -> Optional[tuple]:
+        return self._conn.execute(
+            "SELECT url, path, file_id FROM posters WHERE imdb_id = ?", (imdb_id,)
+        ).fetchone()
+
+    def _local_path(self, imdb_id: str) -> Optional[str]:
+        row = self._row(imdb_id)
+        if row and row[1] and os.path.exists(row[1]):
+            return row[1]
+        return None
+
+    async def fetch(self, imdb_id: str, url: str) -> Optional[str]:
+        """Путь к локальной копии постера; скачивает его при первом обращении."""
+        path = self._local_path(imdb_id)
+        if path is not None:
+            return path
+
+        future = self._in_flight.get(imdb_id)
+        if future is None:
+            future = asyncio.ensure_future(self._download(imdb_id, url))
+            self._in_flight[imdb_id] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(imdb_id, None))
+        return await asyncio.shield(future)
+
+    async def _download(self, imdb_id: str, url: str) -> Optional[str]:
+        await self.start()
+        try:
+            async with self._semaphore:
+                async with self._session.get(url) as response:
+                    if response.status != 200:
+                        raise ValueError(f"HTTP {response.status}")
+                    data = await response.content.read(MAX_POSTER_BYTES + 1)
+            if len(data) > MAX_POSTER_BYTES:
+                raise ValueError("файл больше 10 МБ")
+            extension = image_extension(data)
+            if extension is None:
+                raise ValueError("не похоже на изображение")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.stats["download_failures"] += 1
+            logger.warning(f"Постер {imdb_id} не скачан ({url}): {e}")
+            return None
+
+        path = os.path.join(self.directory, f"{imdb_id}{extension}")
+        fd, tmp_path = tempfile.mkstemp(prefix=".poster-", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            logger.error(f"Постер {imdb_id} не сохранен: {e}")
+            return None
+
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO posters (imdb_id, url, path, size, fetched_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(imdb_id) DO UPDATE SET url = excluded.url, path = excluded.path,"
+                " size = excluded.size, fetched_at = excluded.fetched_at",
+                (imdb_id, url, path, len(data), time.time())
+            )
+        self.stats["downloads"] += 1
+        return path
+
+    def sources(self, imdb_id: str, url: str) -> List[Tuple[str, Union[str, FSInputFile]]]:
+        """Пары (вид, фото): ``file_id``, локальный файл, URL - что из этого есть."""
+        sources = []
+        row = self._row(imdb_id)
+        if row and row[2]:
+            sources.append(("file_id", row[2]))
+        path = self._local_path(imdb_id)
+        if path is not None:
+            sources.append(("local", FSInputFile(path)))
+        sources.append(("url", url))
+        return sources
+
+    def remember(self, imdb_id: str, message: types.Message, kind: str = "url"):
+        """Учитывает удачную отправку из источника ``kind`` и сохраняет ``file_id``."""
+        self.stats[SOURCE_STATS[kind]] += 1
+        if kind == "file_id" or not message.photo:
+            return
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO posters (imdb_id, file_id) VALUES (?, ?)"
+                " ON CONFLICT(imdb_id) DO UPDATE SET file_id = excluded.file_id",
+                (imdb_id, message.photo[-1].file_id)
+            )
+
+    def forget_file_id(self, imdb_id: str):
+        with self._conn:
+            self._conn.execute("UPDATE posters SET file_id = NULL WHERE imdb_id = ?", (imdb_id,))
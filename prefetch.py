@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from metrics import DUPLICATES
+
+logger = logging.getLogger(__name__)
+
+
+class PostPrefetcher:
+    """Фоновый буфер полностью подготовленных постов для каждого ключа
+    (например, жанр, стиль и канал).
+
+    ``prepare(*key, exclude_ids)`` должна вернуть готовый пост (словарь с
+    ключом ``movie``) или ``None``. Буфер пополняется в фоне; при публикации
+    по расписанию пост берется из буфера через ``take()``. Посты, которые
+    так и не будут опубликованы (устаревшие, сброшенные), передаются в
+    ``discard``.
+    """
+
+    def __init__(
+        self,
+        prepare: Callable[..., Awaitable[Optional[dict]]],
+        buffer_size: int = 2,
+        retry_delay: float = 60,
+        max_retry_delay: float = 1800,
+        discard: Optional[Callable[[dict], None]] = None,
+    ):
+        self.prepare = prepare
+        self.discard = discard
+        self.buffer_size = buffer_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._buffers: Dict[Tuple, deque] = {}
+        self._tasks: Dict[Tuple, asyncio.Task] = {}
+
+    def size(self, *key) -> int:
+        return len(self._buffers.get(key, ()))
+
+    def start(self, *key):
+        """Запускает фоновое заполнение буфера, если оно еще не идет."""
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return
+        self._tasks[key] = asyncio.create_task(self._fill(key))
+
+    def take(self, *key, is_stale: Optional[Callable[[dict], bool]] = None) -> Optional[dict]:
+        """Достает подготовленный пост и запускает пополнение буфера.
+
+        Посты, для которых ``is_stale`` вернула True (например, фильм уже
+        опубликован вручную), отбрасываются.
+        """
+        buffer = self._buffers.setdefault(key, deque())
+        post = None
+        while buffer:
+            candidate = buffer.popleft()
+            if is_stale is not None and is_stale(candidate):
+                DUPLICATES.inc(source="prefetch")
+                logger.info(f"Предзагрузка: пост устарел - {candidate['movie'].get('imdb_id')}")
+                self._discard(candidate)
+                continue
+            post = candidate
+            break
+        self.start(*key)
+        return post
+
+    def _discard(self, post: dict):
+        if self.discard is not None:
+            self.discard(post)
+
+    def _drop_buffers(self):
+        for buffer in self._buffers.values():
+            for post in buffer:
+                self._discard(post)
+        self._buffers.clear()
+
+    def invalidate(self):
+        """Сбрасывает все буферы и останавливает их заполнение."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._drop_buffers()
+        logger.info("Предзагрузка: буферы сброшены")
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._drop_buffers()
+
+    async def _fill(self, key: Tuple):
+        buffer = self._buffers.setdefault(key, deque())
+        delay = self.retry_delay
+
+        while len(buffer) < self.buffer_size:
+            exclude_ids = [post["movie"]["imdb_id"] for post in buffer]
+            try:
+                post = await self.prepare(*key, exclude_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Предзагрузка: ошибка подготовки поста: {str(e)}")
+                post = None
+
+            if post is None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+
+            delay = self.retry_delay
+            buffer.append(post)
+            logger.info(f"Предзагрузка: готово {len(buffer)}/{self.buffer_size} постов для {'/'.join(map(str, key))}")
@@ -0,0 +1,75 @@
+import logging
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LLM_TOKENS = REGISTRY.counter("cinemania_llm_tokens_total", "Токены запросов к LLM по месту вызова")
+
+
+def compact_avoid_list(groups: Iterable[Iterable[str]], limit: int) -> List[str]:
+    """Собирает короткий список ID "не предлагать".
+
+    ``groups`` перечисляются по убыванию важности (например, уже
+    подготовленные посты, затем недавние публикации того же жанра).
+    Повторы отбрасываются, в промпт попадает не больше ``limit`` ID: остальные
+    дубликаты все равно отсеет проверка по истории.
+    """
+    result: "OrderedDict[str, None]" = OrderedDict()
+    for group in groups:
+        for imdb_id in group:
+            if len(result) >= limit:
+                return list(result)
+            if imdb_id:
+                result[imdb_id] = None
+    return list(result)
+
+
+def estimate_usage(messages: List[dict], completion: str) -> dict:
+    """Приблизительный usage, если API его не вернул: ~3 символа на токен
+    для смеси русского и английского текста."""
+    prompt = sum(len(message.get("content") or "") for message in messages)
+    return {"prompt_tokens": prompt // 3, "completion_tokens": len(completion) // 3}
+
+
+class TokenLedger:
+    """Учет токенов по местам вызова LLM со скользящими суточными итогами.
+
+    Хранятся итоги за последние ``days`` дней: день -> место вызова ->
+    ``{"calls", "prompt", "completion"}``.
+    """
+
+    def __init__(self, days: int = 7):
+        self.days = days
+        self.totals: "OrderedDict[str, Dict[str, dict]]" = OrderedDict()
+
+    def record(self, site: str, usage: Optional[dict]):
+        if not usage:
+            return
+        prompt = int(usage.get("prompt_tokens", 0))
+        completion = int(usage.get("completion_tokens", 0))
+
+        day = date.today().isoformat()
+        sites = self.totals.setdefault(day, {})
+        while len(self.totals) > self.days:
+            self.totals.popitem(last=False)
+
+        entry = sites.setdefault(site, {"calls": 0, "prompt": 0, "completion": 0})
+        entry["calls"] += 1
+        entry["prompt"] += prompt
+        entry["completion"] += completion
+        LLM_TOKENS.inc(prompt, site=site, kind="prompt")
+        LLM_TOKENS.inc(completion, site=site, kind="completion")
+        logger.debug(f"LLM {site}: {prompt} токенов промпта, {completion} ответа")
+
+    def day_total(self, day: Optional[str] = None) -> dict:
+        sites = self.totals.get(day or date.today().isoformat(), {})
+        return {
+            "calls": sum(entry["calls"] for entry in sites.values()),
+            "prompt": sum(entry["prompt"] for entry in sites.values()),
+            "completion": sum(entry["completion"] for entry in sites.values()),
+            "sites": sites,
+        }
@@ -0,0 +1,161 @@
+import os
+import re
+from typing import List
+
+# Лимиты Telegram: подпись к фото и обычное сообщение
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+PLOT_LIMIT = 200
+TITLE_LIMIT = 200
+
+# trim - обрезать сюжет и рецензию по предложениям, чтобы пост влез в одну подпись;
+# split - фото с заголовком и сюжетом, рецензия отдельным сообщением
+POST_LAYOUT = os.getenv("POST_LAYOUT", "trim")
+
+# Регулярное выражение экранирования MarkdownV2 компилируется один раз.
+# str.translate на кириллице заметно медленнее (см. benchmarks/bench_render.py)
+MD_SPECIAL_CHARS = '\\_*[]()~`>#+-=|{}.!'
+MD_ESCAPE_RE = re.compile(f"[{re.escape(MD_SPECIAL_CHARS)}]")
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+# Шаблоны постов: head - заголовок (всегда в подписи), body - рецензия
+TEMPLATES = {
+    "scheduled": {
+        "head": "🎬 *{title}* \\({year}\\)\n\n📖 Жанр: {genre}\n",
+        "body": "📝 Рецензия \\({style}\\):\n{review}",
+    },
+    "custom": {
+        "head": "🎬 *{title}* \\({year}\\)\n\n📖 Жанр: {genre}\n📚 Сюжет: {plot}\n\n",
+        "body": "📝 Рецензия \\({style}\\):\n{review}",
+    },
+}
+
+
+def _escape_char(match: re.Match) -> str:
+    return "\\" + match.group(0)
+
+
+def escape_md(text) -> str:
+    return MD_ESCAPE_RE.sub(_escape_char, str(text))
+
+
+def _escaped_prefix(escaped: str, limit: int) -> str:
+    """Начало экранированного текста не длиннее ``limit``, не разрывающее пару ``\\x``."""
+    prefix = escaped[:limit]
+    # Каждая обратная косая в экранированном тексте открывает пару: нечетный
+    # хвост из них значит, что последняя осталась без своего символа
+    if (len(prefix) - len(prefix.rstrip("\\"))) % 2:
+        prefix = prefix[:-1]
+    return prefix
+
+
+def clip_md(text: str, limit: int) -> str:
+    """Экранирует текст и укорачивает его до ``limit`` символов по границе
+    предложения (или слова, если не помещается даже первое предложение)."""
+    text = str(text).strip()
+    escaped = escape_md(text)
+    if len(escaped) <= limit:
+        return escaped
+
+    result = ""
+    for sentence in SENTENCE_END.split(text):
+        candidate = f"{result} {escape_md(sentence)}" if result else escape_md(sentence)
+        if len(candidate) > limit:
+            break
+        result = candidate
+    if result:
+        return result
+
+    words = []
+    size = 1  # место под "…"
+    for word in escape_md(text).split():
+        if size + len(word) + 1 > limit:
+            break
+        words.append(word)
+        size += len(word) + 1
+    if not words and limit > 1:
+        # Первое слово длиннее лимита (например, ссылка) - режем его самого
+        words = [_escaped_prefix(escape_md(text), limit - 1)]
+    return " ".join(words) + "…" if words and words[0] else ""
+
+
+def split_md(text: str, limit: int) -> List[str]:
+    """Экранирует текст и режет его на части не длиннее ``limit`` по предложениям."""
+    pieces = []
+    for sentence in SENTENCE_END.split(str(text).strip()):
+        escaped = escape_md(sentence)
+        if len(escaped) <= limit:
+            pieces.append(escaped)
+        else:
+            # Слишком длинное предложение режем по словам, слишком длинные слова - на куски
+            for word in sentence.split():
+                escaped = escape_md(word)
+                while escaped:
+                    piece = _escaped_prefix(escaped, limit)
+                    if not piece:
+                        break
+                    pieces.append(piece)
+                    escaped = escaped[len(piece):]
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current} {piece}" if current else piece
+        if len(candidate) > limit and current:
+            chunks.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def render_post(
+    kind: str,
+    movie: dict,
+    review: str,
+    genre: str,
+    style: str,
+    with_photo: bool = True,
+    layout: str = POST_LAYOUT,
+) -> dict:
+    """Собирает пост по шаблону с учетом лимита подписи.
+
+    Возвращает ``{"caption": ..., "follow_ups": [...]}``: ``caption`` идет
+    подписью к фото (или текстом, если фото нет), ``follow_ups`` - отдельные
+    сообщения, которые отправляются после него.
+    """
+    template = TEMPLATES[kind]
+    limit = CAPTION_LIMIT if with_photo else MESSAGE_LIMIT
+    fields = {
+        "title": clip_md(movie["title"], TITLE_LIMIT),
+        "year": escape_md(movie["year"] or "?"),
+        "genre": escape_md(genre),
+        "style": escape_md(style),
+        "plot": clip_md(movie.get("plot", ""), PLOT_LIMIT),
+    }
+
+    full = template["head"].format(**fields) + template["body"].format(**fields, review=escape_md(review))
+    if len(full) <= limit:
+        return {"caption": full, "follow_ups": []}
+
+    if layout == "split":
+        head = template["head"].format(**fields).rstrip()
+        body_header = template["body"].format(**fields, review="")
+        chunks = split_md(review, MESSAGE_LIMIT - len(body_header))
+        follow_ups = [body_header + chunks[0]] + chunks[1:] if chunks else []
+        return {"caption": head, "follow_ups": follow_ups}
+
+    # Сначала ужимаем сюжет, потом рецензию - каждый раз по границе предложения
+    empty = template["head"].format(**{**fields, "plot": ""}) + template["body"].format(**fields, review="")
+    budget = limit - len(empty)
+    if "{plot}" in template["head"]:
+        fields["plot"] = clip_md(movie.get("plot", ""), min(PLOT_LIMIT, budget // 4))
+        budget -= len(fields["plot"])
+    caption = (
+        template["head"].format(**fields)
+        + template["body"].format(**fields, review=clip_md(review, max(budget, 0)))
+    )
+    return {"caption": caption, "follow_ups": []}
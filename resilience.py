@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, Tuple, Type
+
+import aiohttp
+
+from metrics import UPSTREAM_ERRORS, UPSTREAM_RETRIES, UPSTREAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Внешний сервис признан недоступным, вызов отклонен без обращения к нему."""
+
+
+def transient_http_error(error: BaseException) -> bool:
+    """Ошибка, которую имеет смысл повторить: ответы 4xx (кроме 429) - нет."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после ``failure_threshold`` ошибок подряд вызовы
+    отклоняются сразу; через ``reset_timeout`` секунд пропускается один
+    пробный вызов (остальные отклоняются, пока он идет), и при его успехе
+    цепь снова замыкается.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60,
+        on_state_change: Optional[Callable[[str, str, str], None]] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"{self.name}: состояние цепи {self.state} -> {state}")
+        previous, self.state = self.state, state
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(self.name, previous, state)
+            except Exception as e:
+                logger.error(f"{self.name}: ошибка обработчика смены состояния: {str(e)}")
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def release(self):
+        """Пробный вызов прерван без результата - следующий вызов снова станет пробным."""
+        self.probing = False
+
+    def record_success(self):
+        self.probing = False
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+
+class CallPolicy:
+    """Политика вызова внешнего сервиса.
+
+    Каждая попытка ограничена ``timeout``. Ошибки из ``retry_on`` повторяются
+    до ``retries`` раз с экспоненциальной задержкой и полным джиттером;
+    ``retryable`` дополнительно отсеивает среди них постоянные (например,
+    ответ 4xx). Остальные ошибки не повторяются и не меняют состояние цепи:
+    отказ в авторизации не говорит о том, что сервис ожил. Если
+    задан ``hedge_quantile``, то при превышении этого квантиля задержек
+    запускается дублирующий запрос и берется первый успешный ответ.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30,
+        retries: int = 2,
+        backoff_base: float = 1.0,
+        backoff_max: float = 20.0,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_quantile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        retryable: Optional[Callable[[BaseException], bool]] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.retry_on = tuple(retry_on) + (asyncio.TimeoutError,)
+        self.retryable = retryable
+        self.latencies: deque = deque(maxlen=200)
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "hedged": 0, "rejected": 0}
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_quantile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))
+        return ordered[index]
+
+    def _should_retry(self, error: BaseException) -> bool:
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        return isinstance(error, self.retry_on) and (self.retryable is None or self.retryable(error))
+
+    async def call(self, func: Callable[[], Awaitable]):
+        """Вызывает ``func()`` (фабрику корутины) по правилам политики."""
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(f"{self.name} временно недоступен")
+            probe = self.breaker is not None and self.breaker.state == HALF_OPEN
+
+            try:
+                result = await self._attempt(func)
+            except asyncio.CancelledError:
+                if probe:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                if not self._should_retry(e):
+                    # Запрос отклонен (4xx, ошибка разбора): ни сбой, ни успех сервиса -
+                    # пробный вызов просто освобождается
+                    if probe:
+                        self.breaker.release()
+                    self.stats["failures"] += 1
+                    raise
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                if attempt >= self.retries:
+                    self.stats["failures"] += 1
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                self.stats["retries"] += 1
+                UPSTREAM_RETRIES.inc(upstream=self.name)
+                logger.warning(
+                    f"{self.name}: попытка {attempt} неудачна ({type(e).__name__}: {e}), "
+                    f"повтор через {delay:.1f} с"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    async def _attempt(self, func: Callable[[], Awaitable]):
+        started = time.monotonic()
+        hedge_delay = self._hedge_delay()
+        try:
+            if hedge_delay is None:
+                result = await asyncio.wait_for(func(), self.timeout)
+            else:
+                result = await self._hedged(func, hedge_delay)
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream=self.name, error=type(e).__name__)
+            UPSTREAM_SECONDS.observe(time.monotonic() - started, upstream=self.name)
+            raise
+        elapsed = time.monotonic() - started
+        self.latencies.append(elapsed)
+        UPSTREAM_SECONDS.observe(elapsed, upstream=self.name)
+        return result
+
+    async def _hedged(self, func: Callable[[], Awaitable], hedge_delay: float):
+        deadline = time.monotonic() + self.timeout
+        tasks = [asyncio.ensure_future(func())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay, self.timeout))
+            if not done:
+                self.stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(func()))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(
+                    tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
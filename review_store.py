@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REVIEW_DB_FILE = "reviews.sqlite3"
+
+# Ключ пула: (IMDB ID, стиль, хэш промпта рецензии)
+ReviewKey = Tuple[str, str, str]
+
+
+class ReviewStore:
+    """Пулы готовых рецензий на SQLite.
+
+    На каждый ключ хранится до ``variants`` вариантов. ``take()`` отдает
+    сначала еще не показанные варианты, затем тот, который дольше всех не
+    показывали, поэтому повторные запросы получают разные тексты.
+    При переполнении пула (и всего хранилища сверх ``max_reviews``)
+    вытесняются давно не использованные варианты. ``refill()`` дополняет
+    пул в фоне - не больше одной генерации на ключ одновременно.
+    """
+
+    def __init__(self, path: str = REVIEW_DB_FILE, variants: int = 3, max_reviews: int = 5000):
+        self.path = path
+        self.variants = variants
+        self.max_reviews = max_reviews
+        self.stats = {"hits": 0, "misses": 0, "added": 0, "refills": 0}
+        self._refills: Dict[ReviewKey, asyncio.Task] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " imdb_id TEXT NOT NULL,"
+            " style TEXT NOT NULL,"
+            " prompt_hash TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL);"
+            "CREATE INDEX IF NOT EXISTS reviews_key ON reviews (imdb_id, style, prompt_hash, last_used);"
+        )
+        self._conn.commit()
+
+    def count(self, key: ReviewKey) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM reviews WHERE imdb_id = ? AND style = ? AND prompt_hash = ?", key
+        ).fetchone()[0]
+
+    def take(self, key: ReviewKey) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT id, text FROM reviews WHERE imdb_id = ? AND style = ? AND prompt_hash = ?"
+            " ORDER BY last_used IS NOT NULL, last_used LIMIT 1",
+            key
+        ).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        with self._conn:
+            self._conn.execute("UPDATE reviews SET last_used = ? WHERE id = ?", (time.time(), row[0]))
+        self.stats["hits"] += 1
+        return row[1]
+
+    def add(self, key: ReviewKey, text: str):
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO reviews (imdb_id, style, prompt_hash, text, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (*key, text, now)
+            )
+            self._conn.execute(
+                "DELETE FROM reviews WHERE id IN ("
+                " SELECT id FROM reviews WHERE imdb_id = ? AND style = ? AND prompt_hash = ?"
+                " ORDER BY COALESCE(last_used, created_at) DESC LIMIT -1 OFFSET ?)",
+                (*key, self.variants)
+            )
+            self._conn.execute(
+                "DELETE FROM reviews WHERE id IN ("
+                " SELECT id FROM reviews ORDER BY COALESCE(last_used, created_at) DESC LIMIT -1 OFFSET ?)",
+                (self.max_reviews,)
+            )
+        self.stats["added"] += 1
+
+    def refill(self, key: ReviewKey, generate: Callable[[], Awaitable[Optional[str]]]):
+        """Запускает фоновую генерацию варианта, если пул неполон и она еще не идет."""
+        task = self._refills.get(key)
+        if (task is not None and not task.done()) or self.count(key) >= self.variants:
+            return
+        self._refills[key] = asyncio.create_task(self._refill(key, generate))
+
+    async def _refill(self, key: ReviewKey, generate: Callable[[], Awaitable[Optional[str]]]):
+        try:
+            text = await generate()
+            if text:
+                self.add(key, text)
+                self.stats["refills"] += 1
+        except Exception as e:
+            logger.error(f"Пул рецензий {key[0]}/{key[1]}: фоновая генерация не удалась: {str(e)}")
+        finally:
+            self._refills.pop(key, None)
+
+    async def close(self):
+        tasks = list(self._refills.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._conn.close()
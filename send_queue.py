@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше - важнее
+PRIORITY_CHANNEL = 0
+PRIORITY_USER = 1
+PRIORITY_ADMIN = 2
+LANE_NAMES = {PRIORITY_CHANNEL: "channel", PRIORITY_USER: "user", PRIORITY_ADMIN: "admin"}
+
+# Лимиты Telegram: ~30 сообщений/с на бота, 1/с в личный чат, 20/мин в группу или канал
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20.0 / 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Сколько ждать до появления токена (0 - можно отправлять)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+def is_private_chat(chat_id) -> bool:
+    # Личные чаты - положительные числовые ID; группы и каналы - отрицательные или @username
+    try:
+        return int(chat_id) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class OutboundQueue:
+    """Очередь исходящих запросов к Telegram.
+
+    Запросы разбиты на полосы приоритета и ограничены общим и
+    per-chat token bucket. ``RetryAfter`` от Telegram не теряет сообщение:
+    запрос возвращается в очередь после указанной паузы. Один чат не
+    блокирует воркер - если его бакет пуст, запрос откладывается. Токены
+    общего и чатового бакетов забираются вместе, без ожидания между
+    проверкой и списанием. После ``close()`` ожидающие и отложенные
+    запросы завершаются ошибкой, а не висят.
+    """
+
+    def __init__(self, workers: int = 4, global_rate: float = GLOBAL_RATE, max_retry_after: int = 5):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.max_retry_after = max_retry_after
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: list = []
+        self._delayed: Dict[asyncio.TimerHandle, tuple] = {}
+        self._sequence = itertools.count()
+        self._depth = {lane: 0 for lane in LANE_NAMES}
+        self.latencies: deque = deque(maxlen=500)
+        self.stats = {"delivered": 0, "failed": 0, "retry_after": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        pending = []
+        for handle, job in self._delayed.items():
+            handle.cancel()
+            pending.append(job)
+        self._delayed.clear()
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait()[2])
+        for job in pending:
+            future = job[4]
+            if not future.done():
+                future.set_exception(RuntimeError("Очередь отправки остановлена"))
+        if pending:
+            logger.warning(f"Очередь отправки остановлена, не отправлено запросов: {len(pending)}")
+        self._depth = {lane: 0 for lane in LANE_NAMES}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            rate = PRIVATE_CHAT_RATE if is_private_chat(chat_id) else GROUP_CHAT_RATE
+            bucket = self._chat_buckets[key] = TokenBucket(rate, max(1.0, rate * 3))
+        return bucket
+
+    async def send(self, call: Callable, chat_id, priority: int = PRIORITY_USER):
+        """Ставит ``call()`` (фабрику корутины запроса) в очередь и ждет результата."""
+        if not self.running:
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        self._put((priority, time.monotonic(), call, chat_id, future, 0))
+        return await future
+
+    def _put(self, job: tuple):
+        priority = job[0]
+        self._depth[priority] += 1
+        self._queue.put_nowait((priority, next(self._sequence), job))
+
+    def _put_later(self, delay: float, job: tuple):
+        handle = None
+
+        def put():
+            self._delayed.pop(handle, None)
+            self._put(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, put)
+        self._delayed[handle] = job
+
+    async def _reserve(self, chat_id) -> bool:
+        """Списывает токены обоих бакетов сразу; False - чат пока исчерпал лимит."""
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            if chat_bucket.wait_time() > 0:
+                return False
+            global_wait = self.global_bucket.wait_time()
+            if global_wait == 0:
+                # Между проверкой и списанием нет await - другой воркер не вклинится
+                self.global_bucket.consume()
+                chat_bucket.consume()
+                return True
+            await asyncio.sleep(global_wait)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self._depth[job[0]] -= 1
+            try:
+                await self._process(job)
+            except Exception as e:
+                # Один сломанный запрос не должен останавливать воркер
+                logger.error(f"Очередь отправки: ошибка обработки запроса: {str(e)}")
+                if not job[4].done():
+                    job[4].set_exception(e)
+
+    async def _process(self, job: tuple):
+        priority, enqueued_at, call, chat_id, future, attempts = job
+        if future.done():
+            return
+
+        if not await self._reserve(chat_id):
+            self._put_later(self._chat_bucket(chat_id).wait_time(), job)
+            return
+        # Вызывающий мог отмениться (таймаут) уже во время запроса - тогда
+        # результат просто некому отдать
+        try:
+            result = await call()
+        except TelegramRetryAfter as e:
+            self.stats["retry_after"] += 1
+            if attempts >= self.max_retry_after:
+                self.stats["failed"] += 1
+                if not future.done():
+                    future.set_exception(e)
+                return
+            logger.warning(f"Flood control для {chat_id}: повтор через {e.retry_after} с")
+            self._put_later(e.retry_after, (priority, enqueued_at, call, chat_id, future, attempts + 1))
+            return
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        self.stats["delivered"] += 1
+        self.latencies.append(time.monotonic() - enqueued_at)
+        if not future.done():
+            future.set_result(result)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def quantile(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+        return {
+            **self.stats,
+            "depth": {LANE_NAMES[lane]: depth for lane, depth in self._depth.items()},
+            "latency_p50": quantile(0.5),
+            "latency_p95": quantile(0.95),
+        }
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Пропускает все запросы бота с ``chat_id`` через ``OutboundQueue``.
+
+    ``classify(chat_id)`` возвращает полосу приоритета для чата.
+    """
+
+    def __init__(self, queue: OutboundQueue, classify: Callable[[object], int]):
+        self.queue = queue
+        self.classify = classify
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        return await self.queue.send(
+            lambda: self._timed(make_request, bot, method), chat_id, self.classify(chat_id)
+        )
+
+    @staticmethod
+    async def _timed(make_request, bot, method):
+        started = time.monotonic()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream="Telegram", error=type(e).__name__)
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.monotonic() - started, upstream="Telegram")
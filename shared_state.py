@@ -0,0 +1,295 @@
+"""Общее состояние нескольких реплик бота.
+
+``SHARED_STATE_URL`` выбирает хранилище ключ-значение:
+
+- пусто - режим одной реплики (FSM в памяти процесса, без блокировок);
+- ``memory://`` - хранилище внутри процесса с тем же поведением, что и
+  общее: для проверки режима без внешнего сервиса;
+- ``redis://host:6379/0`` - Redis (нужен пакет ``redis``).
+
+В общем хранилище живут данные FSM, аренда лидера (публикует по
+расписанию только лидер) и ключи идемпотентности публикаций.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+MEMORY_URL = "memory://"
+
+
+class KeyValueStore(abc.ABC):
+    """Строковое хранилище ключ-значение с временем жизни записей.
+
+    ``set_if_absent``, ``extend_if_equal`` и ``delete_if_equal`` атомарны:
+    на них построены аренда лидера и ключи идемпотентности.
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def extend_if_equal(self, key: str, value: str, ttl: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemoryKeyValueStore(KeyValueStore):
+    """Хранилище внутри процесса. Методы не уступают управление циклу
+    событий, поэтому каждая операция атомарна без блокировок."""
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        return value
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl else None
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._items[key] = (value, self._expiry(ttl))
+
+    async def delete(self, key: str):
+        self._items.pop(key, None)
+
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._items[key] = (value, self._expiry(ttl))
+        return True
+
+    async def extend_if_equal(self, key: str, value: str, ttl: float) -> bool:
+        if self._live(key) != value:
+            return False
+        self._items[key] = (value, self._expiry(ttl))
+        return True
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        if self._live(key) != value:
+            return False
+        del self._items[key]
+        return True
+
+
+# Проверка владельца и изменение записи одной командой на стороне Redis
+EXTEND_IF_EQUAL = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+)
+DELETE_IF_EQUAL = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+class RedisKeyValueStore(KeyValueStore):
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("Для SHARED_STATE_URL=redis://... нужен пакет redis (pip install redis)") from e
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _px(ttl: Optional[float]) -> Optional[int]:
+        return int(ttl * 1000) if ttl else None
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._redis.set(key, value, px=self._px(ttl))
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(await self._redis.set(key, value, px=self._px(ttl), nx=True))
+
+    async def extend_if_equal(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self._redis.eval(EXTEND_IF_EQUAL, 1, key, value, self._px(ttl)))
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        return bool(await self._redis.eval(DELETE_IF_EQUAL, 1, key, value))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def open_shared_store(url: Optional[str]) -> Optional[KeyValueStore]:
+    """Хранилище по ``SHARED_STATE_URL`` или ``None`` в режиме одной реплики."""
+    if not url:
+        return None
+    if url == MEMORY_URL:
+        return MemoryKeyValueStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisKeyValueStore(url)
+    raise ValueError(f"Неизвестное общее хранилище: {url}")
+
+
+def replica_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class SharedFSMStorage(BaseStorage):
+    """Хранилище FSM aiogram поверх ``KeyValueStore``: состояние и данные
+    диалога (например, подготовленная рецензия админа) видны любой реплике."""
+
+    def __init__(self, store: KeyValueStore, prefix: str = "fsm", ttl: Optional[float] = None):
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key: StorageKey, part: str) -> str:
+        return ":".join(
+            str(value) for value in (
+                self.prefix, key.bot_id, key.chat_id, key.user_id,
+                key.thread_id or "", key.business_connection_id or "", key.destiny, part
+            )
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.store.delete(self._key(key, "state"))
+        else:
+            await self.store.set(self._key(key, "state"), state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.store.get(self._key(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not data:
+            await self.store.delete(self._key(key, "data"))
+        else:
+            await self.store.set(self._key(key, "data"), json.dumps(dict(data), ensure_ascii=False), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self.store.get(self._key(key, "data"))
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        # Хранилище общее с арендой и ключами публикаций - закрывает его владелец
+        pass
+
+
+class LeaderLease:
+    """Аренда лидерства с продлением.
+
+    Реплика становится лидером, если успела записать ключ аренды, и
+    продлевает его каждые ``ttl / 3`` секунд. Лидерство считается
+    утраченным, если продление не удалось или с последнего успешного
+    прошло больше ``2/3 ttl`` - раньше, чем ключ истечет и его займет
+    другая реплика.
+    """
+
+    def __init__(self, store: KeyValueStore, name: str = "leader", ttl: float = 30, owner: Optional[str] = None):
+        self.store = store
+        self.key = f"lease:{name}"
+        self.ttl = ttl
+        self.owner = owner or replica_id()
+        self._valid_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def _renew(self):
+        was_leader = self.is_leader
+        started = time.monotonic()
+        if was_leader:
+            held = await self.store.extend_if_equal(self.key, self.owner, self.ttl)
+        else:
+            held = await self.store.set_if_absent(self.key, self.owner, self.ttl)
+        self._valid_until = started + self.ttl * 2 / 3 if held else 0.0
+        if held != was_leader:
+            logger.warning(f"{self.owner}: {'получено' if held else 'потеряно'} лидерство ({self.key})")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self._renew()
+            except Exception as e:
+                self._valid_until = 0.0
+                logger.error(f"{self.owner}: аренда {self.key} не продлена: {str(e)}")
+
+    async def start(self):
+        try:
+            await self._renew()
+        except Exception as e:
+            logger.error(f"{self.owner}: аренда {self.key} не получена: {str(e)}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.is_leader:
+            # Освобождаем аренду сразу, не дожидаясь истечения
+            await self.store.delete_if_equal(self.key, self.owner)
+        self._valid_until = 0.0
+
+
+class IdempotencyKeys:
+    """Однократные операции: ``claim()`` успешен только у первой реплики
+    (или первой попытки) для данного набора частей ключа."""
+
+    def __init__(self, store: KeyValueStore, prefix: str = "publish", ttl: float = 3 * 24 * 3600):
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+        self.owner = replica_id()
+
+    def _key(self, parts: tuple) -> str:
+        return ":".join((self.prefix, *map(str, parts)))
+
+    async def claim(self, *parts) -> bool:
+        return await self.store.set_if_absent(self._key(parts), self.owner, self.ttl)
+
+    async def release(self, *parts):
+        """Снимает ключ, если операция не состоялась и ее можно повторить."""
+        await self.store.delete_if_equal(self._key(parts), self.owner)
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+STATE_SNAPSHOT_FILE = "bot_state.json"
+STATE_JOURNAL_FILE = "bot_state.journal"
+
+
+class StateStore:
+    """Состояние бота: компактный снимок плюс журнал изменений.
+
+    Каждое изменение дописывается в журнал одной строкой; после
+    ``compact_every`` записей состояние целиком атомарно сохраняется в снимок,
+    а журнал очищается. При старте читается снимок и короткий хвост журнала.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str = STATE_SNAPSHOT_FILE,
+        journal_path: str = STATE_JOURNAL_FILE,
+        compact_every: int = 50,
+    ):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.data: dict = {}
+        self._journal_entries = 0
+
+    def load(self, defaults: dict) -> dict:
+        self.data = dict(defaults)
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.error(f"Снимок состояния поврежден, используются значения по умолчанию: {e}")
+
+        self._journal_entries = 0
+        damaged = False
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка после аварийной остановки
+                        logger.warning("Журнал состояния: пропущена поврежденная запись")
+                        damaged = True
+                        continue
+                    self.data[entry["key"]] = entry["value"]
+                    self._journal_entries += 1
+        except FileNotFoundError:
+            pass
+
+        # Новые записи не должны склеиться с оборванной строкой
+        if damaged:
+            self.compact()
+
+        logger.info(f"Состояние загружено, записей в журнале: {self._journal_entries}")
+        return self.data
+
+    def set(self, key: str, value):
+        self.data[key] = value
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_entries += 1
+        if self._journal_entries >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Атомарно записывает снимок и очищает журнал."""
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".state-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Снимок уже содержит все изменения - журнал можно обнулить
+        open(self.journal_path, "w", encoding="utf-8").close()
+        self._journal_entries = 0
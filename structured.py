@@ -0,0 +1,300 @@
+"""Структурированные ответы модели: JSON вместо свободного текста.
+
+Схема ответа (небольшое подмножество JSON Schema) один раз компилируется
+в функцию-проверку. Мелкие ошибки модели исправляются на месте, без
+повторного запроса: обертка ```json, пояснения вокруг объекта, висячие
+запятые, ответ, оборванный по max_tokens, ключи в другом регистре
+("IMDB-ID" вместо "imdb_id"), числа строкой, ID с лишним текстом вокруг.
+Итог каждого разбора (ok / repaired / failed) считается в метриках.
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import LLM_PARSE
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# (значение, путь, список исправлений) -> проверенное значение
+Validator = Callable[[Any, str, List[str]], Any]
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _key_token(key: str) -> str:
+    return re.sub(r"[^0-9a-z]", "", key.casefold())
+
+
+def _unanchored(pattern: str) -> str:
+    return pattern[1:] if pattern.startswith("^") else pattern
+
+
+def _compile_string(schema: dict) -> Validator:
+    pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+    search = re.compile(_unanchored(schema["pattern"]).rstrip("$")) if pattern else None
+    min_length = schema.get("minLength", 0)
+
+    def validate(value, path, repairs):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+            repairs.append(f"{path}: число вместо строки")
+        if not isinstance(value, str):
+            raise SchemaError(f"{path}: ожидалась строка")
+        value = value.strip()
+        if pattern is not None and not pattern.fullmatch(value):
+            found = search.search(value)
+            if found is None:
+                raise SchemaError(f"{path}: не соответствует {pattern.pattern}")
+            value = found.group(0)
+            repairs.append(f"{path}: выделено {value}")
+        if len(value) < min_length:
+            raise SchemaError(f"{path}: пустая строка")
+        return value
+
+    return validate
+
+
+def _compile_integer(schema: dict) -> Validator:
+    minimum = schema.get("minimum")
+    maximum = schema.get("maximum")
+
+    def validate(value, path, repairs):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, str):
+            found = re.search(r"-?\d+", value)
+            if found is None:
+                raise SchemaError(f"{path}: ожидалось целое число")
+            value = int(found.group(0))
+            repairs.append(f"{path}: число из строки")
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise SchemaError(f"{path}: ожидалось целое число")
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise SchemaError(f"{path}: {value} вне диапазона")
+        return value
+
+    return validate
+
+
+def _compile_array(schema: dict) -> Validator:
+    items = compile_schema(schema["items"])
+    drop_invalid = schema.get("dropInvalid", False)
+    min_items = schema.get("minItems", 0)
+
+    def validate(value, path, repairs):
+        if isinstance(value, dict):
+            value = [value]
+            repairs.append(f"{path}: объект вместо списка")
+        if not isinstance(value, list):
+            raise SchemaError(f"{path}: ожидался список")
+        result = []
+        for index, item in enumerate(value):
+            try:
+                result.append(items(item, f"{path}[{index}]", repairs))
+            except SchemaError as e:
+                if not drop_invalid:
+                    raise
+                # Один испорченный элемент не губит весь пакет
+                repairs.append(f"отброшен {e}")
+        if len(result) < min_items:
+            raise SchemaError(f"{path}: элементов меньше {min_items}")
+        return result
+
+    return validate
+
+
+def _compile_object(schema: dict) -> Validator:
+    properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    defaults = {
+        name: sub["default"] for name, sub in schema.get("properties", {}).items() if "default" in sub
+    }
+    required = set(schema.get("required", ()))
+    tokens = {_key_token(name): name for name in properties}
+    wrapped = schema.get("wrappedIn")
+
+    def validate(value, path, repairs):
+        if isinstance(value, list) and wrapped:
+            # Модель вернула сам список вместо {"movies": [...]}
+            value = {wrapped: value}
+            repairs.append(f"{path}: список без обертки")
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path}: ожидался объект")
+        found = {}
+        for key, item in value.items():
+            name = key if key in properties else tokens.get(_key_token(key))
+            if name is None or name in found:
+                continue
+            if name != key:
+                repairs.append(f"{path}: ключ {key} -> {name}")
+            found[name] = item
+
+        result = {}
+        for name, validate_property in properties.items():
+            item = found.get(name, MISSING)
+            if item is not MISSING and item is not None:
+                try:
+                    result[name] = validate_property(item, f"{path}.{name}", repairs)
+                    continue
+                except SchemaError:
+                    if name not in defaults:
+                        raise
+            if name in defaults:
+                result[name] = defaults[name]
+                if item is not MISSING:
+                    repairs.append(f"{path}.{name}: значение по умолчанию")
+            elif name in required:
+                raise SchemaError(f"{path}.{name}: поле отсутствует")
+        return result
+
+    return validate
+
+
+COMPILERS = {
+    "string": _compile_string,
+    "integer": _compile_integer,
+    "array": _compile_array,
+    "object": _compile_object,
+}
+
+
+def compile_schema(schema: dict) -> Validator:
+    """Функция-проверка для схемы; разбор схемы выполняется один раз."""
+    return COMPILERS[schema["type"]](schema)
+
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```\s*$")
+
+
+def _scan(text: str) -> Tuple[List[str], bool, List[int]]:
+    """Незакрытые скобки (закрывающими символами), оборвана ли строка и
+    позиции запятых вне строк."""
+    stack, commas = [], []
+    in_string = escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == ",":
+            commas.append(index)
+    return stack, in_string, commas
+
+
+def _repair_truncated(body: str) -> Any:
+    """Восстанавливает ответ, оборванный по max_tokens.
+
+    Последняя пара ключ-значение (или элемент списка) отрезается целиком по
+    запятой вне строк, а не закрывается на месте: оборванная строка или
+    число выглядели бы целыми. Обязательное поле, оказавшееся без значения,
+    отвергнет схема - лучше повторный запрос, чем рецензия без конца.
+    """
+    stack, in_string, commas = _scan(body)
+    candidates = []
+    if not in_string and body.rstrip()[-1:] in ("}", "]"):
+        candidates.append(body)  # оборвано сразу после закрытого значения
+    candidates += [body[:cut] for cut in reversed(commas[-4:])]
+    for candidate in candidates:
+        closers = "".join(reversed(_scan(candidate)[0]))
+        try:
+            return json.loads(TRAILING_COMMA.sub(r"\1", candidate.rstrip() + closers), strict=False)
+        except ValueError:
+            continue
+    raise ValueError("JSON не удалось восстановить")
+
+
+def extract_json(text: str, truncated: Optional[bool] = None) -> Tuple[Any, bool]:
+    """Разбирает JSON из ответа модели; второй элемент - понадобились ли исправления.
+
+    Переводы строк внутри строк допускаются (``strict=False``): модель пишет
+    абзацы рецензии как есть. Оборванный ответ чинится, только если он
+    действительно оборван: ``truncated`` (``finish_reason == "length"``)
+    или в тексте остались незакрытые скобки.
+    """
+    try:
+        return json.loads(text, strict=False), False
+    except ValueError:
+        pass
+
+    body = CODE_FENCE.sub("", text.strip())
+    starts = [index for index in (body.find("{"), body.find("[")) if index >= 0]
+    if not starts:
+        raise ValueError("в ответе нет JSON")
+    body = body[min(starts):]
+    end = max(body.rfind("}"), body.rfind("]"))
+
+    if end >= 0:
+        # Целый объект с текстом вокруг или висячими запятыми
+        try:
+            return json.loads(TRAILING_COMMA.sub(r"\1", body[:end + 1]), strict=False), True
+        except ValueError:
+            pass
+
+    stack, in_string, _ = _scan(body)
+    if not (truncated or stack or in_string):
+        raise ValueError("JSON не удалось разобрать")
+    return _repair_truncated(body), True
+
+
+class StructuredOutput:
+    """Разбор ответа одного места вызова по его схеме с учетом в метриках."""
+
+    def __init__(self, site: str, schema: dict):
+        self.site = site
+        self.validate = compile_schema(schema)
+
+    def parse(self, text: str, truncated: Optional[bool] = None) -> Optional[Any]:
+        repairs: List[str] = []
+        try:
+            value, fixed = extract_json(text, truncated)
+            if fixed:
+                repairs.append("синтаксис JSON")
+            result = self.validate(value, "$", repairs)
+        except ValueError as e:
+            LLM_PARSE.inc(site=self.site, outcome="failed")
+            logger.error(f"{self.site}: ответ модели не разобран: {str(e)}")
+            return None
+        LLM_PARSE.inc(site=self.site, outcome="repaired" if repairs else "ok")
+        if repairs:
+            logger.info(f"{self.site}: ответ исправлен локально: {'; '.join(repairs)}")
+        return result
+
+
+def _decode_string(raw: str) -> str:
+    # В конце потока может стоять оборванная escape-последовательность (\u04)
+    for end in range(len(raw), max(len(raw) - 6, 0) - 1, -1):
+        try:
+            return json.loads(f'"{raw[:end]}"')
+        except ValueError:
+            continue
+    return raw
+
+
+def stream_fields(text: str) -> Dict[str, Any]:
+    """Поля, значения которых уже полностью пришли в потоковом JSON-ответе."""
+    fields = {}
+    for key, raw in re.findall(r'"([\w-]+)"\s*:\s*"((?:[^"\\]|\\.)*)"', text):
+        fields.setdefault(key, _decode_string(raw))
+    for key, number in re.findall(r'"([\w-]+)"\s*:\s*(-?\d+)\s*[,}\n]', text):
+        fields.setdefault(key, int(number))
+    return fields
+
+
+def partial_string(text: str, key: str) -> Optional[str]:
+    """Начало строкового поля ``key``, даже если его значение еще не дописано."""
+    match = re.search(rf'"{re.escape(key)}"\s*:\s*"((?:[^"\\]|\\.)*)', text)
+    return _decode_string(match.group(1)) if match else None
@@ -0,0 +1,99 @@
+"""Общие фикстуры тестов.
+
+Бот импортируется один раз на всю сессию; его файлы (история, кэши,
+состояние) пишутся во временный каталог. Запросы к Telegram API
+перехватываются ``TelegramRecorder`` - сеть тестам не нужна.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_ADMIN_ID = 1000
+TEST_USER_ID = 2000
+TEST_CHANNEL_ID = "-1001"
+
+WORKDIR = tempfile.mkdtemp(prefix="cinemabot-tests-")
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:test",
+    "OPENAI_API_KEY": "sk-test",
+    "OMDB_API_KEY": "test",
+    "CHANNEL_ID": TEST_CHANNEL_ID,
+    "ADMINS": str(TEST_ADMIN_ID),
+    "HISTORY_DB_FILE": os.path.join(WORKDIR, "history.sqlite3"),
+    "OMDB_CACHE_FILE": os.path.join(WORKDIR, "omdb_cache.sqlite3"),
+    "REVIEW_DB_FILE": os.path.join(WORKDIR, "reviews.sqlite3"),
+    "POSTER_DIR": os.path.join(WORKDIR, "posters"),
+    "POSTER_DB_FILE": os.path.join(WORKDIR, "posters.sqlite3"),
+    "STATE_SNAPSHOT_FILE": os.path.join(WORKDIR, "bot_state.json"),
+    "STATE_JOURNAL_FILE": os.path.join(WORKDIR, "bot_state.journal"),
+    "CHANNELS_FILE": os.path.join(WORKDIR, "channels.json"),
+    "CATALOG_FILE": os.path.join(WORKDIR, "imdb_catalog.bin"),
+    "TITLE_INDEX_FILE": os.path.join(WORKDIR, "title_index.sqlite3"),
+})
+
+
+class TelegramRecorder:
+    """Подменяет ``make_request`` сессии бота: запоминает вызванные методы
+    и отвечает так, как ответил бы Telegram."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail_with = {}  # имя метода -> исключение для следующих вызовов
+
+    async def make_request(self, bot, method, timeout=None):
+        from aiogram.types import Chat, Message, PhotoSize
+
+        name = type(method).__name__
+        self.calls.append((name, method))
+        error = self.fail_with.get(name)
+        if error is not None:
+            raise error(method)
+        chat_id = getattr(method, "chat_id", None)
+        if name in ("SendMessage", "SendPhoto", "EditMessageText"):
+            photo = None
+            if name == "SendPhoto":
+                photo = [PhotoSize(file_id=f"file-{len(self.calls)}", file_unique_id="u", width=1, height=1)]
+            return Message(
+                message_id=len(self.calls),
+                date=datetime.fromtimestamp(int(time.time())),
+                chat=Chat(id=int(chat_id or 0), type="private"),
+                text=getattr(method, "text", None),
+                photo=photo,
+            )
+        return True
+
+    def methods(self) -> list:
+        return [name for name, _ in self.calls]
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    import main
+    return main
+
+
+@pytest.fixture
+def telegram(main_module, monkeypatch):
+    recorder = TelegramRecorder()
+    monkeypatch.setattr(main_module.bot.session, "make_request", recorder.make_request)
+    return recorder
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "user"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": text,
+        },
+    }
@@ -0,0 +1,68 @@
+import asyncio
+
+from async_cache import async_cached
+
+
+def test_calls_with_progress_callback_are_not_coalesced():
+    calls = []
+
+    @async_cached(coalesce_if=lambda query, on_text=None: on_text is None, key=lambda query, on_text=None: query)
+    async def generate(query, on_text=None):
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        if on_text:
+            on_text(query)
+        return {"query": query}
+
+    async def scenario():
+        seen = []
+        results = await asyncio.gather(
+            generate("матрица"),
+            generate("матрица"),
+            generate("матрица", on_text=seen.append),
+        )
+        assert results == [{"query": "матрица"}] * 3
+        # Второй вызов без превью присоединился к первому, вызов с превью получил свой поток
+        assert calls == ["матрица", "матрица"]
+        assert seen == ["матрица"]
+        assert generate.cache_info()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_hit_returns_independent_copy():
+    @async_cached()
+    async def load(name):
+        return {"tags": [name]}
+
+    async def scenario():
+        first = await load("a")
+        first["tags"].append("b")
+        assert await load("a") == {"tags": ["a"]}
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_reviews_share_one_request(main_module, monkeypatch):
+    calls = []
+
+    async def chat_completion(site, messages, **params):
+        calls.append(site)
+        await asyncio.sleep(0.01)
+        return f"Рецензия {len(calls)}"
+
+    monkeypatch.setattr(main_module, "chat_completion", chat_completion)
+    monkeypatch.setitem(main_module.DB, "fast_reviews", False)
+    movie = {"imdb_id": "tt0133093", "title": "Матрица", "year": 1999, "plot": "Сюжет."}
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            main_module.generate_review(movie, "ироничный"),
+            main_module.generate_review(movie, "ироничный"),
+        )
+        assert first == second == "Рецензия 1"
+        # Без одновременного запроса рецензия снова новая - результат не кэшируется
+        assert await main_module.generate_review(movie, "ироничный") == "Рецензия 2"
+
+    asyncio.run(scenario())
+    assert calls == ["review", "review"]
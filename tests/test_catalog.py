@@ -0,0 +1,107 @@
+import gzip
+
+from catalog import MovieCatalog, _slot_hash, build_catalog, load_catalog
+
+BASICS_COLUMNS = ["tconst", "titleType", "primaryTitle", "isAdult", "startYear", "genres"]
+RATINGS_COLUMNS = ["tconst", "averageRating", "numVotes"]
+
+
+def write_tsv(path, columns, rows):
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        f.write("\t".join(columns) + "\n")
+        for row in rows:
+            f.write("\t".join(str(value) for value in row) + "\n")
+    return str(path)
+
+
+def make_catalog(tmp_path, basics, ratings, min_votes=1000):
+    basics_path = write_tsv(tmp_path / "basics.tsv.gz", BASICS_COLUMNS, basics)
+    ratings_path = write_tsv(tmp_path / "ratings.tsv.gz", RATINGS_COLUMNS, ratings)
+    output = str(tmp_path / "catalog.bin")
+    count = build_catalog(basics_path, ratings_path, output, min_votes=min_votes)
+    return count, MovieCatalog(output)
+
+
+def test_build_keeps_rated_movies_only(tmp_path):
+    count, catalog = make_catalog(tmp_path, [
+        ("tt0133093", "movie", "The Matrix", 0, 1999, "Action,Sci-Fi"),
+        ("tt0000002", "tvSeries", "Сериал", 0, 2001, "Drama"),
+        ("tt0000003", "movie", "Для взрослых", 1, 2002, "Drama"),
+        ("tt0000004", "movie", "Без года", 0, "\\N", "Drama"),
+        ("tt0000005", "movie", "Мало голосов", 0, 2003, "Drama"),
+        ("tt0000006", "movie", "Без рейтинга", 0, 2004, "Drama"),
+    ], [
+        ("tt0133093", 8.7, 2000000),
+        ("tt0000002", 8.0, 5000),
+        ("tt0000003", 7.0, 5000),
+        ("tt0000004", 7.0, 5000),
+        ("tt0000005", 9.0, 10),
+    ])
+
+    assert count == len(catalog) == 1
+    assert catalog.has_id("tt0133093")
+    assert catalog.get("tt0133093") == {
+        "imdb_id": "tt0133093", "title": "The Matrix", "year": 1999, "rating": 8.7, "votes": 2000000,
+    }
+    for imdb_id in ("tt0000002", "tt0000003", "tt0000004", "tt0000005", "tt0000006"):
+        assert not catalog.has_id(imdb_id)
+    # Мусор вместо ID - не ошибка, а промах
+    for imdb_id in ("", "0133093", "ttabc", None):
+        assert not catalog.has_id(imdb_id)
+    assert catalog.get("tt9999999") is None
+    catalog.close()
+
+
+def test_colliding_ids_are_found_by_probing(tmp_path):
+    # Три записи -> 8 слотов; множитель нечетный, поэтому ID с одинаковыми
+    # младшими тремя битами попадают в один слот
+    numbers = [1, 9, 17]
+    assert len({_slot_hash(number, 7) for number in numbers}) == 1
+    count, catalog = make_catalog(tmp_path, [
+        (f"tt{number:07d}", "movie", f"Фильм {number}", 0, 2000 + number, "Drama")
+        for number in numbers
+    ], [(f"tt{number:07d}", 7.5, 5000) for number in numbers])
+
+    assert count == 3 and catalog.slots == 8
+    for number in numbers:
+        assert catalog.get(f"tt{number:07d}")["title"] == f"Фильм {number}"
+    # Отсутствующий ID из той же цепочки: проба доходит до пустого слота
+    assert _slot_hash(25, 7) == _slot_hash(1, 7)
+    assert not catalog.has_id("tt0000025")
+    catalog.close()
+
+
+def test_sample_respects_filters(tmp_path):
+    _, catalog = make_catalog(tmp_path, [
+        ("tt0000001", "movie", "Старая драма", 0, 1950, "Drama"),
+        ("tt0000002", "movie", "Новая драма", 0, 2020, "Drama,Romance"),
+        ("tt0000003", "movie", "Слабая драма", 0, 2021, "Drama"),
+        ("tt0000004", "movie", "Комедия", 0, 2020, "Comedy"),
+    ], [
+        ("tt0000001", 8.0, 5000),
+        ("tt0000002", 8.0, 5000),
+        ("tt0000003", 5.0, 5000),
+        ("tt0000004", 8.0, 5000),
+    ])
+
+    for _ in range(20):
+        assert catalog.sample(genre="драма", min_year=2000, min_rating=7)["imdb_id"] == "tt0000002"
+        assert catalog.sample(genre="Comedy")["imdb_id"] == "tt0000004"
+    assert catalog.sample(genre="драма", exclude=lambda movie: movie["year"] > 1960)["imdb_id"] == "tt0000001"
+    # Неизвестный жанр и неудовлетворимые фильтры -> None, а не случайный фильм
+    assert catalog.sample(genre="аниме") is None
+    assert catalog.sample(min_rating=9, attempts=50) is None
+    catalog.close()
+
+
+def test_load_catalog_tolerates_missing_and_foreign_files(tmp_path):
+    assert load_catalog(str(tmp_path / "missing.bin")) is None
+    foreign = tmp_path / "foreign.bin"
+    foreign.write_bytes(b"NOTACATALOG" + b"\0" * 32)
+    assert load_catalog(str(foreign)) is None
+
+    _, catalog = make_catalog(tmp_path, [], [])
+    assert len(catalog) == 0
+    assert catalog.sample() is None
+    assert not catalog.has_id("tt0000001")
+    catalog.close()
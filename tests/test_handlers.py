@@ -0,0 +1,31 @@
+import asyncio
+
+from conftest import TEST_ADMIN_ID, TEST_USER_ID, message_update
+
+
+def handler_counts(main) -> dict:
+    routers = main.dp.sub_routers
+    return {
+        "routers": [router.name for router in routers],
+        "message": [len(router.message.handlers) for router in routers],
+        "callback_query": [len(router.callback_query.handlers) for router in routers],
+        "user_buttons": len(main.user_buttons.handlers),
+        "admin_buttons": len(main.admin_buttons.handlers),
+        "session_middlewares": len(main.bot.session.middleware),
+    }
+
+
+def test_start_does_not_register_handlers(main_module, telegram):
+    before = handler_counts(main_module)
+
+    async def scenario():
+        for index in range(10):
+            for user_id in (TEST_USER_ID, TEST_ADMIN_ID):
+                update = message_update(index * 2 + user_id, user_id, "/start")
+                await main_module.dp.feed_raw_update(main_module.bot, update)
+
+    asyncio.run(scenario())
+
+    assert handler_counts(main_module) == before
+    # Каждый /start получил ровно один ответ
+    assert telegram.methods().count("SendMessage") == 20
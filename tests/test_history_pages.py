@@ -0,0 +1,78 @@
+import pytest
+
+
+@pytest.mark.parametrize("filters", [
+    {"genre": "Драма|Триллер", "year": 1999, "style": None},
+    {"genre": None, "year": None, "style": "100%|ирония"},
+    {"genre": None, "year": None, "style": None},
+])
+def test_history_callback_round_trip(main_module, filters):
+    data = main_module.history_callback(2, "<15", filters)
+    assert main_module.parse_history_callback(data) == (2, "<15", filters)
+
+
+def test_history_pages_follow_cursor(main_module, monkeypatch):
+    from history_store import HistoryStore
+
+    history = HistoryStore(":memory:")
+    for index in range(12):
+        history.append({"imdb_id": f"tt{index:07d}", "title": f"Фильм {index}", "year": 2000,
+                        "genre": "Драма|Триллер", "date": "2026-01-01T09:00"})
+    monkeypatch.setattr(main_module, "history", history)
+    monkeypatch.setattr(main_module, "history_pages", {})
+
+    def buttons(markup) -> dict:
+        return {button.text: button.callback_data for row in markup.inline_keyboard for button in row}
+
+    text, markup = main_module.render_history_page(0, "", {"genre": "Драма|Триллер", "year": None, "style": None})
+    assert "Фильм 11" in text and "страница 1 из 3" in text
+    page, cursor, filters = main_module.parse_history_callback(buttons(markup)["➡️"])
+    text, markup = main_module.render_history_page(page, cursor, filters)
+    assert "Фильм 6" in text and "Фильм 7" not in text and "страница 2 из 3" in text
+
+    page, cursor, filters = main_module.parse_history_callback(buttons(markup)["⬅️"])
+    text, _ = main_module.render_history_page(page, cursor, filters)
+    assert "Фильм 11" in text and "страница 1 из 3" in text
+    history.close()
+
+
+LONG_FILTERS = {"genre": "Выбор пользователя", "year": 2001, "style": "аналитический с элементами иронии"}
+
+
+def button_data(markup) -> list:
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def test_callback_data_fits_telegram_limit_with_cyrillic_filters(main_module, monkeypatch):
+    from history_store import HistoryStore
+
+    history = HistoryStore(":memory:")
+    for index in range(30):
+        history.append({"imdb_id": f"tt{index:07d}", "title": f"Фильм {index}", "year": 2001,
+                        "genre": LONG_FILTERS["genre"], "style": LONG_FILTERS["style"],
+                        "date": "2026-01-01T09:00"})
+    monkeypatch.setattr(main_module, "history", history)
+    monkeypatch.setattr(main_module, "history_pages", {})
+
+    text, markup = main_module.render_history_page(3, "<100000", LONG_FILTERS)
+    data = button_data(markup)
+    assert any(item.startswith("histf_style|") for item in data)
+    for item in data:
+        assert len(item.encode()) <= 64, item
+        assert main_module.parse_history_callback(item)[2] in (LONG_FILTERS, {"genre": None, "year": None, "style": None})
+    history.close()
+
+
+def test_filter_tokens_survive_restart(main_module, monkeypatch):
+    from history_store import HistoryStore
+
+    history = HistoryStore(":memory:")
+    history.append({"imdb_id": "tt0000001", "title": "Фильм", "year": 2001, "genre": LONG_FILTERS["genre"],
+                    "style": LONG_FILTERS["style"], "date": "2026-01-01T09:00"})
+    monkeypatch.setattr(main_module, "history", history)
+    data = main_module.history_callback(0, "", LONG_FILTERS)
+
+    # Кнопка из сообщения, отправленного до перезапуска
+    monkeypatch.setattr(main_module, "history_filter_values", {})
+    assert main_module.parse_history_callback(data) == (0, "", LONG_FILTERS)
+    history.close()
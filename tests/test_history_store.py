@@ -0,0 +1,54 @@
+from history_store import HistoryStore
+
+MATRIX = {"imdb_id": "tt0133093", "title": "Матрица", "year": 1999}
+
+
+def test_reservation_blocks_global_scope_until_released(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite3"))
+
+    # Два канала с общей проверкой повторов (scope=None)
+    assert history.reserve(MATRIX, None)
+    assert not history.reserve(MATRIX, None)
+    assert history.is_taken(MATRIX, None)
+
+    history.release(MATRIX, None)
+    assert not history.is_taken(MATRIX, None)
+    history.close()
+
+
+def test_reservation_respects_channel_scope(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite3"))
+
+    assert history.reserve(MATRIX, "kids")
+    # Другой канал со своей историей фильм не видит, общий - видит
+    assert history.reserve(MATRIX, "main")
+    assert history.is_taken(MATRIX, None)
+    assert not history.reserve(MATRIX, None)
+
+    history.release(MATRIX, "kids")
+    history.release(MATRIX, "main")
+    history.append({**MATRIX, "date": "2026-01-01T09:00", "channel": "main"})
+    assert not history.reserve(MATRIX, "main")
+    assert history.reserve(MATRIX, "kids")
+    history.close()
+
+
+def test_page_walks_by_seq_cursor(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite3"))
+    for index in range(7):
+        history.append({"imdb_id": f"tt{index:07d}", "title": f"Фильм {index}", "year": 2000,
+                        "genre": "Драма" if index % 2 else "Комедия", "date": "2026-01-01T09:00"})
+
+    first = history.page(3)
+    assert [record["title"] for record in first] == ["Фильм 6", "Фильм 5", "Фильм 4"]
+    second = history.page(3, before=first[-1]["seq"])
+    assert [record["title"] for record in second] == ["Фильм 3", "Фильм 2", "Фильм 1"]
+    # Новая публикация не сдвигает следующую страницу
+    history.append({"imdb_id": "tt0000099", "title": "Новый", "year": 2001, "date": "2026-01-02T09:00"})
+    assert [record["title"] for record in history.page(3, before=second[-1]["seq"])] == ["Фильм 0"]
+    # Назад - те же записи в том же порядке
+    assert history.page(3, after=second[0]["seq"]) == first
+
+    dramas = history.page(2, before=first[0]["seq"], genre="Драма")
+    assert [record["title"] for record in dramas] == ["Фильм 5", "Фильм 3"]
+    history.close()
@@ -0,0 +1,80 @@
+import asyncio
+
+from live_preview import LivePreview
+
+
+class FakeMessage:
+    """Сообщение бота: правки идут медленно, как через очередь отправки."""
+
+    def __init__(self, log: list, edit_delay: float = 0.0):
+        self.log = log
+        self.edit_delay = edit_delay
+        self.edit_started = asyncio.Event()
+
+    async def answer(self, text):
+        self.log.append(("answer", text))
+        return self
+
+    async def edit_text(self, text):
+        self.edit_started.set()
+        await asyncio.sleep(self.edit_delay)
+        self.log.append(("edit", text))
+
+    async def delete(self):
+        self.log.append(("delete", None))
+
+
+def test_close_waits_for_edit_in_flight():
+    async def scenario():
+        log = []
+        message = FakeMessage(log, edit_delay=0.05)
+        preview = LivePreview(message, "⏳", interval=0)
+        await preview.start()
+        preview.update("Первый абзац")
+        await message.edit_started.wait()
+
+        await preview.close()
+        # Правка не отменена посреди отправки, заглушка удалена после нее
+        assert log == [("answer", "⏳"), ("edit", "Первый абзац"), ("delete", None)]
+
+    asyncio.run(scenario())
+
+
+def test_close_skips_edit_waiting_for_interval():
+    async def scenario():
+        log = []
+        preview = LivePreview(FakeMessage(log), "⏳", interval=10)
+        await preview.start()
+        preview.update("Первый абзац")
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(preview.close(), 1)
+        preview.update("после закрытия")
+        assert log == [("answer", "⏳"), ("delete", None)]
+
+    asyncio.run(scenario())
+
+
+def test_preview_through_send_queue_keeps_worker_alive():
+    from send_queue import OutboundQueue
+
+    async def scenario():
+        queue = OutboundQueue(workers=1)
+        queue.start()
+        log = []
+        message = FakeMessage(log, edit_delay=0.05)
+        edit = message.edit_text
+        message.edit_text = lambda text: queue.send(lambda: edit(text), 1)
+        preview = LivePreview(message, "⏳", interval=0)
+        await preview.start()
+        preview.update("Текст")
+        await message.edit_started.wait()
+        await preview.close()
+
+        async def ping():
+            return "ok"
+
+        assert await asyncio.wait_for(queue.send(ping, 2), 1) == "ok"
+        await queue.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import time
+
+from omdb_cache import OmdbCache, id_key, title_key
+
+MATRIX = {"Response": "True", "imdbID": "tt0133093", "Title": "The Matrix"}
+NOT_FOUND = {"Response": "False", "Error": "Movie not found!"}
+LIMIT = {"Response": "False", "Error": "Request limit reached!"}
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = OmdbCache(str(tmp_path / "omdb.sqlite3"), ttl=0.05)
+    cache.put(id_key("tt0133093"), MATRIX)
+    assert cache.get(id_key("TT0133093 ")) == MATRIX
+    time.sleep(0.06)
+    assert cache.get(id_key("tt0133093")) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 0}
+    cache.close()
+
+
+def test_not_found_is_cached_briefly_and_other_errors_not_at_all(tmp_path):
+    cache = OmdbCache(str(tmp_path / "omdb.sqlite3"), negative_ttl=0.05)
+    cache.put(title_key("Нет такого", 2001), NOT_FOUND)
+    cache.put(title_key("Матрица", 1999), LIMIT)
+    assert cache.get(title_key("нет  такого!", 2001)) == NOT_FOUND
+    assert cache.get(title_key("Матрица", 1999)) is None
+    time.sleep(0.06)
+    assert cache.get(title_key("Нет такого", 2001)) is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = OmdbCache(str(tmp_path / "omdb.sqlite3"), max_entries=10, access_resolution=0)
+    for index in range(10):
+        cache.put(id_key(f"tt{index:07d}"), {**MATRIX, "imdbID": f"tt{index:07d}"})
+        time.sleep(0.002)
+    # Первая запись прочитана - она теперь самая свежая
+    assert cache.get(id_key("tt0000000")) is not None
+    cache.put(id_key("tt0000010"), MATRIX)
+
+    # Вытеснено до 90% лимита - две самые давние записи
+    assert cache.stats()["size"] == 9
+    assert cache.get(id_key("tt0000001")) is None
+    assert cache.get(id_key("tt0000002")) is None
+    assert cache.get(id_key("tt0000000")) is not None
+    cache.close()
+
+
+def test_replacing_entry_does_not_grow_count(tmp_path):
+    path = str(tmp_path / "omdb.sqlite3")
+    cache = OmdbCache(path)
+    cache.put(id_key("tt0133093"), MATRIX)
+    cache.put(id_key("tt0133093"), MATRIX)
+    assert cache.stats()["size"] == 1
+    cache.close()
+    # Счетчик восстанавливается из файла при открытии
+    assert OmdbCache(path).stats()["size"] == 1
+
+
+def test_hit_does_not_write_access_time_within_resolution(tmp_path):
+    cache = OmdbCache(str(tmp_path / "omdb.sqlite3"))
+    cache.put(id_key("tt0133093"), MATRIX)
+    writes = []
+    cache._conn.set_trace_callback(lambda sql: writes.append(sql) if sql.startswith("UPDATE") else None)
+    for _ in range(5):
+        assert cache.get(id_key("tt0133093")) == MATRIX
+    assert writes == []
+    cache.close()
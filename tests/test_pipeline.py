@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+import pytest
+
+from pipeline import Pipeline, Stage, StageFailed
+
+
+async def fail(results):
+    raise ValueError("нет данных")
+
+
+async def slow(results):
+    await asyncio.sleep(10)
+
+
+def test_failed_stage_gets_fallback_and_dependents_run():
+    async def render(results):
+        return f"постер: {results['poster']}"
+
+    pipeline = Pipeline("test", [
+        Stage("poster", fail, fallback=None),
+        Stage("render", render, after=["poster"]),
+    ])
+    results = asyncio.run(pipeline.run())
+    assert results["poster"] is None
+    assert results["render"] == "постер: None"
+
+
+def test_timeout_without_fallback_stops_graph_and_cancels_other_stages():
+    cancelled = []
+
+    async def review(results):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("review")
+            raise
+
+    async def movie(results):
+        return "tt0133093"
+
+    pipeline = Pipeline("test", [
+        Stage("movie", movie),
+        Stage("verify", slow, after=["movie"], timeout=0.05),
+        Stage("review", review, after=["movie"]),
+    ])
+    with pytest.raises(StageFailed) as error:
+        asyncio.run(pipeline.run())
+    assert error.value.stage == "verify"
+    assert isinstance(error.value.cause, asyncio.TimeoutError)
+    assert error.value.results["movie"] == "tt0133093"
+    assert cancelled == ["review"]
+
+
+def test_timeout_with_fallback():
+    pipeline = Pipeline("test", [Stage("poster", slow, timeout=0.05, fallback="нет")])
+    assert asyncio.run(pipeline.run())["poster"] == "нет"
+
+
+def test_cancelling_run_cancels_stages():
+    async def scenario():
+        running = asyncio.Event()
+        cancelled = []
+
+        async def stage(results):
+            running.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("stage")
+                raise
+
+        pipeline = Pipeline("test", [Stage("stage", stage)])
+        run = asyncio.ensure_future(pipeline.run())
+        await running.wait()
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        assert cancelled == ["stage"]
+
+    asyncio.run(scenario())
+
+
+def test_background_error_is_logged_even_if_stage_finished_first(caplog):
+    async def send(results):
+        await asyncio.sleep(0.01)
+
+    # Фоновый этап падает раньше, чем закончится основной
+    pipeline = Pipeline("test", [
+        Stage("record", fail, background=True),
+        Stage("send", send),
+    ])
+
+    async def scenario():
+        await pipeline.run()
+        await pipeline.drain()
+        await asyncio.sleep(0)
+
+    with caplog.at_level(logging.ERROR, logger="pipeline"):
+        asyncio.run(scenario())
+    assert "фоновый этап не выполнен: этап record: нет данных" in caplog.text
+    assert not pipeline._background
+
+
+def test_dependencies_must_be_declared_first():
+    with pytest.raises(ValueError):
+        Pipeline("test", [Stage("render", fail, after=["poster"]), Stage("poster", fail)])
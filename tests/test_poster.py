@@ -0,0 +1,47 @@
+import asyncio
+
+MATRIX = {"Response": "True", "imdbID": "tt0133093", "Title": "The Matrix", "Poster": "https://img/matrix.jpg"}
+NOT_FOUND = {"Response": "False", "Error": "Incorrect IMDb ID."}
+
+
+class FakeOmdb:
+    def __init__(self, by_id: dict, by_title: dict = None):
+        self.by_id = by_id
+        self.by_title = by_title or NOT_FOUND
+        self.calls = []
+
+    async def get_by_id(self, imdb_id: str) -> dict:
+        self.calls.append(("id", imdb_id))
+        return self.by_id.get(imdb_id, NOT_FOUND)
+
+    async def get_by_title(self, title: str, year) -> dict:
+        self.calls.append(("title", title))
+        return self.by_title
+
+
+class FakeTitleIndex:
+    def search(self, title, year=None, limit=5):
+        return [{"imdb_id": "tt0133093", "title": "Матрица", "year": 1999, "score": 1.0}]
+
+
+def test_unknown_imdb_id_falls_back_to_title_index(main_module, monkeypatch):
+    omdb = FakeOmdb({"tt0133093": MATRIX})
+    monkeypatch.setattr(main_module, "omdb", omdb)
+    monkeypatch.setattr(main_module, "title_index", FakeTitleIndex())
+
+    # LLM ошибся в цифрах ID: OMDb отвечает Response False
+    movie = {"imdb_id": "tt0133094", "title": "Матрица", "year": 1999}
+    poster = asyncio.run(main_module.get_movie_poster(movie))
+
+    assert poster == "https://img/matrix.jpg"
+    assert omdb.calls == [("id", "tt0133094"), ("id", "tt0133093")]
+
+
+def test_unknown_imdb_id_without_index_searches_omdb_by_title(main_module, monkeypatch):
+    omdb = FakeOmdb({}, by_title=MATRIX)
+    monkeypatch.setattr(main_module, "omdb", omdb)
+    monkeypatch.setattr(main_module, "title_index", None)
+
+    movie = {"imdb_id": "tt0133094", "title": "The Matrix", "year": 1999}
+    assert asyncio.run(main_module.get_movie_poster(movie)) == "https://img/matrix.jpg"
+    assert omdb.calls == [("id", "tt0133094"), ("title", "The Matrix")]
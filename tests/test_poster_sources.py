@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from poster_store import PosterStore
+
+URL = "https://img/matrix.jpg"
+IMDB_ID = "tt0133093"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PosterStore(str(tmp_path / "posters"), str(tmp_path / "posters.sqlite3"))
+    path = tmp_path / "posters" / f"{IMDB_ID}.jpg"
+    path.write_bytes(b"\xff\xd8\xff")
+    with store._conn:
+        store._conn.execute(
+            "INSERT INTO posters (imdb_id, url, path, file_id) VALUES (?, ?, ?, ?)",
+            (IMDB_ID, URL, str(path), "stale-file-id"),
+        )
+    yield store
+    store._conn.close()
+
+
+def test_sources_go_from_file_id_to_local_file_to_url(store):
+    kinds = [kind for kind, _ in store.sources(IMDB_ID, URL)]
+    assert kinds == ["file_id", "local", "url"]
+    assert isinstance(store.sources(IMDB_ID, URL)[1][1], FSInputFile)
+
+
+def run_send_poster(main, monkeypatch, telegram, store, rejected, error="wrong file identifier/HTTP URL specified"):
+    async def no_fetch(imdb_id, url):
+        return None
+
+    monkeypatch.setattr(store, "fetch", no_fetch)
+    monkeypatch.setattr(main, "posters", store)
+    record = telegram.make_request
+
+    async def make_request(bot, method, timeout=None):
+        if type(method).__name__ == "SendPhoto" and rejected(method.photo):
+            telegram.calls.append(("SendPhoto", method))
+            raise TelegramBadRequest(method, error)
+        return await record(bot, method, timeout)
+
+    monkeypatch.setattr(main.bot.session, "make_request", make_request)
+    return asyncio.run(main.send_poster("-1001", IMDB_ID, URL, "подпись"))
+
+
+def test_rejected_file_id_falls_back_to_local_file(main_module, monkeypatch, telegram, store):
+    assert run_send_poster(main_module, monkeypatch, telegram, store, lambda photo: photo == "stale-file-id")
+
+    assert telegram.methods() == ["SendPhoto", "SendPhoto"]
+    assert isinstance(telegram.calls[1][1].photo, FSInputFile)
+    # Вместо отвергнутого file_id сохранен новый
+    assert store.sources(IMDB_ID, URL)[0] == ("file_id", "file-2")
+    assert store.stats["local_hits"] == 1
+
+
+def test_rejected_file_id_and_local_file_fall_back_to_url(main_module, monkeypatch, telegram, store):
+    assert run_send_poster(main_module, monkeypatch, telegram, store, lambda photo: photo != URL)
+
+    assert [method.photo for _, method in telegram.calls][-1] == URL
+    assert len(telegram.calls) == 3
+    assert store.stats["url_sends"] == 1
+
+
+def test_caption_error_keeps_file_id_and_stops(main_module, monkeypatch, telegram, store):
+    sent = run_send_poster(
+        main_module, monkeypatch, telegram, store, lambda photo: True,
+        error="Bad Request: can't parse entities: Character '.' is reserved and must be escaped",
+    )
+
+    assert sent is False
+    # Источник ни при чем: рабочий file_id не забыт, остальные источники не пробуются
+    assert telegram.methods() == ["SendPhoto"]
+    assert store.sources(IMDB_ID, URL)[0] == ("file_id", "stale-file-id")
@@ -0,0 +1,174 @@
+import asyncio
+
+from prefetch import PostPrefetcher
+
+
+class Preparer:
+    """Как ``prepare_post``: резервирует фильм и снимает резерв, если
+    подготовку прервали. ``reserved`` - фильмы, резерв которых не снят."""
+
+    def __init__(self, gate: asyncio.Event = None, free: int = 0):
+        self.gate = gate
+        self.free = free  # столько первых вызовов проходят без gate
+        self.reserved = set()
+        self.calls = []
+        self.cancelled = 0
+        self._next = 0
+
+    async def prepare(self, *args):
+        *key, exclude_ids = args
+        self.calls.append(list(exclude_ids))
+        self._next += 1
+        imdb_id = f"tt{self._next:07d}"
+        self.reserved.add(imdb_id)
+        try:
+            if self.gate is not None and self._next > self.free:
+                await self.gate.wait()
+            await asyncio.sleep(0)
+        except BaseException:
+            self.reserved.discard(imdb_id)
+            self.cancelled += 1
+            raise
+        return {"movie": {"imdb_id": imdb_id}, "key": tuple(key)}
+
+    def release(self, post: dict):
+        self.reserved.discard(post["movie"]["imdb_id"])
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_take_returns_buffered_posts_and_refills():
+    async def scenario():
+        preparer = Preparer()
+        prefetcher = PostPrefetcher(preparer.prepare, buffer_size=2, discard=preparer.release)
+
+        prefetcher.start("Драма", "обычный", None)
+        await settle()
+        assert prefetcher.size("Драма", "обычный", None) == 2
+        # Второй пост готовится без первого фильма
+        assert preparer.calls == [[], ["tt0000001"]]
+
+        post = prefetcher.take("Драма", "обычный", None)
+        assert post["movie"]["imdb_id"] == "tt0000001"
+        await settle()
+        assert prefetcher.size("Драма", "обычный", None) == 2
+        assert preparer.calls[-1] == ["tt0000002"]
+        # Пустой буфер чужого ключа - None, но заполнение запускается
+        assert prefetcher.take("Комедия", "обычный", None) is None
+        await settle()
+        assert prefetcher.size("Комедия", "обычный", None) == 2
+
+        await prefetcher.close()
+        # Опубликованный пост снимает резерв сам, остальные - через discard
+        assert preparer.reserved == {"tt0000001"}
+
+    asyncio.run(scenario())
+
+
+def test_stale_posts_are_skipped_and_discarded():
+    async def scenario():
+        preparer = Preparer()
+        discarded = []
+        prefetcher = PostPrefetcher(
+            preparer.prepare, buffer_size=3,
+            discard=lambda post: (discarded.append(post["movie"]["imdb_id"]), preparer.release(post))
+        )
+        prefetcher.start("Драма")
+        await settle()
+
+        posted = {"tt0000001", "tt0000002"}
+        post = prefetcher.take("Драма", is_stale=lambda p: p["movie"]["imdb_id"] in posted)
+        assert post["movie"]["imdb_id"] == "tt0000003"
+        assert discarded == ["tt0000001", "tt0000002"]
+
+        # Все посты устарели - None, и каждый отброшен ровно один раз
+        await settle()
+        assert prefetcher.take("Драма", is_stale=lambda p: True) is None
+        assert sorted(discarded) == ["tt0000001", "tt0000002", "tt0000004", "tt0000005", "tt0000006"]
+        await prefetcher.close()
+        assert preparer.reserved == {"tt0000003"}
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_discards_buffers_and_cancels_fill():
+    async def scenario():
+        gate = asyncio.Event()
+        preparer = Preparer(gate, free=1)
+        discarded = []
+        prefetcher = PostPrefetcher(
+            preparer.prepare, buffer_size=2,
+            discard=lambda post: (discarded.append(post["movie"]["imdb_id"]), preparer.release(post))
+        )
+        prefetcher.start("Драма")
+        await settle()
+        # Первый пост в буфере, второй ждет на gate
+        assert prefetcher.size("Драма") == 1
+        assert preparer.reserved == {"tt0000001", "tt0000002"}
+
+        prefetcher.invalidate()
+        await settle()
+        assert prefetcher.size("Драма") == 0
+        assert discarded == ["tt0000001"]
+        assert preparer.cancelled == 1
+        assert preparer.reserved == set()
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_racing_with_refill_leaks_no_reservation():
+    async def scenario():
+        gate = asyncio.Event()
+        preparer = Preparer(gate)
+        discarded = []
+        prefetcher = PostPrefetcher(
+            preparer.prepare, buffer_size=2,
+            discard=lambda post: (discarded.append(post["movie"]["imdb_id"]), preparer.release(post))
+        )
+        prefetcher.start("Драма")
+        await settle()
+
+        # Подготовка уже завершилась, но заполняющая задача еще не проснулась,
+        # когда буфер сбрасывают и сразу запускают заново
+        gate.set()
+        prefetcher.invalidate()
+        prefetcher.start("Драма")
+        await settle()
+
+        assert prefetcher.size("Драма") == 2
+        buffered = {post["movie"]["imdb_id"] for post in prefetcher._buffers[("Драма",)]}
+        # Прерванный пост либо отброшен, либо отменен, но не потерян с резервом
+        assert preparer.reserved == buffered
+        assert "tt0000001" not in buffered
+        assert preparer.cancelled == 1
+
+        await prefetcher.close()
+        assert preparer.reserved == set()
+        assert len(discarded) == len(set(discarded))
+
+    asyncio.run(scenario())
+
+
+def test_failed_prepare_is_retried_with_backoff():
+    async def scenario():
+        attempts = []
+
+        async def prepare(key, exclude_ids):
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) < 3:
+                raise RuntimeError("OMDb недоступен")
+            return {"movie": {"imdb_id": "tt0000001"}}
+
+        prefetcher = PostPrefetcher(prepare, buffer_size=1, retry_delay=0.02, max_retry_delay=0.05)
+        prefetcher.start("Драма")
+        await asyncio.sleep(0.2)
+        assert prefetcher.size("Драма") == 1
+        assert len(attempts) == 3
+        # Пауза после второй ошибки вдвое длиннее первой
+        assert attempts[2] - attempts[1] > attempts[1] - attempts[0]
+        await prefetcher.close()
+
+    asyncio.run(scenario())
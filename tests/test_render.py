@@ -0,0 +1,101 @@
+import re
+
+import pytest
+
+from render import CAPTION_LIMIT, MD_SPECIAL_CHARS, MESSAGE_LIMIT, clip_md, render_post, split_md
+
+MATRIX = {"title": "Матрица", "year": 1999, "plot": "Хакер Нео узнает правду о мире. Он выбирает красную таблетку."}
+
+
+def dangling(text: str) -> bool:
+    """Текст обрывается на половине пары ``\\x``."""
+    return (len(text) - len(text.rstrip("\\"))) % 2 == 1
+
+
+def unescape(text: str) -> str:
+    return re.sub(r"\\(.)", r"\1", text)
+
+
+def assert_escaped(text: str):
+    """Каждый спецсимвол MarkdownV2 экранирован, каждая ``\\`` начинает пару."""
+    index = 0
+    while index < len(text):
+        if text[index] == "\\":
+            assert index + 1 < len(text) and text[index + 1] in MD_SPECIAL_CHARS, text[index - 10:index + 10]
+            index += 2
+            continue
+        assert text[index] not in MD_SPECIAL_CHARS, text[index - 10:index + 10]
+        index += 1
+
+
+def test_short_text_is_escaped_whole():
+    assert clip_md("Нео (Киану Ривз) - избранный.", 100) == "Нео \\(Киану Ривз\\) \\- избранный\\."
+    assert split_md("Первое. Второе!", 100) == ["Первое\\. Второе\\!"]
+
+
+@pytest.mark.parametrize("limit", [CAPTION_LIMIT, MESSAGE_LIMIT])
+@pytest.mark.parametrize("shift", range(6))
+def test_clip_md_never_splits_an_escape(limit, shift):
+    # Предложения из спецсимволов: граница лимита приходится то на "\", то на
+    # экранируемый символ, то сразу после пары
+    sentence = "а" * shift + "." * 40 + "!"
+    text = " ".join([sentence] * (limit // 40))
+    clipped = clip_md(text, limit)
+    assert 0 < len(clipped) <= limit
+    assert not dangling(clipped)
+    assert_escaped(clipped)
+
+    # Одно слово без пробелов длиннее лимита
+    word = "а" * shift + "-" * limit
+    clipped = clip_md(word, limit)
+    assert 0 < len(clipped) <= limit
+    assert not dangling(clipped.rstrip("…"))
+    assert_escaped(clipped.rstrip("…"))
+
+
+@pytest.mark.parametrize("limit", [CAPTION_LIMIT, MESSAGE_LIMIT])
+@pytest.mark.parametrize("shift", range(6))
+def test_split_md_chunks_fit_and_keep_all_text(limit, shift):
+    text = ("б" * shift + "(" * 300 + ". ") * 40 + "в" * shift + "\\" * (2 * limit)
+    chunks = split_md(text, limit)
+    for chunk in chunks:
+        assert len(chunk) <= limit
+        assert not dangling(chunk)
+        assert_escaped(chunk)
+    # Длинное "слово" режется на части, а не теряется
+    assert "".join(unescape(chunk).replace(" ", "") for chunk in chunks) == text.replace(" ", "")
+
+
+@pytest.mark.parametrize("with_photo", [True, False])
+@pytest.mark.parametrize("kind", ["scheduled", "custom"])
+def test_trimmed_post_fits_single_message(kind, with_photo):
+    limit = CAPTION_LIMIT if with_photo else MESSAGE_LIMIT
+    movie = {**MATRIX, "plot": "Сюжет (очень) длинный. " * 100}
+    for shift in range(4):
+        review = "ж" * shift + " ".join(["Фильм - шедевр... Смотреть всем!"] * 400)
+        post = render_post(kind, movie, review, "Фантастика", "обычный", with_photo=with_photo, layout="trim")
+        assert post["follow_ups"] == []
+        assert len(post["caption"]) <= limit
+        assert not dangling(post["caption"])
+        assert "Рецензия" in post["caption"]
+
+
+def test_split_post_moves_review_to_messages():
+    review = " ".join(f"Мысль номер {index} \\(с оговоркой\\)." for index in range(600))
+    post = render_post("custom", MATRIX, review, "Фантастика", "обычный", with_photo=True, layout="split")
+
+    assert len(post["caption"]) <= CAPTION_LIMIT
+    assert "Рецензия" not in post["caption"]
+    assert len(post["follow_ups"]) > 1
+    for message in post["follow_ups"]:
+        assert len(message) <= MESSAGE_LIMIT
+        assert not dangling(message)
+    assert post["follow_ups"][0].startswith("📝 Рецензия \\(обычный\\):\n")
+    assert post["follow_ups"][-1].endswith("599 \\\\\\(с оговоркой\\\\\\)\\.")
+
+
+def test_huge_title_still_fits_caption():
+    movie = {**MATRIX, "title": "Очень-очень длинное название " * 100}
+    post = render_post("custom", movie, "Хорошо.", "Драма", "обычный", with_photo=True, layout="trim")
+    assert len(post["caption"]) <= CAPTION_LIMIT
+    assert not dangling(post["caption"])
@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from resilience import (
+    CLOSED, HALF_OPEN, OPEN, CallPolicy, CircuitBreaker, CircuitOpenError, transient_http_error,
+)
+
+
+class Unauthorized(Exception):
+    pass
+
+
+def breaker_with_log(**options):
+    changes = []
+    breaker = CircuitBreaker(
+        "test", on_state_change=lambda name, previous, state: changes.append((previous, state)), **options
+    )
+    return breaker, changes
+
+
+def test_breaker_opens_lets_one_probe_through_and_closes():
+    breaker, changes = breaker_with_log(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Пока идет пробный вызов, остальные отклоняются
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+    assert changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_failed_probe_opens_breaker_again():
+    breaker, changes = breaker_with_log(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    assert changes[-1] == (HALF_OPEN, OPEN)
+
+
+def policy(**options) -> CallPolicy:
+    options.setdefault("backoff_base", 0)
+    return CallPolicy("test", **options)
+
+
+def test_non_retryable_probe_does_not_close_breaker():
+    breaker, changes = breaker_with_log(failure_threshold=1, reset_timeout=0.05)
+    calls = policy(breaker=breaker, retryable=lambda error: not isinstance(error, Unauthorized))
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    async def unauthorized():
+        raise Unauthorized("401")
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(Unauthorized):
+            await calls.call(unauthorized)
+        # Ни "восстановлен", ни повторное размыкание; следующий вызов снова пробный
+        assert breaker.state == HALF_OPEN and not breaker.probing
+        assert await calls.call(ok) == "ok"
+
+    asyncio.run(scenario())
+    assert changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_non_retryable_error_does_not_reset_failure_count():
+    breaker, _ = breaker_with_log(failure_threshold=2)
+    calls = policy(breaker=breaker, retries=0, retryable=lambda error: not isinstance(error, Unauthorized))
+
+    async def fail():
+        raise ConnectionError("reset")
+
+    async def unauthorized():
+        raise Unauthorized("401")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await calls.call(fail)
+        with pytest.raises(Unauthorized):
+            await calls.call(unauthorized)
+        with pytest.raises(ConnectionError):
+            await calls.call(fail)
+        with pytest.raises(CircuitOpenError):
+            await calls.call(fail)
+
+    asyncio.run(scenario())
+    assert calls.stats["rejected"] == 1
+
+
+def test_retries_are_limited():
+    attempts = []
+    calls = policy(retries=2)
+
+    async def fail():
+        attempts.append(1)
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(calls.call(fail))
+    assert len(attempts) == 3
+    assert calls.stats["retries"] == 2 and calls.stats["failures"] == 1
+
+
+def test_client_errors_are_not_retried():
+    attempts = []
+    calls = policy(retries=3, retryable=transient_http_error)
+
+    async def not_found():
+        attempts.append(1)
+        raise aiohttp.ClientResponseError(None, (), status=404)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(calls.call(not_found))
+    assert len(attempts) == 1
+    assert calls.stats["retries"] == 0
+
+
+def test_each_attempt_is_limited_by_timeout():
+    calls = policy(timeout=0.05, retries=1)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(calls.call(hang))
+    assert time.monotonic() - started < 1
+    assert calls.stats["retries"] == 1
+
+
+def test_slow_request_is_hedged():
+    calls = policy(hedge_quantile=0.5, hedge_min_samples=5)
+    calls.latencies.extend([0.01] * 5)
+    started, cancelled = [], []
+
+    async def request():
+        index = len(started)
+        started.append(index)
+        if index == 0:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+        return f"ответ {index}"
+
+    assert asyncio.run(calls.call(request)) == "ответ 1"
+    assert calls.stats["hedged"] == 1
+    assert cancelled == [0]
+
+
+def test_fast_request_is_not_hedged():
+    calls = policy(hedge_quantile=0.5, hedge_min_samples=5)
+    calls.latencies.extend([0.5] * 5)
+
+    async def request():
+        return "ok"
+
+    assert asyncio.run(calls.call(request)) == "ok"
+    assert calls.stats["hedged"] == 0
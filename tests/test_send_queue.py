@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from send_queue import OutboundQueue
+
+
+def test_close_fails_requests_waiting_after_retry_after():
+    async def scenario():
+        queue = OutboundQueue(workers=1)
+        queue.start()
+
+        async def flood():
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "flood", 30)
+
+        request = asyncio.ensure_future(queue.send(flood, 1))
+        await asyncio.sleep(0.05)
+        await queue.close()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(request, 1)
+        assert queue.summary()["retry_after"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_chat_token_is_not_spent_twice():
+    async def scenario():
+        queue = OutboundQueue(workers=4, global_rate=1)
+        queue.global_bucket.tokens = 0
+        queue.start()
+        sent = []
+
+        async def send(index):
+            sent.append(index)
+
+        # Токен чата один: после паузы на общем бакете его получает только один воркер
+        requests = [asyncio.ensure_future(queue.send(lambda i=i: send(i), -100)) for i in range(3)]
+        await asyncio.sleep(1.5)
+        assert len(sent) == 1
+        await queue.close()
+        await asyncio.gather(*requests, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_caller_cancelled_mid_send_does_not_stop_worker():
+    async def scenario():
+        queue = OutboundQueue(workers=1)
+        queue.start()
+        release = asyncio.Event()
+        sent = []
+
+        async def slow():
+            await release.wait()
+            sent.append("slow")
+            return "slow"
+
+        async def fast():
+            sent.append("fast")
+            return "fast"
+
+        # Вызывающий отменяется, пока запрос уже у Telegram
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.send(slow, 1), 0.05)
+        release.set()
+        assert await asyncio.wait_for(queue.send(fast, 2), 1) == "fast"
+        assert sent == ["slow", "fast"]
+        assert all(not task.done() for task in queue._tasks)
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_caller_cancelled_mid_send_with_error_does_not_stop_worker():
+    async def scenario():
+        queue = OutboundQueue(workers=1)
+        queue.start()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise ValueError("Bad Request")
+
+        async def fast():
+            return "fast"
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.send(failing, 1), 0.05)
+        release.set()
+        assert await asyncio.wait_for(queue.send(fast, 2), 1) == "fast"
+        await queue.close()
+
+    asyncio.run(scenario())
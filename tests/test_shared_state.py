@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.storage.base import StorageKey
+
+from shared_state import IdempotencyKeys, KeyValueStore, LeaderLease, MemoryKeyValueStore, SharedFSMStorage
+
+
+def test_key_value_store_is_abstract():
+    with pytest.raises(TypeError):
+        KeyValueStore()
+
+
+def test_lease_is_handed_over_after_close():
+    async def scenario():
+        store = MemoryKeyValueStore()
+        first = LeaderLease(store, ttl=0.3, owner="first")
+        second = LeaderLease(store, ttl=0.3, owner="second")
+        await first.start()
+        await second.start()
+        assert first.is_leader and not second.is_leader
+
+        # Лидер продлевает аренду - вторая реплика ее не перехватывает
+        await asyncio.sleep(0.5)
+        assert first.is_leader and not second.is_leader
+
+        await first.close()
+        await asyncio.sleep(0.25)
+        assert second.is_leader and not first.is_leader
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_lease_expires_when_leader_stops_renewing():
+    async def scenario():
+        store = MemoryKeyValueStore()
+        first = LeaderLease(store, ttl=0.3, owner="first")
+        second = LeaderLease(store, ttl=0.3, owner="second")
+        await first._renew()  # без фонового продления
+        await second._renew()
+        assert first.is_leader and not second.is_leader
+        await asyncio.sleep(0.35)
+        assert not first.is_leader
+        await second._renew()
+        assert second.is_leader
+
+    asyncio.run(scenario())
+
+
+def test_fsm_round_trip():
+    async def scenario():
+        storage = SharedFSMStorage(MemoryKeyValueStore())
+        # Другая реплика с тем же хранилищем видит тот же диалог
+        replica = SharedFSMStorage(storage.store)
+        key = StorageKey(bot_id=1, chat_id=1000, user_id=1000)
+        await storage.set_state(key, "AdminStates:review_ready")
+        await storage.set_data(key, {"review": "Рецензия", "movie": {"imdb_id": "tt0133093"}})
+        assert await replica.get_state(key) == "AdminStates:review_ready"
+        assert await replica.get_data(key) == {"review": "Рецензия", "movie": {"imdb_id": "tt0133093"}}
+
+        await replica.set_state(key, None)
+        await replica.set_data(key, {})
+        assert await storage.get_state(key) is None
+        assert await storage.get_data(key) == {}
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def slot(main_module, monkeypatch):
+    """publish_slot с общим хранилищем ключей и подмененной публикацией."""
+    published = []
+    outcome = {"sent": True}
+
+    async def publish(profile):
+        published.append(profile["id"])
+        return outcome["sent"]
+
+    monkeypatch.setattr(main_module, "leader", None)
+    monkeypatch.setattr(main_module, "publish_keys", IdempotencyKeys(MemoryKeyValueStore()))
+    monkeypatch.setattr(main_module, "slot_time", lambda schedule: "2026-10-17T09:00")
+    monkeypatch.setattr(main_module, "publish_scheduled_post", publish)
+    monkeypatch.setattr(main_module, "EXTRA_CHANNELS", [])
+    return published, outcome, main_module.DB["schedule"]
+
+
+def test_slot_is_published_once(main_module, slot):
+    published, _, schedule = slot
+
+    async def scenario():
+        await asyncio.gather(main_module.publish_slot(schedule), main_module.publish_slot(schedule))
+        await main_module.publish_slot(schedule)
+
+    asyncio.run(scenario())
+    assert published == ["main"]
+
+
+def test_slot_is_retried_when_nothing_was_sent(main_module, slot):
+    published, outcome, schedule = slot
+    outcome["sent"] = False
+
+    async def scenario():
+        await main_module.publish_slot(schedule)
+        outcome["sent"] = True
+        await main_module.publish_slot(schedule)
+        await main_module.publish_slot(schedule)
+
+    asyncio.run(scenario())
+    assert published == ["main", "main"]
+
+
+def prepared_post(main, monkeypatch, follow_ups=()):
+    movie = {"imdb_id": "tt0133093", "title": "Матрица", "year": 1999}
+    post = {"movie": movie, "caption": "Матрица", "poster_url": None, "follow_ups": list(follow_ups), "scope": "main"}
+    main.history.reserve(movie, "main")
+    monkeypatch.setattr(main.prefetcher, "take", lambda *args, **kwargs: post)
+    return movie
+
+
+def test_failed_send_reports_nothing_published(main_module, monkeypatch, telegram):
+    movie = prepared_post(main_module, monkeypatch)
+    telegram.fail_with["SendMessage"] = lambda method: TelegramBadRequest(method, "chat not found")
+
+    assert asyncio.run(main_module.publish_scheduled_post()) is False
+    # Резерв снят - фильм можно взять снова
+    assert not main_module.history.is_taken(movie, "main")
+
+
+def test_partly_sent_post_counts_as_published(main_module, monkeypatch, telegram):
+    movie = prepared_post(main_module, monkeypatch, follow_ups=["продолжение"])
+    record = telegram.make_request
+
+    async def make_request(bot, method, timeout=None):
+        if getattr(method, "text", None) == "продолжение":
+            raise TelegramBadRequest(method, "message is too long")
+        return await record(bot, method, timeout)
+
+    monkeypatch.setattr(main_module.bot.session, "make_request", make_request)
+    assert asyncio.run(main_module.publish_scheduled_post()) is True
+    assert main_module.history.is_posted(movie, "main")
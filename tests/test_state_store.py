@@ -0,0 +1,67 @@
+import json
+
+from state_store import StateStore
+
+DEFAULTS = {"current_genre": "драма", "current_style": "классический", "schedule": "09:00"}
+
+
+def open_store(tmp_path, **options) -> StateStore:
+    return StateStore(str(tmp_path / "state.json"), str(tmp_path / "state.journal"), **options)
+
+
+def journal_lines(tmp_path) -> list:
+    path = tmp_path / "state.journal"
+    return path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+
+
+def test_journal_is_replayed_over_snapshot(tmp_path):
+    store = open_store(tmp_path)
+    store.load(DEFAULTS)
+    store.set("current_genre", "комедия")
+    store.set("schedule", "10:30")
+    store.set("current_genre", "фантастика")
+
+    data = open_store(tmp_path).load(DEFAULTS)
+    assert data == {**DEFAULTS, "current_genre": "фантастика", "schedule": "10:30"}
+    assert len(journal_lines(tmp_path)) == 3
+
+
+def test_journal_is_compacted_every_n_entries(tmp_path):
+    store = open_store(tmp_path)
+    store.load(DEFAULTS)
+    for index in range(49):
+        store.set("counter", index)
+    assert len(journal_lines(tmp_path)) == 49
+    assert not (tmp_path / "state.json").exists()
+
+    store.set("counter", 49)
+    # 50-я запись переносит все в снимок и очищает журнал
+    assert journal_lines(tmp_path) == []
+    assert json.loads((tmp_path / "state.json").read_text(encoding="utf-8"))["counter"] == 49
+
+    store.set("schedule", "11:00")
+    assert open_store(tmp_path).load(DEFAULTS) == {**DEFAULTS, "counter": 49, "schedule": "11:00"}
+
+
+def test_truncated_last_line_is_skipped_and_compacted_at_startup(tmp_path):
+    store = open_store(tmp_path)
+    store.load(DEFAULTS)
+    store.set("current_style", "ироничный")
+    # Аварийная остановка посреди записи
+    with open(tmp_path / "state.journal", "a", encoding="utf-8") as f:
+        f.write('{"key": "schedule", "val')
+
+    restarted = open_store(tmp_path)
+    assert restarted.load(DEFAULTS) == {**DEFAULTS, "current_style": "ироничный"}
+    # Журнал сразу сжат - новая запись не склеится с оборванной строкой
+    assert journal_lines(tmp_path) == []
+    restarted.set("schedule", "12:00")
+    assert open_store(tmp_path).load(DEFAULTS) == {**DEFAULTS, "current_style": "ироничный", "schedule": "12:00"}
+
+
+def test_damaged_snapshot_falls_back_to_defaults_and_journal(tmp_path):
+    (tmp_path / "state.json").write_text("{broken", encoding="utf-8")
+    (tmp_path / "state.journal").write_text(
+        json.dumps({"key": "schedule", "value": "08:00"}) + "\n", encoding="utf-8"
+    )
+    assert open_store(tmp_path).load(DEFAULTS) == {**DEFAULTS, "schedule": "08:00"}
@@ -0,0 +1,51 @@
+import asyncio
+
+from openai.openai_object import OpenAIObject
+
+
+def chunk(content=None, usage=None) -> OpenAIObject:
+    choices = [{"index": 0, "delta": {"content": content}}] if content is not None else []
+    data = {"object": "chat.completion.chunk", "choices": choices}
+    if usage:
+        data["usage"] = usage
+    return OpenAIObject.construct_from(data)
+
+
+def fake_stream(chunks):
+    async def acreate(**params):
+        assert params["stream_options"] == {"include_usage": True}
+
+        async def stream():
+            for item in chunks:
+                yield item
+        return stream()
+    return acreate
+
+
+def test_streamed_usage_is_recorded(main_module, monkeypatch):
+    usage = {"prompt_tokens": 40, "completion_tokens": 5, "total_tokens": 45}
+    monkeypatch.setattr(main_module.openai.ChatCompletion, "acreate",
+                        fake_stream([chunk("Пер"), chunk("вый"), chunk(usage=usage)]))
+    previews = []
+
+    text, truncated = asyncio.run(main_module.stream_chat_completion(
+        "test_stream_usage", [{"role": "user", "content": "x"}], previews.append))
+
+    assert text == "Первый" and not truncated
+    assert previews == ["Пер", "Первый"]
+    assert main_module.token_ledger.day_total()["sites"]["test_stream_usage"] == {
+        "calls": 1, "prompt": 40, "completion": 5,
+    }
+
+
+def test_streamed_usage_is_estimated_without_usage_chunk(main_module, monkeypatch):
+    monkeypatch.setattr(main_module.openai.ChatCompletion, "acreate",
+                        fake_stream([chunk("Рецензия " * 10)]))
+
+    asyncio.run(main_module.stream_chat_completion(
+        "test_stream_estimate", [{"role": "user", "content": "запрос " * 10}], lambda text: None))
+
+    # Оценка ~3 символа на токен
+    assert main_module.token_ledger.day_total()["sites"]["test_stream_estimate"] == {
+        "calls": 1, "prompt": 23, "completion": 30,
+    }
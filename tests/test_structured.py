@@ -0,0 +1,68 @@
+import pytest
+
+from structured import StructuredOutput, extract_json
+
+REVIEW = StructuredOutput("test_review", {
+    "type": "object",
+    "required": ["title", "review"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "year": {"type": "integer", "default": None},
+        "review": {"type": "string", "minLength": 1},
+    },
+})
+BATCH = StructuredOutput("test_batch", {
+    "type": "object",
+    "required": ["movies"],
+    "properties": {
+        "movies": {
+            "type": "array", "dropInvalid": True, "minItems": 1,
+            "items": {
+                "type": "object", "required": ["imdb_id", "title"],
+                "properties": {"imdb_id": {"type": "string"}, "title": {"type": "string"}},
+            },
+        },
+    },
+})
+
+
+def test_raw_newlines_in_review_are_kept():
+    # Модель пишет абзацы как есть, без \n-экранирования
+    text = '{"title": "Матрица", "year": 1999, "review": "Первый абзац, с запятой.\n\nВторой абзац."}'
+    assert REVIEW.parse(text)["review"] == "Первый абзац, с запятой.\n\nВторой абзац."
+    assert extract_json(text) == (
+        {"title": "Матрица", "year": 1999, "review": "Первый абзац, с запятой.\n\nВторой абзац."}, False
+    )
+
+
+def test_fenced_review_with_raw_newlines():
+    text = '```json\n{"title": "Матрица", "review": "Первый абзац.\nВторой, последний."}\n```'
+    assert REVIEW.parse(text)["review"] == "Первый абзац.\nВторой, последний."
+
+
+def test_truncated_required_string_is_not_cut():
+    # Оборвано по max_tokens посреди рецензии - обрубок не выдается за рецензию
+    text = '{"title": "Матрица", "year": 1999, "review": "Первый абзац, второе предложение'
+    assert REVIEW.parse(text, truncated=True) is None
+
+
+def test_truncated_number_is_not_taken_as_complete():
+    value, repaired = extract_json('{"title": "Матрица", "review": "Текст.", "year": 19', truncated=True)
+    assert value == {"title": "Матрица", "review": "Текст."}
+    assert repaired
+
+
+def test_truncated_batch_keeps_complete_movies():
+    text = (
+        '{"movies": [{"imdb_id": "tt0133093", "title": "Матрица"},'
+        ' {"imdb_id": "tt0110912", "title": "Криминальное чтиво"},'
+        ' {"imdb_id": "tt0068646", "title": "Крестный'
+    )
+    movies = BATCH.parse(text, truncated=True)["movies"]
+    assert [movie["imdb_id"] for movie in movies] == ["tt0133093", "tt0110912"]
+
+
+def test_complete_but_invalid_json_is_not_repaired():
+    # Скобки закрыты и ответ не оборван - чинить нечего, это ошибка модели
+    with pytest.raises(ValueError):
+        extract_json('{"title": "Матрица", "review": "Текст "в кавычках"."}', truncated=False)
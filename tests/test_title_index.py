@@ -0,0 +1,87 @@
+from title_index import TitleIndex, load_title_index, normalize, trigrams
+
+ENTRIES = [
+    ("tt0133093", "The Matrix", 1999, 2000000),
+    ("tt0133093", "Матрица", 1999, 2000000),
+    ("tt0234215", "The Matrix Reloaded", 2003, 600000),
+    ("tt0087182", "Dune", 1984, 150000),
+    ("tt1160419", "Dune", 2021, 900000),
+    ("tt1049413", "Up", 2009, 1100000),
+    ("tt0114709", "Toy Story", 1995, 1000000),
+    ("tt0114709", "История игрушек", 1995, 1000000),
+]
+
+
+def make_index(tmp_path, entries=ENTRIES):
+    index = TitleIndex(str(tmp_path / "titles.sqlite3"))
+    index.rebuild(entries)
+    return index
+
+
+def test_normalize_transliterates_and_strips_punctuation():
+    assert normalize("Матрица") == "matritsa"
+    assert normalize("  Ёлки-палки!  ") == "elki palki"
+    assert normalize("WALL·E") == "wall e"
+    assert trigrams("up") == {"  u", " up", "up "}
+
+
+def test_exact_title_scores_above_partial_match(tmp_path):
+    index = make_index(tmp_path)
+
+    found = index.search("The Matrix")
+    assert [movie["imdb_id"] for movie in found[:2]] == ["tt0133093", "tt0234215"]
+    assert found[0]["score"] > found[1]["score"]
+    # Опечатка все равно находит фильм по общим триграммам
+    assert index.search("The Matirx")[0]["imdb_id"] == "tt0133093"
+    index.close()
+
+
+def test_transliterated_query_finds_localized_title(tmp_path):
+    index = make_index(tmp_path)
+
+    for query in ("Матрица", "Matritsa", "матрица"):
+        found = index.search(query)
+        assert found[0]["imdb_id"] == "tt0133093"
+        assert found[0]["title"] == "Матрица"
+    assert index.search("istoriya igrushek")[0]["imdb_id"] == "tt0114709"
+    # У фильма несколько названий, но в выдаче он один раз
+    assert [movie["imdb_id"] for movie in index.search("Toy Story")].count("tt0114709") == 1
+    index.close()
+
+
+def test_year_breaks_ties_between_same_titles(tmp_path):
+    index = make_index(tmp_path)
+
+    # Без года выше более популярный фильм, с годом - совпавший по году
+    assert index.search("Dune")[0]["imdb_id"] == "tt1160419"
+    assert index.search("Dune", year=1984)[0]["imdb_id"] == "tt0087182"
+    assert index.search("Dune", year=1985)[0]["imdb_id"] == "tt0087182"
+    index.close()
+
+
+def test_short_and_empty_queries(tmp_path):
+    index = make_index(tmp_path)
+
+    # Запрос короче триграммы дополняется пробелами и все равно ищется
+    assert index.search("Up")[0]["imdb_id"] == "tt1049413"
+    assert index.search("!!!") == []
+    assert index.search("") == []
+    # Ни одной известной триграммы - пустой ответ, а не случайные фильмы
+    assert index.search("qzx") == []
+    index.close()
+
+
+def test_rebuild_replaces_entries(tmp_path):
+    index = make_index(tmp_path)
+    assert len(index) == len(ENTRIES)
+
+    index.rebuild([("tt1049413", "Up", 2009, 1), ("tt1049413", "UP!", 2009, 1), ("tt0000001", "...", 2000, 1)])
+    # Дубликаты после нормализации и пустые названия отбрасываются
+    assert len(index) == 1
+    assert index.search("The Matrix") == []
+    index.close()
+
+    assert load_title_index(str(tmp_path / "missing.sqlite3")) is None
+    reopened = load_title_index(str(tmp_path / "titles.sqlite3"))
+    assert reopened.search("Up")[0]["imdb_id"] == "tt1049413"
+    reopened.close()
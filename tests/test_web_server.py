@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from web_server import HEALTH_PATH, METRICS_PATH, SECRET_HEADER, WEBHOOK_PATH, BotWebServer
+
+SECRET = "s3cret"
+UPDATE = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "/start"}}
+
+
+class FakeDispatcher:
+    """Вместо aiogram: запоминает апдейты и ждет сигнала, чтобы завершить обработку."""
+
+    def __init__(self):
+        self.updates = []
+        self.release = asyncio.Event()
+
+    async def feed_raw_update(self, bot, update: dict):
+        self.updates.append(update)
+        await self.release.wait()
+
+
+def run_with_client(scenario, **server_options):
+    async def run():
+        dispatcher = FakeDispatcher()
+        server = BotWebServer(dispatcher=dispatcher, secret_token=SECRET, **server_options)
+        async with TestClient(TestServer(server.build_app())) as client:
+            await scenario(client, server, dispatcher)
+        dispatcher.release.set()
+        await server.close()
+
+    asyncio.run(run())
+
+
+def test_good_secret_is_acknowledged_before_handler_finishes():
+    async def scenario(client, server, dispatcher):
+        response = await client.post(WEBHOOK_PATH, json=UPDATE, headers={SECRET_HEADER: SECRET})
+        assert response.status == 200
+        await asyncio.sleep(0)
+        # Ответ уже ушел, а обработчик все еще ждет
+        assert dispatcher.updates == [UPDATE]
+        assert len(server._tasks) == 1
+        dispatcher.release.set()
+        await asyncio.wait(server._tasks)
+        assert server.stats["handled"] == 1
+
+    run_with_client(scenario)
+
+
+@pytest.mark.parametrize("header", [None, "wrong", "секрет"])
+def test_bad_secret_is_rejected(header):
+    async def scenario(client, server, dispatcher):
+        headers = {SECRET_HEADER: header} if header is not None else {}
+        response = await client.post(WEBHOOK_PATH, json=UPDATE, headers=headers)
+        assert response.status == 401
+        assert dispatcher.updates == []
+        assert server.stats["rejected"] == 1
+
+    run_with_client(scenario)
+
+
+def test_pending_updates_are_bounded():
+    async def scenario(client, server, dispatcher):
+        for _ in range(2):
+            response = await client.post(WEBHOOK_PATH, json=UPDATE, headers={SECRET_HEADER: SECRET})
+            assert response.status == 200
+        response = await client.post(WEBHOOK_PATH, json=UPDATE, headers={SECRET_HEADER: SECRET})
+        assert response.status == 503
+        assert server.stats["overloaded"] == 1
+
+    run_with_client(scenario, max_pending=2)
+
+
+def test_health_and_metrics_are_not_on_webhook_listener():
+    async def scenario(client, server, dispatcher):
+        for path in (HEALTH_PATH, METRICS_PATH):
+            response = await client.get(path)
+            assert response.status == 404
+
+    run_with_client(scenario)
+
+
+def test_health_and_metrics():
+    async def run():
+        server = BotWebServer(lambda: {"status": "ok"}, metrics=lambda: "cinemania_up 1\n")
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.get(HEALTH_PATH)
+            assert response.status == 200
+            assert (await response.json())["status"] == "ok"
+            response = await client.get(METRICS_PATH)
+            assert await response.text() == "cinemania_up 1\n"
+            response = await client.post(WEBHOOK_PATH, json=UPDATE)
+            assert response.status in (404, 405)
+
+    asyncio.run(run())
+
+
+def test_webhook_requires_secret():
+    with pytest.raises(ValueError):
+        BotWebServer(lambda: {}, dispatcher=FakeDispatcher(), secret_token=None)
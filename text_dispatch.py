@@ -0,0 +1,34 @@
+from typing import Awaitable, Callable, Dict
+
+from aiogram import F, Router, types
+from aiogram.fsm.context import FSMContext
+
+ButtonHandler = Callable[[types.Message, FSMContext], Awaitable]
+
+
+class ButtonDispatcher:
+    """Таблица "точный текст кнопки -> обработчик".
+
+    В роутере регистрируется один обработчик с фильтром по словарю, поэтому
+    поиск кнопки - одно обращение к хэш-таблице, сколько бы кнопок ни было
+    в меню. Обработчики кнопок принимают ``(message, state)``.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, ButtonHandler] = {}
+
+    def button(self, *texts: str):
+        def decorator(handler: ButtonHandler) -> ButtonHandler:
+            for text in texts:
+                if text in self.handlers:
+                    raise ValueError(f"Кнопка уже зарегистрирована: {text}")
+                self.handlers[text] = handler
+            return handler
+        return decorator
+
+    def attach(self, router: Router):
+        # Фильтр ссылается на сам словарь: кнопки, добавленные позже, тоже учитываются
+        router.message.register(self.dispatch, F.text.in_(self.handlers))
+
+    async def dispatch(self, message: types.Message, state: FSMContext):
+        return await self.handlers[message.text](message, state)
@@ -0,0 +1,188 @@
+"""Нечеткий поиск IMDB ID по названию фильма (оригинальному или локализованному).
+
+Сборка индекса (однократно, из выгрузок IMDb):
+
+    python title_index.py title.basics.tsv.gz title.akas.tsv.gz \
+        --ratings title.ratings.tsv.gz -o title_index.sqlite3
+
+Названия нормализуются с транслитерацией кириллицы, поэтому "Матрица",
+"Matritsa" и "The Matrix" (если локализованное название есть в akas)
+сводятся к сравнимым строкам. Поиск идет по триграммам.
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import sqlite3
+from typing import Iterable, List, Optional, Set
+
+from catalog import read_tsv
+
+logger = logging.getLogger(__name__)
+
+TITLE_INDEX_FILE = "title_index.sqlite3"
+
+# Регионы, локализованные названия которых попадают в индекс
+AKA_REGIONS = {"RU", "SU", "UA", "BY", "KZ", "XWW", "US", "GB"}
+
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "і": "i", "ї": "i", "є": "e", "ў": "u",
+})
+NON_WORD = re.compile(r"[\W_]+")
+
+# Из N редчайших триграмм запроса набираются кандидаты - частые триграммы
+# (" th", "the") почти ничего не говорят о фильме, но дают огромные списки
+RARE_GRAMS = 12
+MAX_CANDIDATES = 300
+
+
+def normalize(title: str) -> str:
+    text = title.casefold().translate(TRANSLIT)
+    return NON_WORD.sub(" ", text).strip()
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Триграммный индекс названий на SQLite.
+
+    ``search(title, year)`` возвращает кандидатов, отсортированных по
+    сходству названия (коэффициент Дайса по триграммам) с поправками на
+    совпадение года и популярность фильма.
+    """
+
+    def __init__(self, path: str = TITLE_INDEX_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS titles ("
+            " id INTEGER PRIMARY KEY,"
+            " imdb_id TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " norm TEXT NOT NULL,"
+            " year INTEGER,"
+            " votes INTEGER NOT NULL DEFAULT 0);"
+            "CREATE TABLE IF NOT EXISTS grams ("
+            " gram TEXT NOT NULL,"
+            " title_id INTEGER NOT NULL,"
+            " PRIMARY KEY (gram, title_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS gram_df (gram TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;"
+        )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM titles").fetchone()[0]
+
+    def rebuild(self, entries: Iterable[tuple]):
+        """Заполняет индекс заново из ``(imdb_id, title, year, votes)``."""
+        with self._conn:
+            self._conn.executescript("DELETE FROM grams; DELETE FROM gram_df; DELETE FROM titles;")
+            seen = set()
+            for imdb_id, title, year, votes in entries:
+                norm = normalize(title)
+                if not norm or (imdb_id, norm) in seen:
+                    continue
+                seen.add((imdb_id, norm))
+                title_id = self._conn.execute(
+                    "INSERT INTO titles (imdb_id, title, norm, year, votes) VALUES (?, ?, ?, ?, ?)",
+                    (imdb_id, title, norm, year, votes)
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO grams (gram, title_id) VALUES (?, ?)",
+                    ((gram, title_id) for gram in trigrams(norm))
+                )
+            self._conn.execute(
+                "INSERT INTO gram_df (gram, df) SELECT gram, COUNT(*) FROM grams GROUP BY gram"
+            )
+
+    def search(self, title: str, year: Optional[int] = None, limit: int = 5) -> List[dict]:
+        norm = normalize(title)
+        if not norm:
+            return []
+        query_grams = trigrams(norm)
+        placeholders = ",".join("?" * len(query_grams))
+        rare = [
+            row[0] for row in self._conn.execute(
+                f"SELECT gram FROM gram_df WHERE gram IN ({placeholders}) ORDER BY df LIMIT ?",
+                (*query_grams, RARE_GRAMS)
+            )
+        ]
+        if not rare:
+            return []
+
+        rows = self._conn.execute(
+            f"SELECT t.imdb_id, t.title, t.norm, t.year, t.votes FROM titles t JOIN ("
+            f" SELECT title_id, COUNT(*) AS hits FROM grams WHERE gram IN ({','.join('?' * len(rare))})"
+            f" GROUP BY title_id ORDER BY hits DESC LIMIT ?) c ON c.title_id = t.id",
+            (*rare, MAX_CANDIDATES)
+        ).fetchall()
+
+        best = {}
+        for imdb_id, found_title, found_norm, found_year, votes in rows:
+            found_grams = trigrams(found_norm)
+            score = 2 * len(query_grams & found_grams) / (len(query_grams) + len(found_grams))
+            if year and found_year:
+                score += 0.15 if found_year == year else 0.05 if abs(found_year - year) == 1 else 0
+            score += min(math.log10(votes + 1) / 100, 0.06)
+            # Одному фильму соответствуют несколько названий - оставляем лучшее
+            if imdb_id not in best or score > best[imdb_id]["score"]:
+                best[imdb_id] = {"imdb_id": imdb_id, "title": found_title, "year": found_year, "score": round(score, 3)}
+        return sorted(best.values(), key=lambda m: m["score"], reverse=True)[:limit]
+
+    def close(self):
+        self._conn.close()
+
+
+def load_title_index(path: str) -> Optional[TitleIndex]:
+    """Индекс, если файл есть, иначе ``None`` (поиск по названию тогда идет через OMDb)."""
+    if not os.path.exists(path):
+        return None
+    return TitleIndex(path)
+
+
+def read_entries(basics_path: str, akas_path: Optional[str], ratings_path: Optional[str], min_votes: int):
+    votes = {}
+    if ratings_path:
+        for row in read_tsv(ratings_path):
+            count = int(row["numVotes"])
+            if count >= min_votes:
+                votes[row["tconst"]] = count
+
+    movies = {}
+    for row in read_tsv(basics_path):
+        if row["titleType"] != "movie" or row["isAdult"] == "1":
+            continue
+        if ratings_path and row["tconst"] not in votes:
+            continue
+        year = int(row["startYear"]) if row["startYear"].isdigit() else None
+        movies[row["tconst"]] = year
+        yield row["tconst"], row["primaryTitle"], year, votes.get(row["tconst"], 0)
+        if row["originalTitle"] != row["primaryTitle"]:
+            yield row["tconst"], row["originalTitle"], year, votes.get(row["tconst"], 0)
+
+    if akas_path:
+        for row in read_tsv(akas_path):
+            if row["titleId"] in movies and (row["region"] in AKA_REGIONS or row["language"] == "ru"):
+                yield row["titleId"], row["title"], movies[row["titleId"]], votes.get(row["titleId"], 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Сборка индекса названий фильмов из выгрузок IMDb")
+    parser.add_argument("basics", help="title.basics.tsv(.gz)")
+    parser.add_argument("akas", nargs="?", help="title.akas.tsv(.gz) - локализованные названия")
+    parser.add_argument("--ratings", help="title.ratings.tsv(.gz) - для отбора и ранжирования по популярности")
+    parser.add_argument("--min-votes", type=int, default=1000)
+    parser.add_argument("-o", "--output", default=TITLE_INDEX_FILE)
+    args = parser.parse_args()
+    index = TitleIndex(args.output)
+    index.rebuild(read_entries(args.basics, args.akas, args.ratings, args.min_votes))
+    print(f"Индекс названий: {len(index)} названий -> {args.output}")
+    index.close()
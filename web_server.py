@@ -0,0 +1,122 @@
+import asyncio
+import hmac
+import logging
+from typing import Callable, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhook"
+HEALTH_PATH = "/health"
+METRICS_PATH = "/metrics"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class BotWebServer:
+    """HTTP-сервер бота на aiohttp: вебхуки Telegram, health-check и метрики.
+
+    Каждый адрес включается своим аргументом: ``dispatcher`` - вебхук,
+    ``health`` - ``/health``, ``metrics`` - ``/metrics``. Вебхук и служебные
+    адреса поднимаются разными экземплярами: вебхук слушает публичный
+    адрес, а состояние и метрики - только локальный.
+
+    Вебхук проверяет секретный токен (без него сервер с ``dispatcher`` не
+    создается), сразу отвечает 200 и обрабатывает апдейт в фоне; одновременно
+    обрабатывается не больше ``concurrency`` апдейтов, а принятых и еще не
+    обработанных - не больше ``max_pending``: сверх этого вебхук отвечает 503,
+    и Telegram доставит апдейт повторно.
+    """
+
+    def __init__(
+        self,
+        health: Optional[Callable[[], dict]] = None,
+        metrics: Optional[Callable[[], str]] = None,
+        dispatcher: Optional[Dispatcher] = None,
+        bot: Optional[Bot] = None,
+        webhook_path: str = WEBHOOK_PATH,
+        secret_token: Optional[str] = None,
+        concurrency: int = 16,
+        max_pending: int = 256,
+    ):
+        if dispatcher is not None and not secret_token:
+            raise ValueError("Вебхук без секретного токена принимал бы апдейты от кого угодно")
+        self.health = health
+        self.metrics = metrics
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self._tasks: set = set()
+        self._runner: Optional[web.AppRunner] = None
+        self.stats = {"received": 0, "rejected": 0, "overloaded": 0, "handled": 0, "failed": 0}
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        if self.health is not None:
+            app.router.add_get(HEALTH_PATH, self.handle_health)
+        if self.metrics is not None:
+            app.router.add_get(METRICS_PATH, self.handle_metrics)
+        if self.dispatcher is not None:
+            app.router.add_post(self.webhook_path, self.handle_update)
+        return app
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"HTTP-сервер запущен на {host}:{port}")
+
+    async def close(self, timeout: float = 10):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        # Даем уже принятым апдейтам завершиться
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+    def webhook_status(self) -> dict:
+        return {**self.stats, "pending": len(self._tasks)}
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.health())
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics(), content_type="text/plain", charset="utf-8")
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        # Сравниваем байты: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(received.encode("utf-8"), self.secret_token.encode("utf-8")):
+            self.stats["rejected"] += 1
+            logger.warning("Вебхук: неверный секретный токен")
+            return web.Response(status=401)
+
+        if len(self._tasks) >= self.max_pending:
+            self.stats["overloaded"] += 1
+            logger.warning(f"Вебхук: в обработке уже {len(self._tasks)} апдейтов, просим повторить позже")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        try:
+            update = await request.json()
+        except ValueError:
+            self.stats["rejected"] += 1
+            return web.Response(status=400)
+
+        self.stats["received"] += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update: dict):
+        async with self._semaphore:
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update)
+                self.stats["handled"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Вебхук: ошибка обработки апдейта {update.get('update_id')}: {str(e)}")